@@ -2,9 +2,9 @@ from flask import Flask, request, make_response
 from config import Config
 from flask_cors import CORS
 import logging
-from logging.config import dictConfig
+from app.log import setup_logging
 import os
-from .extensions import scheduler, db
+from .extensions import db
 from flask_sse import sse
 from celery import Celery, Task
 from app.models.test import Test
@@ -29,9 +29,13 @@ def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
 
+    from app.main.storage import validate_storage_backends
+    validate_storage_backends(app.config['STORAGE_BACKENDS'])
+
     if not os.path.exists((app.config['LOGS_DIR'])):
         os.mkdir((app.config['LOGS_DIR']))
 
+    log_formatter = 'json' if app.config['LOG_FORMAT'] == 'json' else 'default'
     logger_config = {
         'version': 1,
         'disable_existing_loggers': False,
@@ -40,24 +44,23 @@ def create_app(config_class=Config):
                 'format': '{levelname} {asctime} | {pathname}.{funcName}(), Ln {lineno}: {message}',
                 'style': '{',
             },
+            'json': {
+                '()': 'app.log.JsonFormatter',
+            },
         },
         'handlers': {
             'default': {
                 'level': 'INFO',
-                'class': 'logging.handlers.RotatingFileHandler',
+                'class': 'logging.handlers.WatchedFileHandler',
                 'filename': os.path.join(app.config['LOGS_DIR'], 'info.log'),
-                'formatter': 'default',
-                'backupCount': 10,
-                'maxBytes': 1024 * 1024 * 5,
+                'formatter': log_formatter,
                 'delay': True,
             },
             'debug': {
                 'level': 'DEBUG',
-                'class': 'logging.handlers.RotatingFileHandler',
+                'class': 'logging.handlers.WatchedFileHandler',
                 'filename': os.path.join(app.config['LOGS_DIR'], 'debug.log'),
-                'formatter': 'default',
-                'backupCount': 10,
-                'maxBytes': 1024 * 1024 * 5,
+                'formatter': log_formatter,
                 'delay': True,
             },
         },
@@ -75,13 +78,17 @@ def create_app(config_class=Config):
         }
     }
 
+    if app.config['LOG_ROTATE']:
+        for handler in logger_config['handlers'].values():
+            handler.update({'class': 'logging.handlers.RotatingFileHandler', 'backupCount': 10, 'maxBytes': 1024 * 1024 * 5})
+
     if app.config['DEBUG']:
         if app.config['MAIN_HOST']:
-            dictConfig(logger_config)
+            setup_logging(logger_config)
         else:
             app.logger.setLevel(logging.DEBUG)
     else:
-        dictConfig(logger_config)
+        setup_logging(logger_config)
 
     CORS(app)
     cors = CORS(app, resources={r"/api/*": {"origins": "*"}, r"/stream/*": {"origins": "*"}})
@@ -92,22 +99,30 @@ def create_app(config_class=Config):
         db.init_app(app)
         migrate = Migrate(app, db)
 
-        # scheduler
-        # scheduler.init_app(app)
-        # from .main import tasks
-        # scheduler.start()
+        # scheduler runs in a process of its own (`flask scheduler`), not once per web worker
 
         # sse
+        from app.main.result_cache import get_cached_result, is_running, cache_result
+
         @sse.before_request
         def after_done_access():
-            try:
-                test = Test.query.filter_by(id=request.args.get("channel")).first()
-                if test:
-                    response = make_response(f'data: {test.content}\n\n')
-                    response.headers['Content-Type'] = 'text/event-stream'
-                    return response
-            except DataError:
-                pass
+            channel = request.args.get("channel")
+
+            # finished tests are served from redis, database is hit only on cache miss
+            content = get_cached_result(channel)
+            if content is None and not is_running(channel):
+                try:
+                    test = Test.query.filter_by(id=channel).first()
+                    if test:
+                        content = test.content
+                        cache_result(channel, content)
+                except DataError:
+                    db.session.rollback()
+
+            if content is not None:
+                response = make_response(f'data: {content}\n\n')
+                response.headers['Content-Type'] = 'text/event-stream'
+                return response
         app.register_blueprint(sse, url_prefix='/stream')
 
         # celery
@@ -118,4 +133,8 @@ def create_app(config_class=Config):
     from app.main import bp as main_bp
     app.register_blueprint(main_bp)
 
+    # profiling
+    from app.main import profiling
+    profiling.init_app(app, main_bp.name)
+
     return app
@@ -0,0 +1,293 @@
+'''
+asyncio sub-host agent
+
+Serves the same `/api/upload-url`, `/api/upload-tebi`, `/api/upload-storage`,
+`/api/upload-file`, `/api/cancel`, `/api/profiles/<id>` and
+`/api/payload/<size>` contracts as the flask app, but every request runs on
+one event loop and shares one `ClientSession`. `/api/control` is a websocket
+carrying the same commands with progress events.
+
+usage:
+    python -m app.agent --host 0.0.0.0 --port 5000
+'''
+from aiohttp import web, ClientSession, TCPConnector, WSMsgType
+from app import create_app
+from app.main.payload import iter_payload, get_payload_etag
+from app.main import cancellation, profiling
+from app.main.resources import ResourceMeter
+from app.main.routes import (
+    api_upload_url_endpoint, api_upload_tebi_endpoint, api_upload_file_endpoint, api_control_endpoint, api_clock_endpoint,
+    api_cancel_endpoint, api_upload_storage_endpoint, api_profiles_endpoint,
+    parse_upload_url_request, parse_upload_tebi_request, measure_upload_url, measure_upload_tebi,
+    format_download_time, CHUNK_SIZE,
+)
+import argparse
+import asyncio
+import tempfile
+import time
+
+
+routes = web.RouteTableDef()
+
+
+@web.middleware
+async def flask_context_middleware(request: web.Request, handler):
+    '''handlers use `current_app` for config and logger, like flask views'''
+    with request.app['flask_app'].app_context():
+        return await handler(request)
+
+
+@web.middleware
+async def ttfb_middleware(request: web.Request, handler):
+    start_time = time.time()
+    response = await handler(request)
+    response.headers['X-TTFB'] = str(time.time() - start_time)
+    return response
+
+
+@web.middleware
+async def profiling_middleware(request: web.Request, handler):
+    '''same as `profiling.profile_view` of flask views'''
+    if not profiling.is_requested(request.headers):
+        return await handler(request)
+    if profiling.is_busy():
+        return web.json_response({'error': str(profiling.ProfilerBusy())}, status=409)
+
+    async with profiling.ProfileSession(request.path) as session:
+        response = await handler(request)
+    response.headers[profiling.PROFILE_ID_HEADER] = session.id
+    return response
+
+
+async def read_json(request: web.Request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+async def command_upload_url(app: web.Application, json: dict, on_progress=None):
+    '''
+    returns tuple `status`, `json`
+    '''
+    params, error = parse_upload_url_request(json)
+    if error:
+        return 400, {'error': error}
+
+    async with app['limiter']:
+        return 200, await measure_upload_url(**params, session=app['session'], on_progress=on_progress)
+
+
+async def command_upload_tebi(app: web.Application, json: dict, on_progress=None):
+    '''
+    returns tuple `status`, `json`
+    '''
+    params, error = parse_upload_tebi_request(json)
+    if error:
+        return 400, {'error': error}
+
+    if on_progress is not None:
+        loop = asyncio.get_running_loop()
+        loop_on_progress = on_progress
+
+        def on_progress(downloaded_bytes, elapsed_time):
+            loop.call_soon_threadsafe(loop_on_progress, downloaded_bytes, elapsed_time)
+
+    # boto3 is blocking, so tebi transfers run in threads
+    async with app['limiter']:
+        return 200, await asyncio.to_thread(profiling.in_thread(measure_upload_tebi), **params, on_progress=on_progress)
+
+
+commands = {
+    api_upload_url_endpoint: command_upload_url,
+    api_upload_tebi_endpoint: command_upload_tebi,
+    api_upload_storage_endpoint: command_upload_tebi,
+}
+
+
+@routes.post(api_upload_url_endpoint)
+@routes.post(api_upload_tebi_endpoint)
+@routes.post(api_upload_storage_endpoint)
+async def upload_command(request: web.Request):
+    json = await read_json(request)
+    if json is None:
+        return web.json_response({'error': 'Request body must be json'}, status=400)
+
+    status, response_json = await commands[request.path](request.app, json)
+    return web.json_response(response_json, status=status)
+
+
+@routes.post(api_cancel_endpoint)
+async def cancel(request: web.Request):
+    json = await read_json(request)
+    if not json or not json.get('test_id'):
+        return web.json_response({'error': 'No test_id provided'}, status=400)
+
+    return web.json_response({'test_id': json['test_id'], 'cancelled': cancellation.cancel(json['test_id'])})
+
+
+@routes.get(api_control_endpoint)
+async def control(request: web.Request):
+    '''
+    websocket control channel, see `app.main.control.ControlChannel` for messages
+    '''
+    ws = web.WebSocketResponse(heartbeat=request.app['flask_app'].config['CONTROL_HEARTBEAT'])
+    await ws.prepare(request)
+
+    running = set()
+    async for msg in ws:
+        if msg.type != WSMsgType.TEXT:
+            continue
+
+        data = msg.json()
+        if data.get('type') != 'command':
+            continue
+
+        task = asyncio.create_task(run_control_command(request.app, ws, data))
+        running.add(task)
+        task.add_done_callback(running.discard)
+
+    # main host is gone, nobody waits for results
+    for task in running:
+        task.cancel()
+
+    return ws
+
+
+async def run_control_command(app: web.Application, ws: web.WebSocketResponse, data: dict):
+    command_id = data.get('id')
+    progress_interval = app['flask_app'].config['CONTROL_PROGRESS_INTERVAL']
+    last_progress = 0
+    sending = set()
+
+    def on_progress(downloaded_bytes, elapsed_time):
+        nonlocal last_progress
+        if elapsed_time - last_progress < progress_interval or ws.closed:
+            return
+        last_progress = elapsed_time
+
+        task = asyncio.create_task(ws.send_json({
+            'type': 'progress',
+            'id': command_id,
+            'bytes': downloaded_bytes,
+            'elapsed': elapsed_time,
+        }))
+        sending.add(task)
+        task.add_done_callback(sending.discard)
+
+    command = commands.get(data.get('endpoint'))
+    if command is None:
+        status, response_json = 404, {'error': f'Unknown command \'{data.get("endpoint")}\''}
+    else:
+        try:
+            status, response_json = await command(app, data.get('json') or {}, on_progress)
+        except Exception as e:
+            app['flask_app'].logger.error(e)
+            status, response_json = 500, {'error': str(e)}
+
+    # result goes after progress of the command
+    await asyncio.gather(*sending, return_exceptions=True)
+    if not ws.closed:
+        await ws.send_json({'type': 'result', 'id': command_id, 'status': status, 'json': response_json})
+
+
+@routes.post(api_upload_file_endpoint)
+async def upload_file(request: web.Request):
+    reader = await request.multipart()
+
+    x1 = time.monotonic()
+    async with request.app['limiter']:
+        with ResourceMeter() as meter:
+            while True:
+                field = await reader.next()
+                if field is None:
+                    return web.json_response({'error': 'No file provided'}, status=400)
+                if field.name == 'file':
+                    break
+
+            with tempfile.NamedTemporaryFile() as temp:
+                while True:
+                    chunk = await field.read_chunk(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    temp.write(chunk)
+
+                # here can be saving file
+
+    return web.json_response(meter.attach({
+        'vps_name': request.app['flask_app'].config['HOST_NAME'],
+        'download_time': format_download_time(time.monotonic() - x1),
+    }))
+
+
+@routes.get(f'{api_profiles_endpoint}/{{profile_id}}')
+async def profile(request: web.Request):
+    summary = profiling.load_summary(request.match_info['profile_id'])
+    if summary is None:
+        return web.json_response({'error': f'Profile \'{request.match_info["profile_id"]}\' not found'}, status=404)
+    return web.json_response(summary)
+
+
+@routes.get(api_clock_endpoint)
+async def clock(request: web.Request):
+    return web.json_response({
+        'vps_name': request.app['flask_app'].config['HOST_NAME'],
+        'time': time.time(),
+    })
+
+
+@routes.get('/api/payload/{size:\\d+}')
+async def payload(request: web.Request):
+    size = int(request.match_info['size'])
+    max_size = request.app['flask_app'].config['PAYLOAD_MAX_SIZE']
+    if size < 1 or size > max_size:
+        return web.json_response({'error': f'size must be greater than 0 and not greater than {max_size}'}, status=400)
+
+    response = web.StreamResponse(headers={
+        'Content-Type': 'application/octet-stream',
+        'ETag': get_payload_etag(size),
+        'Cache-Control': 'no-store, no-transform',
+    })
+    response.content_length = size
+    await response.prepare(request)
+
+    for block in iter_payload(size):
+        await response.write(block)
+
+    await response.write_eof()
+    return response
+
+
+async def client_session_ctx(app: web.Application):
+    max_concurrency = app['flask_app'].config['AGENT_MAX_CONCURRENCY']
+    app['limiter'] = asyncio.Semaphore(max_concurrency)
+    app['session'] = ClientSession(connector=TCPConnector(limit=max_concurrency))
+    yield
+    await app['session'].close()
+
+
+def create_agent(flask_app=None) -> web.Application:
+    if flask_app is None:
+        flask_app = create_app()
+
+    app = web.Application(
+        middlewares=[ttfb_middleware, flask_context_middleware, profiling_middleware],
+        client_max_size=0,
+    )
+    app['flask_app'] = flask_app
+    app.cleanup_ctx.append(client_session_ctx)
+    app.add_routes(routes)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description='asyncio sub-host agent')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    args = parser.parse_args()
+
+    web.run_app(create_agent(), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
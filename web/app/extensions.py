@@ -1,5 +1,17 @@
+from flask import current_app
 from flask_apscheduler import APScheduler
 from flask_sqlalchemy import SQLAlchemy
+import redis
 
 scheduler = APScheduler()
 db = SQLAlchemy()
+
+_redis_clients = {}
+
+
+def get_redis() -> redis.Redis:
+    '''shared redis client for `REDIS_URL`, one connection pool per process'''
+    redis_url = current_app.config['REDIS_URL']
+    if redis_url not in _redis_clients:
+        _redis_clients[redis_url] = redis.Redis.from_url(redis_url)
+    return _redis_clients[redis_url]
@@ -0,0 +1,100 @@
+from logging.config import dictConfig
+from logging.handlers import QueueHandler, QueueListener
+import atexit
+import logging
+import os
+import queue
+import orjson
+
+
+class JsonFormatter(logging.Formatter):
+    '''one json object per line, enabled by `LOG_FORMAT=json`'''
+
+    def format(self, record: logging.LogRecord) -> str:
+        output = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'process': record.process,
+            'location': f'{record.pathname}.{record.funcName}():{record.lineno}',
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            output['exc_info'] = self.formatException(record.exc_info)
+        return orjson.dumps(output, default=str).decode()
+
+
+class LazyQueueHandler(QueueHandler):
+    '''
+    enqueues records as they are, message is formatted by the listener thread,
+    so callers only pay for creating the record
+    '''
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+# one listener (single writer) per process
+_listener: QueueListener = None
+_queue_handler: LazyQueueHandler = None
+
+
+def setup_logging(logger_config: dict):
+    '''
+    applies `logger_config`, then moves handlers of its loggers behind one queue:
+    loggers only enqueue records and one listener thread writes them to files
+
+    handler of a non-root logger gets a filter by logger name,
+    so records are routed the same way as without the queue
+    '''
+    global _listener, _queue_handler
+
+    stop_logging()
+    dictConfig(logger_config)
+
+    _queue_handler = LazyQueueHandler(queue.SimpleQueue())
+
+    handlers = []
+    for name in logger_config.get('loggers', {}):
+        logger = logging.getLogger(name or None)
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+            if name:
+                handler.addFilter(logging.Filter(name))
+            handlers.append(handler)
+
+        if not name or not logger.propagate:
+            logger.addHandler(_queue_handler)
+
+    _listener = QueueListener(_queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def stop_logging():
+    '''writes out queued records and stops the listener'''
+    global _listener, _queue_handler
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    if _queue_handler is not None:
+        for logger in [logging.getLogger(), *logging.Logger.manager.loggerDict.values()]:
+            if isinstance(logger, logging.Logger):
+                logger.removeHandler(_queue_handler)
+        _queue_handler = None
+
+
+def _restart_in_child():
+    '''listener thread doesn't survive fork (celery prefork workers), child gets its own'''
+    global _listener
+
+    if _listener is None:
+        return
+
+    _queue_handler.queue = queue.SimpleQueue()
+    _listener = QueueListener(_queue_handler.queue, *_listener.handlers, respect_handler_level=True)
+    _listener.start()
+
+
+atexit.register(stop_logging)
+os.register_at_fork(after_in_child=_restart_in_child)
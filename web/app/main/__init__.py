@@ -1,5 +1,5 @@
 from flask import Blueprint
 
-bp = Blueprint('main', __name__)
+bp = Blueprint('main', __name__, cli_group=None)
 
-from app.main import routes
+from app.main import routes, commands
@@ -0,0 +1,407 @@
+from flask import current_app
+from app.extensions import db, get_redis
+from app.models.test import Test
+from app.main.persistence import LANDED_KEY
+from sqlalchemy import select
+import datetime
+import threading
+import numpy as np
+import orjson
+
+
+METRICS = ('latency', 'ttfb', 'time', 'throughput')
+# lower is better for every other metric
+HIGHER_IS_BETTER = ('throughput',)
+PERCENTILES = (50, 90, 95, 99)
+# id below any entry of redis stream
+EMPTY_STREAM_ID = b'0-0'
+
+
+class MeasurementStore:
+    '''
+    measurements of tests as numpy columns, one row per vps and storage of a test:
+        timestamp: float64 unix seconds of test
+        hour: uint8 hour of day of test (utc)
+        host: int32 index of `hosts`
+        storage: int16 index of `storages`
+        ok: bool
+        latency, ttfb, time: float64 ms, throughput: float64 mb/s (nan when not measured)
+
+    tests are parsed once, `sync()` loads only tests it hasn't seen: older than loaded range
+    or written since the last sync (`LANDED_KEY` tells which datetimes flushed batches had,
+    so tests written late by write-behind persistence are picked up as well)
+
+    results of queries are memoized until new tests are loaded
+    '''
+
+    def __init__(self) -> None:
+        self.hosts = []
+        self.storages = []
+        self.version = 0
+
+        self._host_codes = {}
+        self._storage_codes = {}
+        self._test_ids = set()
+        self._chunks = []
+        self._columns = None
+
+        self._synced = False
+        self._loaded_from = None
+        self._loaded_until = None
+        self._landed_id = None
+
+        self._memo = {}
+        self._lock = threading.Lock()
+
+    def sync(self, date_from=None):
+        '''loads tests since `date_from` (all when None) that aren't loaded yet'''
+        with self._lock:
+            landed_from = self._read_landed()
+
+            if not self._synced:
+                self._load(date_from)
+                self._loaded_from = date_from
+                self._synced = True
+                return
+
+            if self._loaded_from is not None and (date_from is None or date_from < self._loaded_from):
+                self._load(date_from, self._loaded_from)
+                self._loaded_from = date_from
+
+            since = self._loaded_until or self._loaded_from
+            if landed_from is not None and (since is None or landed_from < since):
+                since = landed_from
+            self._load(since)
+
+    def _read_landed(self):
+        '''returns the oldest datetime of tests written since the last call, None if nothing was written'''
+        redis = get_redis()
+        last_id = self._landed_id
+        entries = redis.xrange(LANDED_KEY, min=last_id or '-')
+        if last_id is None:
+            # stream is followed from here, when it is empty every entry added later is new
+            self._landed_id = entries[-1][0] if entries else EMPTY_STREAM_ID
+            return None
+        if entries:
+            self._landed_id = entries[-1][0]
+
+        # stream was trimmed past the last entry seen, anything loaded could be behind
+        if last_id != EMPTY_STREAM_ID and (not entries or entries[0][0] != last_id):
+            first = redis.xrange(LANDED_KEY, count=1)
+            if first and _stream_id(first[0][0]) > _stream_id(last_id):
+                return self._loaded_from or datetime.datetime.fromtimestamp(0, tz=datetime.timezone.utc)
+
+        landed = [
+            datetime.datetime.fromisoformat(fields[b'from'].decode())
+            for entry_id, fields in entries if entry_id != last_id
+        ]
+        return min(landed) if landed else None
+
+    def _load(self, date_from=None, date_to=None):
+        query = select(Test.id, Test.datetime, Test.content).order_by(Test.datetime)
+        if date_from is not None:
+            query = query.where(Test.datetime >= date_from)
+        if date_to is not None:
+            query = query.where(Test.datetime < date_to)
+
+        timestamps, hosts, storages, ok = [], [], [], []
+        metrics = {metric: [] for metric in METRICS}
+
+        result = db.session.execute(query.execution_options(yield_per=current_app.config['ANALYTICS_BATCH_SIZE']))
+        try:
+            for row in result:
+                test_id = str(row.id)
+                if test_id in self._test_ids:
+                    continue
+                self._test_ids.add(test_id)
+
+                if row.datetime is None:
+                    continue
+                test_datetime = row.datetime if row.datetime.tzinfo else row.datetime.replace(tzinfo=datetime.timezone.utc)
+                if self._loaded_until is None or test_datetime > self._loaded_until:
+                    self._loaded_until = test_datetime
+
+                content = orjson.loads(row.content) if isinstance(row.content, str) else row.content or {}
+                timestamp = test_datetime.timestamp()
+                for vps_name, vps_status in content.get('vps', {}).items():
+                    # every key except `ip` is a storage ('object', 'tebi' or other storage backend)
+                    for storage, measurement in vps_status.items():
+                        if storage == 'ip' or not measurement:
+                            continue
+
+                        timestamps.append(timestamp)
+                        hosts.append(self._get_code(self._host_codes, self.hosts, vps_name))
+                        storages.append(self._get_code(self._storage_codes, self.storages, storage))
+                        ok.append(bool(measurement.get('ok')))
+                        for metric in METRICS:
+                            metrics[metric].append(_to_float(measurement.get(metric)))
+        finally:
+            result.close()
+
+        if not timestamps:
+            return
+
+        timestamps = np.array(timestamps, dtype=np.float64)
+        self._chunks.append({
+            'timestamp': timestamps,
+            'hour': (timestamps // 3600 % 24).astype(np.uint8),
+            'host': np.array(hosts, dtype=np.int32),
+            'storage': np.array(storages, dtype=np.int16),
+            'ok': np.array(ok, dtype=bool),
+            **{metric: np.array(values, dtype=np.float64) for metric, values in metrics.items()},
+        })
+        self._columns = None
+        self._memo.clear()
+        self.version += 1
+
+    @staticmethod
+    def _get_code(codes: dict, names: list, name):
+        code = codes.get(name)
+        if code is None:
+            code = codes[name] = len(names)
+            names.append(name)
+        return code
+
+    def get_columns(self) -> dict:
+        '''columns of every loaded measurement, chunks are concatenated once per load'''
+        if self._columns is None:
+            if self._chunks:
+                self._chunks = [{name: np.concatenate([chunk[name] for chunk in self._chunks]) for name in self._chunks[0]}]
+                self._columns = self._chunks[0]
+            else:
+                self._columns = {
+                    'timestamp': np.empty(0, dtype=np.float64),
+                    'hour': np.empty(0, dtype=np.uint8),
+                    'host': np.empty(0, dtype=np.int32),
+                    'storage': np.empty(0, dtype=np.int16),
+                    'ok': np.empty(0, dtype=bool),
+                    **{metric: np.empty(0, dtype=np.float64) for metric in METRICS},
+                }
+        return self._columns
+
+    def get_mask(self, date_from=None, date_to=None, hosts=None, storage=None):
+        columns = self.get_columns()
+        mask = np.ones(len(columns['timestamp']), dtype=bool)
+        if date_from is not None:
+            mask &= columns['timestamp'] >= date_from.timestamp()
+        if date_to is not None:
+            mask &= columns['timestamp'] < date_to.timestamp()
+        if hosts:
+            mask &= np.isin(columns['host'], [self._host_codes[host] for host in hosts if host in self._host_codes])
+        if storage is not None:
+            mask &= columns['storage'] == self._storage_codes.get(storage, -1)
+        return mask
+
+    def analyze(self, date_from=None, date_to=None, hosts=None, storage=None, metric='time') -> dict:
+        '''
+        returns analytics of measurements in range (see `get_analytics`), memoized until new tests are loaded
+        '''
+        key = (date_from, date_to, tuple(sorted(hosts or ())), storage, metric)
+        with self._lock:
+            result = self._memo.get(key)
+            if result is None:
+                if len(self._memo) >= current_app.config['ANALYTICS_MEMO_SIZE']:
+                    self._memo.clear()
+                mask = self.get_mask(date_from, date_to, hosts, storage)
+                result = self._memo[key] = {
+                    'measurements': int(mask.sum()),
+                    'percentiles': get_percentiles(self.get_columns(), mask),
+                    'ranking': get_ranking(self.get_columns(), mask, self.hosts, metric),
+                    'correlation': get_correlation(self.get_columns(), mask, self.hosts),
+                    'heatmap': get_heatmap(self.get_columns(), mask, self.hosts, metric),
+                }
+            return result
+
+
+def _to_float(value):
+    try:
+        return float(value) if value is not None else np.nan
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _stream_id(entry_id) -> tuple:
+    milliseconds, _, sequence = entry_id.decode().partition('-')
+    return int(milliseconds), int(sequence or 0)
+
+
+def _round(value, digits=3):
+    '''json friendly value, nan becomes None'''
+    return None if np.isnan(value) else round(float(value), digits)
+
+
+def group_quantiles(codes, values, groups, quantiles) -> np.ndarray:
+    '''
+    returns array `groups` x `quantiles` (0..1) of `values` grouped by `codes` (0..groups-1),
+    linear interpolation between the closest ranks, nan for empty groups
+    '''
+    # sorted by value, then stable by code, much faster than lexsort,
+    # stable sort of 16 bit codes is a radix sort
+    order = np.argsort(values)
+    sort_codes = codes[order].astype(np.uint16) if groups <= 1 << 16 else codes[order]
+    order = order[np.argsort(sort_codes, kind='stable')]
+    codes, values = codes[order], values[order]
+
+    counts = np.bincount(codes, minlength=groups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    output = np.full((groups, len(quantiles)), np.nan)
+    present = counts > 0
+    for index, quantile in enumerate(quantiles):
+        position = (counts[present] - 1) * quantile
+        lower = np.floor(position).astype(np.int64)
+        upper = np.ceil(position).astype(np.int64)
+        lower_values = values[starts[present] + lower]
+        upper_values = values[starts[present] + upper]
+        output[present, index] = lower_values + (upper_values - lower_values) * (position - lower)
+    return output
+
+
+def get_percentiles(columns, mask) -> dict:
+    '''
+    {metric: {"count": int, "mean": float, "p50": float, "p90": float, "p95": float, "p99": float}}
+    of successful measurements
+    '''
+    output = {}
+    selected = mask & columns['ok']
+    for metric in METRICS:
+        values = columns[metric][selected & ~np.isnan(columns[metric])]
+        if not len(values):
+            output[metric] = {'count': 0}
+            continue
+
+        output[metric] = {
+            'count': int(len(values)),
+            'mean': _round(values.mean()),
+            **{f'p{percentile}': _round(value) for percentile, value in zip(PERCENTILES, np.percentile(values, PERCENTILES))},
+        }
+    return output
+
+
+def get_ranking(columns, mask, hosts: list, metric) -> list:
+    '''
+    vps ordered by median of `metric` (best first):
+        [{"vps": str, "measurements": int, "failure_rate": float, "median": float, "p95": float, "mean": float}]
+    '''
+    groups = len(hosts)
+    attempts = np.bincount(columns['host'][mask], minlength=groups)
+    failures = np.bincount(columns['host'][mask & ~columns['ok']], minlength=groups)
+
+    selected = mask & columns['ok'] & ~np.isnan(columns[metric])
+    codes, values = columns['host'][selected], columns[metric][selected]
+    counts = np.bincount(codes, minlength=groups)
+    sums = np.bincount(codes, weights=values, minlength=groups)
+    quantiles = group_quantiles(codes, values, groups, (0.5, 0.95))
+
+    ranked = np.flatnonzero(counts)
+    medians = quantiles[ranked, 0]
+    ranked = ranked[np.argsort(-medians if metric in HIGHER_IS_BETTER else medians, kind='stable')]
+
+    return [
+        {
+            'vps': hosts[code],
+            'measurements': int(attempts[code]),
+            'failure_rate': _round(failures[code] / attempts[code], 4),
+            'median': _round(quantiles[code, 0]),
+            'p95': _round(quantiles[code, 1]),
+            'mean': _round(sums[code] / counts[code]),
+        }
+        for code in ranked
+    ]
+
+
+def _pearson(x, y) -> float:
+    if len(x) < 2:
+        return np.nan
+    x, y = x - x.mean(), y - y.mean()
+    denominator = np.sqrt((x * x).sum() * (y * y).sum())
+    return (x * y).sum() / denominator if denominator else np.nan
+
+
+def _ranks(values) -> np.ndarray:
+    '''ranks of `values`, ties get the average of their ranks'''
+    order = np.argsort(values)
+    sorted_values = values[order]
+    boundaries = np.concatenate(([True], sorted_values[1:] != sorted_values[:-1]))
+    group = np.cumsum(boundaries) - 1
+    counts = np.bincount(group)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    ranks = np.empty(len(values))
+    ranks[order] = (starts + (counts - 1) / 2)[group]
+    return ranks
+
+
+def get_correlation(columns, mask, hosts: list) -> dict:
+    '''
+    correlation between latency and throughput of successful measurements:
+        {"measurements": int, "pearson": float, "spearman": float, "vps": {vps_name: pearson}}
+    '''
+    selected = mask & columns['ok'] & ~np.isnan(columns['latency']) & ~np.isnan(columns['throughput'])
+    x, y, codes = columns['latency'][selected], columns['throughput'][selected], columns['host'][selected]
+
+    # per vps pearson from grouped sums, one pass for every vps
+    groups = len(hosts)
+    n = np.bincount(codes, minlength=groups).astype(np.float64)
+    sum_x, sum_y = np.bincount(codes, x, groups), np.bincount(codes, y, groups)
+    sum_xx, sum_yy, sum_xy = np.bincount(codes, x * x, groups), np.bincount(codes, y * y, groups), np.bincount(codes, x * y, groups)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        covariance = n * sum_xy - sum_x * sum_y
+        denominator = np.sqrt((n * sum_xx - sum_x ** 2) * (n * sum_yy - sum_y ** 2))
+        per_vps = np.where((n > 1) & (denominator > 0), covariance / denominator, np.nan)
+
+    return {
+        'measurements': int(len(x)),
+        'pearson': _round(_pearson(x, y), 4),
+        'spearman': _round(_pearson(_ranks(x), _ranks(y)), 4) if len(x) > 1 else None,
+        'vps': {hosts[code]: _round(per_vps[code], 4) for code in np.flatnonzero(n > 1)},
+    }
+
+
+def get_heatmap(columns, mask, hosts: list, metric) -> dict:
+    '''
+    median of `metric` per vps and hour of day (utc):
+        {"vps": [str], "values": [[float or None] * 24] (row per vps), "counts": [[int] * 24]}
+    '''
+    selected = mask & columns['ok'] & ~np.isnan(columns[metric])
+    cells = columns['host'][selected].astype(np.int64) * 24 + columns['hour'][selected]
+
+    groups = len(hosts)
+    counts = np.bincount(cells, minlength=groups * 24).reshape(groups, 24)
+    medians = group_quantiles(cells, columns[metric][selected], groups * 24, (0.5,))[:, 0].reshape(groups, 24)
+
+    present = np.flatnonzero(counts.sum(axis=1))
+    return {
+        'vps': [hosts[code] for code in present],
+        'values': [[_round(value) for value in medians[code]] for code in present],
+        'counts': counts[present].tolist(),
+    }
+
+
+# one store per process, shared by requests and threads
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store() -> MeasurementStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = MeasurementStore()
+        return _store
+
+
+def get_analytics(date_from=None, date_to=None, hosts=None, storage=None, metric='time') -> dict:
+    '''
+    analytics of measurements of tests between `date_from` and `date_to`:
+        {
+            "measurements": int (vps and storage pairs in range, failed included),
+            "percentiles": {"latency": {"count": int, "mean": float, "p50": float, ...}, ...},
+            "ranking": [{"vps": str, "measurements": int, "failure_rate": float, "median": float, ...}],
+            "correlation": {"measurements": int, "pearson": float, "spearman": float, "vps": {vps_name: float}},
+            "heatmap": {"vps": [str], "values": [[float]], "counts": [[int]]}
+        }
+    `hosts` limits vps names, `metric` is ranked and mapped by `heatmap`
+    '''
+    store = get_store()
+    store.sync(date_from)
+    return store.analyze(date_from, date_to, hosts, storage, metric)
@@ -0,0 +1,159 @@
+from flask import current_app
+from contextlib import contextmanager
+from app.extensions import get_redis
+import asyncio
+import threading
+import time
+
+
+CANCEL_PREFIX = 'test_cancel:'
+
+# sub-host side: tasks running measurements of every test and recently cancelled tests of this process,
+# hosts with redis (`REDIS_URL`) also share cancels between processes through `CANCEL_PREFIX` keys
+_running = {}
+_cancelled = {}
+_checked = {}
+_lock = threading.Lock()
+_cancelled_ttl = 60 * 60
+
+
+class TestCancelled(Exception):
+    pass
+
+
+# Main host
+
+
+def request_cancel(channel):
+    get_redis().set(f'{CANCEL_PREFIX}{channel}', 1, ex=current_app.config['TEST_DEADLINE'] * 2)
+
+
+def is_cancel_requested(*channels):
+    channels = [channel for channel in channels if channel]
+    if not channels:
+        return False
+    return get_redis().exists(*(f'{CANCEL_PREFIX}{channel}' for channel in channels)) > 0
+
+
+async def run_with_deadline(coro, channels: list, deadline_at=None):
+    '''
+    runs `coro` until it finishes, `deadline_at` (unix timestamp) passes or cancel
+    of any of `channels` is requested
+
+    raises `asyncio.TimeoutError` or `TestCancelled`
+    '''
+    task = asyncio.ensure_future(coro)
+    cancelled = False
+
+    async def watch():
+        nonlocal cancelled
+        while not task.done():
+            if is_cancel_requested(*channels):
+                cancelled = True
+                task.cancel()
+                return
+            await asyncio.sleep(current_app.config['CANCEL_POLL_INTERVAL'])
+
+    watcher = asyncio.create_task(watch())
+    timeout = max(deadline_at - time.time(), 0) if deadline_at is not None else None
+    try:
+        return await asyncio.wait_for(task, timeout)
+    except asyncio.CancelledError:
+        if cancelled:
+            raise TestCancelled()
+        raise
+    finally:
+        watcher.cancel()
+
+
+# Sub-host
+
+
+@contextmanager
+def track(test_id):
+    '''registers current asyncio task as running measurement of `test_id`'''
+    if not test_id:
+        yield
+        return
+
+    entry = (asyncio.get_running_loop(), asyncio.current_task())
+    with _lock:
+        _running.setdefault(test_id, set()).add(entry)
+
+    # cancel may be received by another process of this host
+    watcher = asyncio.create_task(_watch_shared(test_id)) if _is_shared() else None
+    try:
+        yield
+    finally:
+        if watcher is not None:
+            watcher.cancel()
+        with _lock:
+            entries = _running.get(test_id)
+            if entries is not None:
+                entries.discard(entry)
+                if not entries:
+                    del _running[test_id]
+
+
+def cancel(test_id):
+    '''
+    cancels every running measurement of `test_id`, measurements in threads
+    stop at the next `is_cancelled` check
+
+    returns amount of cancelled tasks
+    '''
+    if _is_shared():
+        request_cancel(test_id)
+
+    now = time.monotonic()
+    with _lock:
+        for cancelled_id, cancelled_at in list(_cancelled.items()):
+            if now - cancelled_at > _cancelled_ttl:
+                del _cancelled[cancelled_id]
+        _cancelled[test_id] = now
+        entries = list(_running.pop(test_id, ()))
+
+    for loop, task in entries:
+        loop.call_soon_threadsafe(task.cancel)
+    return len(entries)
+
+
+def is_cancelled(test_id):
+    '''
+    checks cancels of this process, and on hosts with redis cancels received by other
+    processes, redis is asked at most once per `CANCEL_POLL_INTERVAL` for every test
+    '''
+    if not test_id:
+        return False
+
+    now = time.monotonic()
+    with _lock:
+        if test_id in _cancelled:
+            return True
+        if not _is_shared() or now - _checked.get(test_id, 0) < current_app.config['CANCEL_POLL_INTERVAL']:
+            return False
+        _checked[test_id] = now
+        for checked_id, checked_at in list(_checked.items()):
+            if now - checked_at > _cancelled_ttl:
+                del _checked[checked_id]
+
+    if not is_cancel_requested(test_id):
+        return False
+
+    with _lock:
+        _cancelled[test_id] = now
+    return True
+
+
+def _is_shared():
+    return bool(current_app.config.get('REDIS_URL'))
+
+
+async def _watch_shared(test_id):
+    '''cancels measurements of `test_id` in this process once its cancel is recorded in redis'''
+    interval = current_app.config['CANCEL_POLL_INTERVAL']
+    while True:
+        await asyncio.sleep(interval)
+        if is_cancel_requested(test_id):
+            cancel(test_id)
+            return
@@ -0,0 +1,49 @@
+from aiohttp import ClientSession
+import asyncio
+import time
+
+
+# last part of the wait is spent spinning, sleep alone oversleeps by a few ms
+SPIN_SECONDS = 0.005
+
+
+async def wait_until(timestamp):
+    '''waits until local unix `timestamp` without blocking event loop for long'''
+    remaining = timestamp - time.time()
+    if remaining > SPIN_SECONDS:
+        await asyncio.sleep(remaining - SPIN_SECONDS)
+
+    while time.time() < timestamp:
+        await asyncio.sleep(0)
+
+
+def wait_until_sync(timestamp):
+    '''same as `wait_until` for threads'''
+    remaining = timestamp - time.time()
+    if remaining > SPIN_SECONDS:
+        time.sleep(remaining - SPIN_SECONDS)
+
+    while time.time() < timestamp:
+        pass
+
+
+async def measure_clock(session: ClientSession, clock_url, samples=5):
+    '''
+    NTP-like estimation of remote clock, sample with the lowest rtt wins
+
+    returns tuple `offset`, `rtt` in seconds, remote time = local time + `offset`
+    '''
+    best = None
+    for _ in range(samples):
+        sent_at = time.time()
+        async with session.get(clock_url) as resp:
+            resp.raise_for_status()
+            remote_time = float((await resp.json())['time'])
+        received_at = time.time()
+
+        rtt = received_at - sent_at
+        offset = remote_time - (sent_at + received_at) / 2
+        if best is None or rtt < best[1]:
+            best = (offset, rtt)
+
+    return best
@@ -0,0 +1,82 @@
+from flask import current_app
+from app.main import bp
+import asyncio
+import click
+import datetime
+import threading
+import orjson
+
+
+@bp.cli.command('scheduler')
+def run_scheduler():
+    '''
+    runs jobs of `app.main.tasks` until interrupted, jobs must run in one process only,
+    so they are not started by web workers
+    '''
+    if not current_app.config['MAIN_HOST']:
+        raise click.UsageError('Scheduler runs on main host only')
+
+    from app.extensions import scheduler
+    from app.main import tasks  # noqa: F401
+
+    scheduler.init_app(current_app._get_current_object())
+    scheduler.start()
+    click.echo(f'Scheduler started, jobs: {", ".join(job.id for job in scheduler.get_jobs())}')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        scheduler.shutdown()
+
+
+@bp.cli.command('simulate')
+@click.option('--hosts', default='10,50,100,200,400', show_default=True, help='Comma separated host counts, one test per count.')
+@click.option('--size', default=1024 * 1024, show_default=True, help='Source file size in bytes.')
+@click.option('--latency', default=20.0, show_default=True, help='Mean one way latency of host in ms.')
+@click.option('--jitter', default=5.0, show_default=True, help='Jitter of every response in ms.')
+@click.option('--bandwidth', default=100.0, show_default=True, help='Mean bandwidth of host in mb/s.')
+@click.option('--failure-rate', default=0.0, show_default=True, help='Share of measurements failing.')
+@click.option('--coordinated', is_flag=True, help='Start measurements of all hosts at once.')
+@click.option('--seed', type=int, help='Seed of host profiles and jitter.')
+@click.option('--output', type=click.Path(dir_okay=False), help='Write results as json.')
+def simulate(hosts, size, latency, jitter, bandwidth, failure_rate, coordinated, seed, output):
+    '''
+    runs tests against hundreds of fake sub-hosts in this process and reports how
+    the orchestrator scales with host count (see `app.main.simulation`)
+    '''
+    if not current_app.config['MAIN_HOST']:
+        raise click.UsageError('Simulation runs on main host only')
+
+    from app.main.simulation import simulate as run_simulation
+
+    def on_step(result):
+        click.echo(
+            f'{result["hosts"]:>5} hosts  {result["completion"]:>9.3f} s  cpu {result["cpu"]:>10.3f} ms  '
+            f'rss {result["rss_peak"]:>8} kb  lag max {result["loop_lag"]["max"]:>8.3f} ms  '
+            f'sse {result["sse"]["messages"]:>6} msgs {result["sse"]["bytes"]:>10} b  '
+            f'ok {result["ok"]} failed {result["failed"]}'
+        )
+
+    host_counts = sorted(int(host_count) for host_count in hosts.split(','))
+    results = asyncio.run(run_simulation(host_counts, size, latency, jitter, bandwidth, failure_rate, coordinated, seed, on_step))
+
+    if output:
+        with open(output, 'wb') as f:
+            f.write(orjson.dumps(results, option=orjson.OPT_INDENT_2))
+
+
+@bp.cli.command('analytics')
+@click.option('--from', 'date_from', type=click.DateTime(), help='Start of range, utc.')
+@click.option('--to', 'date_to', type=click.DateTime(), help='End of range, utc.')
+@click.option('--host', 'hosts', multiple=True, help='Vps name, can be repeated.')
+@click.option('--storage', help='Storage name or object.')
+@click.option('--metric', type=click.Choice(['latency', 'ttfb', 'time', 'throughput']), default='time', show_default=True)
+def analytics(date_from, date_to, hosts, storage, metric):
+    '''prints analytics of measurements as json (same as `/api/analytics`)'''
+    if not current_app.config['MAIN_HOST']:
+        raise click.UsageError('Analytics run on main host only')
+
+    from app.main.analytics import get_analytics
+
+    date_from = date_from.replace(tzinfo=datetime.timezone.utc) if date_from else None
+    date_to = date_to.replace(tzinfo=datetime.timezone.utc) if date_to else None
+    click.echo(orjson.dumps(get_analytics(date_from, date_to, list(hosts), storage, metric), option=orjson.OPT_INDENT_2))
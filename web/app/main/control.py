@@ -0,0 +1,162 @@
+from aiohttp import ClientSession, ClientError, WSMsgType, WSServerHandshakeError
+import asyncio
+import contextvars
+import threading
+import time
+import uuid
+
+
+class ControlUnavailable(ConnectionError):
+    '''channel couldn't be opened, command wasn't sent and can be sent over http'''
+
+
+class ControlClosed(ConnectionError):
+    '''channel closed while command was running, its result is unknown'''
+
+
+class ControlChannel:
+    '''
+    websocket to one sub-host, multiplexes commands by id
+
+    messages to sub-host:
+        {"type": "command", "id": str, "endpoint": "/api/upload-url", "json": {...}}
+
+    messages from sub-host:
+        {"type": "progress", "id": str, "bytes": int, "elapsed": float}
+        {"type": "result", "id": str, "status": int, "json": {...}}
+
+    lives on `ControlClient` loop only
+    '''
+
+    def __init__(self, control_url, session: ClientSession, heartbeat) -> None:
+        self._control_url = control_url
+        self._session = session
+        self._heartbeat = heartbeat
+
+        self._ws = None
+        self._pending = {}
+        self._reader = None
+        self._connect_lock = asyncio.Lock()
+
+    async def _connect(self):
+        '''
+        raises `ControlUnavailable` if websocket can't be opened
+        '''
+        async with self._connect_lock:
+            if self._ws is None or self._ws.closed:
+                try:
+                    self._ws = await self._session.ws_connect(self._control_url, heartbeat=self._heartbeat)
+                except (ClientError, OSError, asyncio.TimeoutError) as e:
+                    raise ControlUnavailable(f'control channel \'{self._control_url}\' unavailable: {e!r}') from e
+                self._pending = {}
+                self._reader = asyncio.create_task(self._read(self._ws, self._pending))
+        return self._ws, self._pending
+
+    async def _read(self, ws, pending: dict):
+        try:
+            async for msg in ws:
+                if msg.type != WSMsgType.TEXT:
+                    continue
+
+                data = msg.json()
+                future, on_progress = pending.get(data.get('id'), (None, None))
+                if future is None:
+                    continue
+
+                if data.get('type') == 'progress' and on_progress is not None:
+                    on_progress(data)
+                elif data.get('type') == 'result' and not future.done():
+                    future.set_result(data)
+        finally:
+            for future, _ in pending.values():
+                if not future.done():
+                    future.set_exception(ControlClosed(f'control channel \'{self._control_url}\' closed'))
+
+    async def request(self, endpoint, json, on_progress=None):
+        '''
+        returns tuple `status`, `json` of command result
+
+        raises `ControlUnavailable` if channel can't be opened, `ControlClosed`
+        if it is closed before result comes
+        '''
+        ws, pending = await self._connect()
+
+        command_id = uuid.uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        pending[command_id] = (future, on_progress)
+        try:
+            await ws.send_json({'type': 'command', 'id': command_id, 'endpoint': endpoint, 'json': json})
+            data = await future
+        finally:
+            pending.pop(command_id, None)
+
+        return data.get('status'), data.get('json')
+
+
+class ControlClient:
+    '''
+    keeps control channels to sub-hosts on its own event loop thread,
+    so channels outlive event loops of single tests
+
+    one per process, started on first request
+
+    sub-hosts without `/api/control` aren't asked again for `unavailable_ttl` seconds
+    '''
+
+    def __init__(self) -> None:
+        self._loop = None
+        self._session = None
+        self._channels = {}
+        self._unavailable = {}
+        self._start_lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._loop is not None:
+                return
+
+            self._loop = asyncio.new_event_loop()
+            threading.Thread(target=self._loop.run_forever, name='control-channel', daemon=True).start()
+
+    async def _request(self, control_url, heartbeat, endpoint, json, on_progress, unavailable_ttl):
+        if self._unavailable.get(control_url, 0) > time.monotonic():
+            raise ControlUnavailable(f'control channel \'{control_url}\' unavailable')
+
+        if self._session is None:
+            self._session = ClientSession()
+
+        if control_url not in self._channels:
+            self._channels[control_url] = ControlChannel(control_url, self._session, heartbeat)
+
+        try:
+            return await self._channels[control_url].request(endpoint, json, on_progress)
+        except ControlUnavailable as e:
+            # sub-host answered, but has no control channel
+            if isinstance(e.__cause__, WSServerHandshakeError):
+                self._unavailable[control_url] = time.monotonic() + unavailable_ttl
+            raise
+
+    async def request(self, control_url, heartbeat, endpoint, json, on_progress=None, unavailable_ttl=0):
+        '''
+        sends command from any event loop, `on_progress` is called on the caller loop
+
+        returns tuple `status`, `json` of command result, raises like `ControlChannel.request`
+        '''
+        self._ensure_started()
+
+        caller_loop = asyncio.get_running_loop()
+        caller_context = contextvars.copy_context()
+
+        def progress(data):
+            try:
+                caller_loop.call_soon_threadsafe(on_progress, data, context=caller_context)
+            except RuntimeError:
+                pass  # caller loop is already closed
+
+        future = asyncio.run_coroutine_threadsafe(
+            self._request(control_url, heartbeat, endpoint, json, progress if on_progress else None, unavailable_ttl), self._loop
+        )
+        return await asyncio.wrap_future(future)
+
+
+control_client = ControlClient()
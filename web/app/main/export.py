@@ -0,0 +1,179 @@
+from app.extensions import db
+from app.models.test import Test
+from sqlalchemy import select
+import csv
+import io
+import json
+
+
+EXPORT_FORMATS = ('ndjson', 'csv', 'parquet')
+EXPORT_KINDS = ('tests', 'measurements')
+
+TEST_COLUMNS = ['id', 'datetime', 'url', 'execution_time', 'content']
+MEASUREMENT_COLUMNS = [
+    'test_id', 'datetime', 'url', 'execution_time', 'file_size',
+    'vps', 'vps_ip', 'storage', 'ok', 'ip', 'latency', 'ttfb', 'time', 'throughput',
+    'warm_requests', 'warm_ttfb', 'warm_time', 'warm_throughput',
+    'cpu_user', 'cpu_system', 'rss_peak', 'disk_write', 'net_rx', 'host_cpu_busy', 'host_cpu_steal', 'concurrent',
+]
+WARM_FIELDS = ('requests', 'ttfb', 'time', 'throughput')
+RESOURCE_FIELDS = ('cpu_user', 'cpu_system', 'rss_peak', 'disk_write', 'net_rx', 'host_cpu_busy', 'host_cpu_steal', 'concurrent')
+
+
+def iter_test_rows(date_from=None, date_to=None, batch_size=1000):
+    '''
+    yields rows of `test` table ordered by datetime through server-side cursor,
+    only `batch_size` rows are held in memory
+    '''
+    query = select(Test.id, Test.datetime, Test.url, Test.execution_time, Test.content).order_by(Test.datetime)
+    if date_from is not None:
+        query = query.where(Test.datetime >= date_from)
+    if date_to is not None:
+        query = query.where(Test.datetime < date_to)
+
+    result = db.session.execute(query.execution_options(yield_per=batch_size))
+    try:
+        for row in result:
+            content = json.loads(row.content) if isinstance(row.content, str) else row.content or {}
+            yield {
+                'id': str(row.id),
+                'datetime': row.datetime.isoformat() if row.datetime else None,
+                'url': row.url,
+                'execution_time': row.execution_time,
+                'content': content,
+            }
+    finally:
+        result.close()
+
+
+def iter_export_records(kind, date_from=None, date_to=None, hosts=None, batch_size=1000):
+    '''
+    yields dicts of `kind` ('tests' or 'measurements'), `hosts` limits vps names,
+    tests are yielded with measurements of `hosts` only
+    '''
+    for test in iter_test_rows(date_from, date_to, batch_size):
+        vps = test['content'].get('vps', {})
+        if hosts:
+            vps = {vps_name: value for vps_name, value in vps.items() if vps_name in hosts}
+            if not vps:
+                continue
+
+        if kind == 'tests':
+            yield dict(test, content=dict(test['content'], vps=vps)) if hosts else test
+            continue
+
+        for vps_name, vps_status in vps.items():
+            # every key except `ip` is a storage ('object', 'tebi' or other storage backend)
+            for storage, measurement in vps_status.items():
+                if storage == 'ip' or not measurement:
+                    continue
+
+                yield {
+                    'test_id': test['id'],
+                    'datetime': test['datetime'],
+                    'url': test['url'],
+                    'execution_time': test['execution_time'],
+                    'file_size': test['content'].get('file_size'),
+                    'vps': vps_name,
+                    'vps_ip': vps_status.get('ip'),
+                    'storage': storage,
+                    'ok': measurement.get('ok'),
+                    'ip': measurement.get('ip'),
+                    'latency': measurement.get('latency'),
+                    'ttfb': measurement.get('ttfb'),
+                    'time': measurement.get('time'),
+                    'throughput': measurement.get('throughput'),
+                    **{f'warm_{field}': (measurement.get('warm') or {}).get(field) for field in WARM_FIELDS},
+                    **{field: (measurement.get('resources') or {}).get(field) for field in RESOURCE_FIELDS},
+                }
+
+
+def export_ndjson(records):
+    for record in records:
+        yield json.dumps(record) + '\n'
+
+
+def export_csv(records, columns):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns, extrasaction='ignore')
+    writer.writeheader()
+
+    for record in records:
+        if 'content' in record:
+            record = dict(record, content=json.dumps(record['content']))
+        writer.writerow(record)
+
+        if buffer.tell() > 1024 * 64:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield buffer.getvalue()
+
+
+class _ChunkSink:
+    '''write-only file object, collected bytes are taken by the response generator'''
+
+    def __init__(self) -> None:
+        self.chunks = []
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def export_parquet(records, columns, row_group_size=10000):
+    '''
+    requires optional `pyarrow`, every row group is flushed to the client as soon as it is written
+    '''
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    def column_type(column):
+        if column == 'ok':
+            return pa.bool_()
+        if column in ('warm_requests', 'rss_peak', 'disk_write', 'net_rx', 'concurrent'):
+            return pa.int64()
+        if column in (
+            'execution_time', 'file_size', 'latency', 'ttfb', 'time', 'throughput', 'warm_ttfb', 'warm_time', 'warm_throughput',
+            'cpu_user', 'cpu_system', 'host_cpu_busy', 'host_cpu_steal',
+        ):
+            return pa.float64()
+        return pa.string()
+
+    schema = pa.schema([(column, column_type(column)) for column in columns])
+
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+
+    def write_batch(batch):
+        table = pa.Table.from_pylist(batch, schema=schema)
+        writer.write_table(table)
+
+    batch = []
+    for record in records:
+        if 'content' in record:
+            record = dict(record, content=json.dumps(record['content']))
+        batch.append(record)
+
+        if len(batch) >= row_group_size:
+            write_batch(batch)
+            batch = []
+            yield sink.take()
+
+    if batch:
+        write_batch(batch)
+    writer.close()
+    yield sink.take()
@@ -0,0 +1,140 @@
+import hashlib
+import re
+import time
+
+
+ALGORITHMS = ('md5', 'sha256', 'crc32c')
+
+_md5_etag_re = re.compile(r'^[0-9a-f]{32}$')
+
+
+class IntegrityError(Exception):
+    pass
+
+
+class _Crc32c:
+    '''hashlib-like wrapper of optional `crc32c` package'''
+
+    def __init__(self) -> None:
+        import crc32c
+        self._crc32c = crc32c.crc32c
+        self._value = 0
+
+    def update(self, data):
+        self._value = self._crc32c(data, self._value)
+
+    def hexdigest(self):
+        return f'{self._value:08x}'
+
+
+def is_supported(algorithm) -> bool:
+    if algorithm not in ALGORITHMS:
+        return False
+    if algorithm == 'crc32c':
+        try:
+            import crc32c  # noqa: F401
+        except ImportError:
+            return False
+    return True
+
+
+def parse_verify(json: dict):
+    '''
+    returns tuple `verify`, `digest`, `error`, `verify` is hash algorithm or None,
+    `digest` is known hex digest of the file (not required)
+    '''
+    verify = json.get('verify')
+    if not verify:
+        return None, None, None
+
+    if verify not in ALGORITHMS:
+        return None, None, f'\'verify\' must be one of: {", ".join(ALGORITHMS)}'
+    if not is_supported(verify):
+        return None, None, f'\'{verify}\' verification requires crc32c package'
+
+    digest = json.get('digest')
+    if digest is not None and not isinstance(digest, str):
+        return None, None, '\'digest\' must be hex string'
+    return verify, digest.lower() if digest else None, None
+
+
+class StreamHasher:
+    '''
+    hashes transfer chunk by chunk in the read loop, chunks are passed as memoryviews
+    so nothing is copied, time spent hashing is counted separately (thread cpu time)
+    '''
+
+    def __init__(self, algorithm) -> None:
+        self.algorithm = algorithm
+        self.size = 0
+        self.cpu_time = 0
+
+        self._hash = _Crc32c() if algorithm == 'crc32c' else hashlib.new(algorithm)
+
+    def update(self, chunk):
+        start_time = time.thread_time()
+        self._hash.update(memoryview(chunk))
+        self.cpu_time += time.thread_time() - start_time
+        self.size += len(chunk)
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+    def verify(self, size=None, etag=None, digest=None):
+        '''
+        compares transfer with what the source declared, returns list of checks passed
+
+        `size` - Content-Length, `etag` - ETag (compared only when it is md5 of a single part upload
+        and algorithm is md5), `digest` - known hex digest
+
+        raises `IntegrityError`
+        '''
+        checks = []
+        if size is not None:
+            if self.size != int(size):
+                raise IntegrityError(f'Received {self.size} bytes, expected {size}')
+            checks.append('size')
+
+        if etag is not None and self.algorithm == 'md5':
+            etag = etag.strip().strip('"').lower()
+            if _md5_etag_re.match(etag):
+                if self.hexdigest() != etag:
+                    raise IntegrityError(f'md5 {self.hexdigest()} doesn\'t match etag {etag}')
+                checks.append('etag')
+
+        if digest is not None:
+            if self.hexdigest() != digest:
+                raise IntegrityError(f'{self.algorithm} {self.hexdigest()} doesn\'t match digest {digest}')
+            checks.append('digest')
+
+        return checks
+
+    def verify_response(self, headers, digest=None):
+        '''
+        same as `verify` with Content-Length and ETag of http response,
+        size is compared only when body is not encoded (client decompresses it)
+        '''
+        size = None
+        if headers.get('Content-Encoding', 'identity') == 'identity':
+            size = headers.get('Content-Length')
+        return self.verify(size, headers.get('ETag'), digest)
+
+
+def get_summary(hashers: list, checks: list) -> dict:
+    '''
+    summary of verified transfers:
+        {
+            "algorithm": str,
+            "digest": str (of the first transfer),
+            "bytes": int,
+            "cpu": float ms spent hashing,
+            "checks": ["size", "etag", "digest"] checks passed
+        }
+    '''
+    return {
+        'algorithm': hashers[0].algorithm,
+        'digest': hashers[0].hexdigest(),
+        'bytes': sum(hasher.size for hasher in hashers),
+        'cpu': round(sum(hasher.cpu_time for hasher in hashers) * 1000, 3),
+        'checks': sorted(set(checks)),
+    }
@@ -0,0 +1,54 @@
+import random
+
+
+PAYLOAD_SEED = 20240609
+PAYLOAD_BUFFER_SIZE = 1024 * 1024 * 1
+
+_payload_buffer = None
+
+
+def get_payload_buffer() -> bytes:
+    '''deterministic incompressible block, generated once per process and reused for every payload'''
+    global _payload_buffer
+    if _payload_buffer is None:
+        _payload_buffer = random.Random(PAYLOAD_SEED).randbytes(PAYLOAD_BUFFER_SIZE)
+    return _payload_buffer
+
+
+def get_payload_etag(size):
+    return f'"payload-{PAYLOAD_SEED}-{PAYLOAD_BUFFER_SIZE}-{size}"'
+
+
+def iter_payload(size):
+    '''yields `size` bytes of payload, full blocks are the same buffer object so nothing is copied'''
+    buffer = get_payload_buffer()
+    full_blocks, tail = divmod(size, len(buffer))
+
+    for _ in range(full_blocks):
+        yield buffer
+    if tail:
+        yield buffer[:tail]
+
+
+class PayloadReader:
+    '''file-like object over payload of `size` bytes, used to seed storage fixtures'''
+
+    def __init__(self, size) -> None:
+        self._size = size
+        self._position = 0
+
+    def read(self, amount=-1):
+        remaining = self._size - self._position
+        if amount is None or amount < 0 or amount > remaining:
+            amount = remaining
+
+        buffer = get_payload_buffer()
+        parts = []
+        while amount > 0:
+            offset = self._position % len(buffer)
+            part = buffer[offset:offset + amount]
+            parts.append(part)
+            self._position += len(part)
+            amount -= len(part)
+
+        return b''.join(parts)
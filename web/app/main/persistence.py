@@ -0,0 +1,242 @@
+from flask import current_app
+from celery import shared_task
+from app.extensions import db, get_redis
+from app.models.test import Test
+from app.main import queues
+from redis.exceptions import RedisError, LockError
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import SQLAlchemyError, OperationalError, InterfaceError
+import datetime
+import fcntl
+import glob
+import os
+import time
+import uuid
+import orjson
+
+
+PENDING_KEY = 'persist:tests'
+FAILED_KEY = 'persist:tests:failed'
+FLUSH_LOCK_KEY = 'persist:tests:flush'
+FLUSH_SCHEDULED_KEY = 'persist:tests:scheduled'
+# stream of committed batches, {"from": iso datetime of the oldest test}, readers of `test` table
+# learn from it that tests older than what they have already read were written
+LANDED_KEY = 'persist:tests:landed'
+LANDED_MAXLEN = 1000
+
+# removes committed batch from the head of the buffer only while flush lock is still ours,
+# flusher that lost its lock must not trim records another flusher is writing
+_trim_script = '''
+    if redis.call('get', KEYS[1]) ~= ARGV[1] then
+        return 0
+    end
+    redis.call('ltrim', KEYS[2], ARGV[2], -1)
+    return 1
+'''
+
+
+def make_record(test_id, url, execution_time, content: str) -> bytes:
+    '''buffered row of `Test`, `datetime` is time test finished, not time row is written'''
+    return orjson.dumps({
+        'id': str(test_id),
+        'datetime': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'url': url,
+        'execution_time': execution_time,
+        'content': content,
+    })
+
+
+def save_test(test_id, url, execution_time, content: str):
+    '''
+    buffers finished test, it is written to database by `flush()` in a batch with others,
+    so the test doesn't wait for database and a database outage doesn't lose it
+
+    record is kept in redis (`PENDING_KEY`) until its batch is committed,
+    while redis is unavailable it is appended to spill file in `PERSIST_SPILL_DIR`
+    '''
+    record = make_record(test_id, url, execution_time, content)
+    try:
+        pending = get_redis().rpush(PENDING_KEY, record)
+    except RedisError as e:
+        current_app.logger.error(f'Couldn\'t buffer test {test_id}, spilled to disk: {e!r}')
+        spill([record])
+        return
+
+    try:
+        schedule_flush(pending)
+    except Exception as e:
+        # record is buffered, the next test or `job_flush_results` schedules the flush
+        current_app.logger.error(f'Couldn\'t schedule flush of tests: {e!r}')
+
+
+def schedule_flush(pending: int):
+    '''
+    flush runs `PERSIST_FLUSH_INTERVAL` after the first test buffered since the last one,
+    and right away every time `PERSIST_BATCH_SIZE` tests are pending
+    '''
+    interval = current_app.config['PERSIST_FLUSH_INTERVAL']
+    if get_redis().set(FLUSH_SCHEDULED_KEY, 1, nx=True, ex=max(int(interval), 1)):
+        _enqueue_flush(interval)
+    if pending % current_app.config['PERSIST_BATCH_SIZE'] == 0:
+        _enqueue_flush(0)
+
+
+def _enqueue_flush(delay):
+    eta = datetime.datetime.utcnow() + datetime.timedelta(seconds=delay) if delay else None
+    queues.enqueue(flush_task, queues.PERSIST, {}, eta=eta)
+
+
+@shared_task(ignore_result=True)
+def flush_task():
+    replay_spill()
+    try:
+        flush()
+    except SQLAlchemyError as e:
+        current_app.logger.error(f'Couldn\'t write buffered tests, retrying later: {e!r}')
+        _enqueue_flush(current_app.config['PERSIST_OUTAGE_INTERVAL'])
+
+
+def flush(batch_size=None) -> int:
+    '''
+    writes buffered tests to database, one multi-row insert per batch of `batch_size`
+    (default `PERSIST_BATCH_SIZE`), returns amount of tests flushed
+
+    batch is removed from redis only after it is committed, inserts skip tests already
+    written, so a batch retried after a crash is written once
+
+    raises `SQLAlchemyError` if database stays unavailable, tests stay buffered
+    '''
+    batch_size = batch_size or current_app.config['PERSIST_BATCH_SIZE']
+    redis = get_redis()
+
+    # one flusher at a time, producers only append, so the head of the list is stable
+    lock = redis.lock(FLUSH_LOCK_KEY, timeout=current_app.config['PERSIST_FLUSH_LOCK_TIMEOUT'])
+    if not lock.acquire(blocking=False):
+        return 0
+    trim = redis.register_script(_trim_script)
+
+    written = 0
+    try:
+        while True:
+            # every batch gets the whole lock timeout, a long backlog doesn't outlive the lock
+            lock.reacquire()
+            records = redis.lrange(PENDING_KEY, 0, batch_size - 1)
+            if not records:
+                break
+
+            written += write_batch(records)
+            if not trim(keys=[FLUSH_LOCK_KEY, PENDING_KEY], args=[lock.local.token, len(records)]):
+                # rows are committed, the next flusher skips them as already written
+                current_app.logger.error('Lock of tests flush expired while writing batch, batch is left to the next flush')
+                break
+            redis.xadd(LANDED_KEY, {'from': min(orjson.loads(record)['datetime'] for record in records)}, maxlen=LANDED_MAXLEN)
+
+            if len(records) < batch_size:
+                break
+    except LockError:
+        current_app.logger.error('Lock of tests flush expired between batches')
+    finally:
+        try:
+            lock.release()
+        except LockError:
+            current_app.logger.error('Lock of tests flush expired while flushing')
+
+    if written:
+        current_app.logger.info(f'Flushed {written} buffered tests')
+    return written
+
+
+def write_batch(records: list) -> int:
+    '''
+    inserts `records` with retries while database is unreachable, if the batch is rejected
+    (invalid row) rows are inserted one by one and rejected ones are moved to `FAILED_KEY`
+    '''
+    rows = [_to_row(record) for record in records]
+
+    retries = current_app.config['PERSIST_RETRIES']
+    delay = current_app.config['PERSIST_RETRY_DELAY']
+    for attempt in range(retries + 1):
+        try:
+            _insert(rows)
+            return len(rows)
+        except (OperationalError, InterfaceError) as e:
+            db.session.rollback()
+            if attempt == retries:
+                raise e
+            current_app.logger.info(f'Database unavailable, retrying batch in {delay}s: {e!r}')
+            time.sleep(delay)
+            delay *= 2
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            current_app.logger.error(f'Batch of {len(rows)} tests rejected, writing them one by one: {e!r}')
+            break
+
+    written = 0
+    for record, row in zip(records, rows):
+        try:
+            _insert([row])
+            written += 1
+        except (OperationalError, InterfaceError):
+            db.session.rollback()
+            raise
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            current_app.logger.error(f'Test {row["id"]} rejected by database: {e!r}')
+            get_redis().rpush(FAILED_KEY, record)
+    return written
+
+
+def _to_row(record: bytes) -> dict:
+    row = orjson.loads(record)
+    row['id'] = uuid.UUID(row['id'])
+    row['datetime'] = datetime.datetime.fromisoformat(row['datetime'])
+    return row
+
+
+def _insert(rows: list):
+    db.session.execute(insert(Test).values(rows).on_conflict_do_nothing(index_elements=['id']))
+    db.session.commit()
+
+
+# Spill files, used only while redis is unavailable
+
+def spill(records: list):
+    '''appends `records` to spill file of this process, synced to disk before returning'''
+    directory = current_app.config['PERSIST_SPILL_DIR']
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'tests-{os.getpid()}.ndjson')
+
+    while True:
+        with open(path, 'ab') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            # file was replayed and removed while waiting for the lock
+            if os.fstat(f.fileno()).st_nlink == 0:
+                continue
+            f.write(b''.join(record + b'\n' for record in records))
+            f.flush()
+            os.fsync(f.fileno())
+            return
+
+
+def replay_spill() -> int:
+    '''moves spilled tests back to redis buffer, returns amount of tests moved'''
+    directory = current_app.config['PERSIST_SPILL_DIR']
+    moved = 0
+    for path in glob.glob(os.path.join(directory, 'tests-*.ndjson')):
+        try:
+            with open(path, 'rb') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                records = [line for line in f.read().splitlines() if line]
+                if records:
+                    get_redis().rpush(PENDING_KEY, *records)
+                os.unlink(path)
+                moved += len(records)
+        except FileNotFoundError:
+            continue
+        except RedisError as e:
+            current_app.logger.error(f'Couldn\'t replay spilled tests, redis is unavailable: {e!r}')
+            break
+
+    if moved:
+        current_app.logger.info(f'Replayed {moved} spilled tests')
+    return moved
@@ -0,0 +1,249 @@
+from flask import current_app, request, g, make_response
+import asyncio
+import contextvars
+import cProfile
+import functools
+import inspect
+import os
+import pstats
+import re
+import threading
+import time
+import uuid
+import orjson
+
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_ID_HEADER = 'X-Profile-Id'
+
+_profile_id_re = re.compile(r'^[0-9a-f]{32}$')
+
+# session of the running view or task, copied into threads by `asyncio.to_thread`
+_current_session = contextvars.ContextVar('profile_session', default=None)
+
+# only one cProfile can be enabled in a thread, later one would silently replace the running one
+_profiled_threads = set()
+_profiled_threads_lock = threading.Lock()
+
+
+class ProfilerBusy(Exception):
+    def __init__(self) -> None:
+        super().__init__('Another profile is running in this thread')
+
+
+class ProfileSession:
+    '''
+    cProfile of one view or task plus event loop lag
+
+    every thread doing work of the session is profiled separately (`thread()`),
+    stats are merged when session is saved as `<id>.prof` (pstats) and `<id>.json` (summary)
+
+    session can't start in a thread that is already profiled (`ProfilerBusy`, see `is_busy()`),
+    profile of async session includes every coroutine interleaved on the same event loop
+    while it runs, not only the profiled view or task
+    '''
+
+    def __init__(self, name, profile_id=None) -> None:
+        self.id = profile_id or uuid.uuid4().hex
+        self.name = name
+
+        self._profiles = []
+        self._profile = None
+        self._lags = []
+        self._lag_task = None
+        self._started_at = None
+        self._wall_time = None
+        self._token = None
+
+    # Sync
+
+    def __enter__(self):
+        self._started_at = time.monotonic()
+        self._profile = self._enable()
+        self._token = _current_session.set(self)
+        return self
+
+    def __exit__(self, *exc):
+        self._stop()
+        self.save()
+
+    # Async, also measures lag of running loop, saved in a thread
+
+    async def __aenter__(self):
+        self.__enter__()
+        self._lag_task = asyncio.create_task(self._watch_loop(current_app.config['PROFILE_LOOP_LAG_INTERVAL']))
+        return self
+
+    async def __aexit__(self, *exc):
+        self._lag_task.cancel()
+        self._stop()
+        await asyncio.to_thread(self.save)
+
+    def _stop(self):
+        self.disable(self._profile)
+        self._wall_time = time.monotonic() - self._started_at
+        _current_session.reset(self._token)
+
+    def _enable(self):
+        thread_id = threading.get_ident()
+        with _profiled_threads_lock:
+            if thread_id in _profiled_threads:
+                raise ProfilerBusy()
+            _profiled_threads.add(thread_id)
+
+        profile = cProfile.Profile()
+        self._profiles.append(profile)
+        profile.enable()
+        return profile
+
+    def thread(self):
+        '''profiles current thread until returned profile is passed to `disable()`, raises `ProfilerBusy`'''
+        return self._enable()
+
+    @staticmethod
+    def disable(profile):
+        profile.disable()
+        with _profiled_threads_lock:
+            _profiled_threads.discard(threading.get_ident())
+
+    async def _watch_loop(self, interval):
+        while True:
+            sleep_start = time.monotonic()
+            await asyncio.sleep(interval)
+            self._lags.append(max(time.monotonic() - sleep_start - interval, 0))
+
+    def get_summary(self, top=30):
+        stats = pstats.Stats(*self._profiles)
+        functions = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:top]
+
+        summary = {
+            'id': self.id,
+            'name': self.name,
+            'created': time.time(),
+            'wall_time': round(self._wall_time * 1000, 3),
+            'threads': len(self._profiles),
+            'functions': [
+                {
+                    'function': f'{file_name}:{line}({function_name})',
+                    'calls': calls,
+                    'total_time': round(total_time * 1000, 3),
+                    'cumulative_time': round(cumulative_time * 1000, 3),
+                }
+                for (file_name, line, function_name), (_, calls, total_time, cumulative_time, _) in functions
+            ],
+        }
+        if self._lags:
+            summary['loop_lag'] = {
+                'samples': len(self._lags),
+                'max': round(max(self._lags) * 1000, 3),
+                'mean': round(sum(self._lags) / len(self._lags) * 1000, 3),
+            }
+        return summary
+
+    def save(self):
+        directory = current_app.config['PROFILES_DIR']
+        os.makedirs(directory, exist_ok=True)
+
+        pstats.Stats(*self._profiles).dump_stats(os.path.join(directory, f'{self.id}.prof'))
+        with open(os.path.join(directory, f'{self.id}.json'), 'wb') as f:
+            f.write(orjson.dumps(self.get_summary(current_app.config['PROFILE_TOP'])))
+
+
+def in_thread(func):
+    '''
+    wraps `func` passed to `asyncio.to_thread`, the thread joins session of the caller,
+    plain call when nothing is profiled
+    '''
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        session = _current_session.get()
+        if session is None or is_busy():
+            return func(*args, **kwargs)
+
+        profile = session.thread()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            session.disable(profile)
+    return wrapper
+
+
+def is_requested(headers) -> bool:
+    return current_app.config['PROFILING'] and bool(headers.get(PROFILE_HEADER))
+
+
+def is_busy() -> bool:
+    '''True if current thread is already profiled by a session'''
+    with _profiled_threads_lock:
+        return threading.get_ident() in _profiled_threads
+
+
+def busy_response():
+    return make_response({'error': str(ProfilerBusy())}, 409)
+
+
+async def run_profiled(coro, name, profile_id=None):
+    '''awaits `coro` inside of profile session, for tasks running `asyncio.run`, unprofiled if thread is busy'''
+    if is_busy():
+        current_app.logger.info(f'Profile {profile_id} of {name} skipped, another profile is running')
+        return await coro
+
+    async with ProfileSession(name, profile_id):
+        return await coro
+
+
+def load_summary(profile_id):
+    '''returns summary of saved profile or None'''
+    if not _profile_id_re.match(profile_id):
+        return None
+
+    try:
+        with open(os.path.join(current_app.config['PROFILES_DIR'], f'{profile_id}.json'), 'rb') as f:
+            return orjson.loads(f.read())
+    except FileNotFoundError:
+        return None
+
+
+def profile_view(view):
+    '''
+    profiles `view` when request has `X-Profile` header, id is returned in `X-Profile-Id`,
+    409 if another profile is running in the same thread
+    '''
+    if inspect.iscoroutinefunction(view):
+        @functools.wraps(view)
+        async def async_wrapper(*args, **kwargs):
+            if not is_requested(request.headers):
+                return await view(*args, **kwargs)
+            if is_busy():
+                return busy_response()
+
+            async with ProfileSession(request.endpoint) as session:
+                g.profile_id = session.id
+                return await view(*args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not is_requested(request.headers):
+            return view(*args, **kwargs)
+        if is_busy():
+            return busy_response()
+
+        with ProfileSession(request.endpoint) as session:
+            g.profile_id = session.id
+            return view(*args, **kwargs)
+    return wrapper
+
+
+def init_app(app, blueprint_name):
+    '''wraps every view of blueprint, has to be called after blueprint is registered'''
+    for endpoint, view in app.view_functions.items():
+        if endpoint.startswith(f'{blueprint_name}.'):
+            app.view_functions[endpoint] = profile_view(view)
+
+    @app.after_request
+    def add_profile_id(response):
+        profile_id = g.get('profile_id')
+        if profile_id is not None:
+            response.headers[PROFILE_ID_HEADER] = profile_id
+        return response
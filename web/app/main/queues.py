@@ -0,0 +1,26 @@
+from flask import current_app
+
+
+# kinds of test tasks, each has its own celery queue (see `CELERY_QUEUES`)
+INTERACTIVE = 'interactive'
+SCHEDULED = 'scheduled'
+RETRY = 'retry'
+# not a test kind, batched writes of finished tests (`app.main.persistence`) never wait behind tests
+PERSIST = 'persist'
+
+
+def get_route(kind) -> dict:
+    '''`apply_async` options of queue for tasks of `kind`'''
+    queue = current_app.config['CELERY_QUEUES'][kind]
+    return {'queue': queue['name'], 'priority': queue['priority']}
+
+
+def enqueue(task, kind, kwargs: dict, eta=None):
+    '''
+    sends `task` to queue of `kind`:
+        interactive - tests started from ui or api, workers of this queue stay free for them
+        scheduled - `job_tests`, tests with `eta` and batch sweeps
+        retry - tests waiting for `MonopolyMode` (admission), re-enqueued every few seconds
+        persist - flushes of finished tests to database
+    '''
+    return task.apply_async(kwargs=kwargs, eta=eta, **get_route(kind))
@@ -0,0 +1,41 @@
+from flask import current_app
+from aiohttp import ClientSession, ClientTimeout
+from app.models.vps import Vps
+import asyncio
+import time
+
+
+async def probe_vps(session: ClientSession, vps_url):
+    '''
+    returns rtt in ms, raises if vps doesn't answer within `VPS_PROBE_TIMEOUT`
+    '''
+    start_time = time.monotonic()
+    async with session.get(f'{vps_url}/api/clock') as resp:
+        resp.raise_for_status()
+        await resp.read()
+    return round((time.monotonic() - start_time) * 1000, 3)
+
+
+async def probe_all():
+    '''
+    probes every enabled vps at once and updates its health and circuit breaker
+
+    returns {vps_name: rtt or None}
+    '''
+    registry = Vps.query.filter_by(enabled=True).all()
+    timeout = ClientTimeout(total=current_app.config['VPS_PROBE_TIMEOUT'])
+
+    async with ClientSession(timeout=timeout) as session:
+        results = await asyncio.gather(*(probe_vps(session, vps.url) for vps in registry), return_exceptions=True)
+
+    output = {}
+    for vps, result in zip(registry, results):
+        if isinstance(result, Exception):
+            current_app.logger.info(f'Probe of \'{vps.name}\' failed: {result!r}')
+            vps.record_failure(probe=True)
+            output[vps.name] = None
+        else:
+            vps.record_success(rtt=result)
+            output[vps.name] = result
+
+    return output
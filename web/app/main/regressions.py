@@ -0,0 +1,145 @@
+from flask import current_app
+from app.extensions import db
+from app.models.baseline import Baseline
+from app.models.regression import Regression
+from sqlalchemy import select, tuple_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import SQLAlchemyError
+import asyncio
+import datetime
+import hashlib
+import orjson
+
+
+METRICS = ('latency', 'ttfb', 'time')
+# metrics depending on test parameters, baseline is kept per parameters
+SCOPED_METRICS = ('time',)
+
+
+def get_scope(url, speed, amount, payload_size=None) -> str:
+    return hashlib.sha256(orjson.dumps([url, speed, amount, payload_size])).hexdigest()[:32]
+
+
+def evaluate(test_id, status: dict, url, speed, amount, payload_size=None) -> list:
+    '''
+    compares every successful measurement of `status` (`UploadStatus.get_status()`)
+    with its baseline, stores and returns regressions, then adds measurements to baselines
+
+    a measurement is a regression when baseline has at least `REGRESSION_MIN_SAMPLES`
+    and value is more than `REGRESSION_THRESHOLD` spreads above it
+
+    returns list of regressions:
+        [
+            {
+                "vps": str,
+                "storage": str,
+                "metric": "latency" | "ttfb" | "time",
+                "value": float ms,
+                "baseline": float ms,
+                "deviation": float ms,
+                "score": float
+            }
+        ]
+    '''
+    if 'error' in status:
+        return []
+
+    alpha = current_app.config['REGRESSION_ALPHA']
+    threshold = current_app.config['REGRESSION_THRESHOLD']
+    min_samples = current_app.config['REGRESSION_MIN_SAMPLES']
+    min_ratio = current_app.config['REGRESSION_MIN_RATIO']
+
+    scope = get_scope(url, speed, amount, payload_size)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    regressions = []
+
+    measurements = []
+    for vps_name, vps_status in status.get('vps', {}).items():
+        for storage, measurement in vps_status.items():
+            if storage == 'ip' or not measurement.get('ok'):
+                continue
+
+            for metric in METRICS:
+                if measurement.get(metric) is not None:
+                    key = (vps_name, storage, metric, scope if metric in SCOPED_METRICS else '')
+                    measurements.append((key, float(measurement[metric])))
+
+    if not measurements:
+        return []
+
+    try:
+        db.session.begin_nested()
+        baselines = lock_baselines({key for key, _ in measurements})
+
+        for key, value in measurements:
+            vps_name, storage, metric, _ = key
+            baseline = baselines[key]
+
+            if baseline.samples >= min_samples:
+                score = baseline.get_score(value, min_ratio)
+                if score > threshold:
+                    regression = {
+                        'vps': vps_name,
+                        'storage': storage,
+                        'metric': metric,
+                        'value': value,
+                        'baseline': round(baseline.ewma, 3),
+                        'deviation': round(value - baseline.ewma, 3),
+                        'score': round(score, 2),
+                    }
+                    regressions.append(regression)
+                    db.session.add(Regression(test_id=test_id, datetime=now, url=url, **regression))
+
+            baseline.update(value, alpha, threshold if baseline.samples >= min_samples else None)
+            baseline.updated = now
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        current_app.logger.error(f'Couldn\'t evaluate regressions of test {test_id}: {e}')
+        return []
+
+    if regressions:
+        current_app.logger.warning('Test %s regressed: %s', test_id, regressions)
+    return regressions
+
+
+async def evaluate_in_thread(test_id, status: dict, url, speed, amount, payload_size=None) -> list:
+    '''
+    `evaluate` in a thread with its own app context and database session, waiting
+    for locked baselines doesn't block event loop and concurrent tests don't share session
+    '''
+    app = current_app._get_current_object()
+
+    def run():
+        with app.app_context():
+            return evaluate(test_id, status, url, speed, amount, payload_size)
+
+    return await asyncio.to_thread(run)
+
+
+def lock_baselines(keys: set) -> dict:
+    '''
+    returns {(vps, storage, metric, scope): `Baseline`} locked for update until commit,
+    missing baselines are created first, tests finishing at once don't fail on the same new key
+    '''
+    columns = ('vps', 'storage', 'metric', 'scope')
+    db.session.execute(
+        insert(Baseline).values([dict(zip(columns, key), samples=0) for key in sorted(keys)]).on_conflict_do_nothing()
+    )
+
+    primary_key = (Baseline.vps, Baseline.storage, Baseline.metric, Baseline.scope)
+    # rows are always locked in the same order, so concurrent tests can't deadlock
+    query = select(Baseline).where(tuple_(*primary_key).in_(keys)).order_by(*primary_key).with_for_update()
+    return {(baseline.vps, baseline.storage, baseline.metric, baseline.scope): baseline for baseline in db.session.scalars(query)}
+
+
+def get_regressions(since: datetime.datetime = None, vps=None, storage=None, limit=100) -> list:
+    '''returns latest regressions first'''
+    query = Regression.query
+    if since is not None:
+        query = query.filter(Regression.datetime >= since)
+    if vps is not None:
+        query = query.filter_by(vps=vps)
+    if storage is not None:
+        query = query.filter_by(storage=storage)
+    return [regression.to_dict() for regression in query.order_by(Regression.datetime.desc(), Regression.id.desc()).limit(limit)]
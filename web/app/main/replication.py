@@ -0,0 +1,74 @@
+import time
+
+
+def parse_replication(header) -> dict:
+    '''
+    parses `x-tb-replication` header ('DE:2,SGP:1,USE:2,USW:2') into {region: copies},
+    malformed parts are skipped
+    '''
+    regions = {}
+    if not header:
+        return regions
+
+    for part in header.split(','):
+        region, _, copies = part.strip().partition(':')
+        try:
+            regions[region.strip()] = int(copies)
+        except ValueError:
+            continue
+    return regions
+
+
+class ReplicationTracker:
+    '''
+    tracks when every region of `topology` reaches its expected amount of copies,
+    lag is counted from `started_at` (unix timestamp the upload finished)
+
+    regions structure:
+        {
+            "DE": {
+                "copies": int,
+                "expected": int,
+                "lag": float ms (None while region is behind)
+            }
+        }
+    '''
+
+    def __init__(self, topology: dict, started_at=None) -> None:
+        self._topology = dict(topology)
+        self._started_at = time.time() if started_at is None else started_at
+        self._copies = {region: 0 for region in self._topology}
+        self._reached_at = {}
+
+        self.header = None
+
+    @property
+    def complete(self):
+        return len(self._reached_at) == len(self._topology)
+
+    def update(self, header, now=None):
+        '''
+        records state from `x-tb-replication` header, returns True once every region caught up
+        '''
+        now = time.time() if now is None else now
+        self.header = header
+
+        for region, copies in parse_replication(header).items():
+            if region not in self._topology:
+                continue
+
+            self._copies[region] = copies
+            if copies >= self._topology[region] and region not in self._reached_at:
+                self._reached_at[region] = now
+
+        return self.complete
+
+    def get_regions(self):
+        return {
+            region: {
+                'copies': self._copies[region],
+                'expected': expected,
+                'lag': round((self._reached_at[region] - self._started_at) * 1000, 3) if region in self._reached_at else None,
+            }
+            for region, expected in self._topology.items()
+        }
@@ -0,0 +1,145 @@
+import resource
+import threading
+
+
+# meters running in this process, deltas of process and host counters are shared by them
+_active = set()
+_active_lock = threading.Lock()
+
+
+def read_process_io():
+    '''returns {field: int} of /proc/self/io, {} if it isn't readable (not linux, restricted container)'''
+    try:
+        with open('/proc/self/io') as f:
+            return {key: int(value) for key, value in (line.split(':') for line in f)}
+    except (OSError, ValueError):
+        return {}
+
+
+def read_net_dev():
+    '''returns tuple `rx_bytes`, `tx_bytes` of all interfaces except loopback, None if unavailable'''
+    try:
+        with open('/proc/net/dev') as f:
+            lines = f.readlines()[2:]
+    except OSError:
+        return None
+
+    rx_bytes = tx_bytes = 0
+    for line in lines:
+        interface, _, counters = line.partition(':')
+        if interface.strip() == 'lo':
+            continue
+        counters = counters.split()
+        rx_bytes += int(counters[0])
+        tx_bytes += int(counters[8])
+    return rx_bytes, tx_bytes
+
+
+def read_host_cpu():
+    '''returns tuple `busy`, `steal`, `iowait`, `total` jiffies of /proc/stat, None if unavailable'''
+    try:
+        with open('/proc/stat') as f:
+            fields = [int(value) for value in f.readline().split()[1:]]
+    except (OSError, ValueError):
+        return None
+
+    # user nice system idle iowait irq softirq steal (guest time is already in user)
+    user, nice, system, idle, iowait, irq, softirq, steal = (fields + [0] * 8)[:8]
+    total = user + nice + system + idle + iowait + irq + softirq + steal
+    return total - idle - iowait - steal, steal, iowait, total
+
+
+def get_rss_kb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize() // 1024
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class ResourceMeter:
+    '''
+    resources used while one measurement runs, returned with its timings:
+        {
+            "cpu_user": float ms, "cpu_system": float ms (cpu time of the process),
+            "ctx_voluntary": int, "ctx_involuntary": int (context switches of the process),
+            "rss": int kb (at start), "rss_peak": int kb (peak of the process so far),
+            "disk_read": int bytes, "disk_write": int bytes (storage io of the process),
+            "net_rx": int bytes, "net_tx": int bytes (every interface except loopback),
+            "host_cpu_busy": float %, "host_cpu_steal": float %, "host_cpu_iowait": float %,
+            "concurrent": int (measurements of the process running at the same time, 1 when alone)
+        }
+
+    counters are process and host wide, so they are exact only when `concurrent` is 1,
+    fields that can't be read on this host are skipped
+    '''
+
+    def __init__(self) -> None:
+        self._concurrent = 1
+        self._start = None
+        self._usage = None
+
+    def __enter__(self):
+        with _active_lock:
+            _active.add(self)
+            for meter in _active:
+                meter._concurrent = max(meter._concurrent, len(_active))
+
+        self._start = self._read()
+        return self
+
+    def __exit__(self, *exc):
+        end = self._read()
+        with _active_lock:
+            _active.discard(self)
+        self._usage = self._diff(self._start, end)
+
+    @staticmethod
+    def _read():
+        return {
+            'rusage': resource.getrusage(resource.RUSAGE_SELF),
+            'rss': get_rss_kb(),
+            'io': read_process_io(),
+            'net': read_net_dev(),
+            'cpu': read_host_cpu(),
+        }
+
+    def _diff(self, start, end):
+        rusage_start, rusage_end = start['rusage'], end['rusage']
+        usage = {
+            'cpu_user': round((rusage_end.ru_utime - rusage_start.ru_utime) * 1000, 3),
+            'cpu_system': round((rusage_end.ru_stime - rusage_start.ru_stime) * 1000, 3),
+            'ctx_voluntary': rusage_end.ru_nvcsw - rusage_start.ru_nvcsw,
+            'ctx_involuntary': rusage_end.ru_nivcsw - rusage_start.ru_nivcsw,
+            # ru_maxrss is kb on linux
+            'rss_peak': rusage_end.ru_maxrss,
+        }
+        if start['rss'] is not None:
+            usage['rss'] = start['rss']
+
+        if start['io'] and end['io']:
+            usage['disk_read'] = end['io'].get('read_bytes', 0) - start['io'].get('read_bytes', 0)
+            usage['disk_write'] = end['io'].get('write_bytes', 0) - start['io'].get('write_bytes', 0)
+
+        if start['net'] is not None and end['net'] is not None:
+            usage['net_rx'] = end['net'][0] - start['net'][0]
+            usage['net_tx'] = end['net'][1] - start['net'][1]
+
+        if start['cpu'] is not None and end['cpu'] is not None:
+            busy, steal, iowait, total = (end_value - start_value for start_value, end_value in zip(start['cpu'], end['cpu']))
+            if total > 0:
+                usage['host_cpu_busy'] = round(busy / total * 100, 2)
+                usage['host_cpu_steal'] = round(steal / total * 100, 2)
+                usage['host_cpu_iowait'] = round(iowait / total * 100, 2)
+
+        usage['concurrent'] = self._concurrent
+        return usage
+
+    def get_usage(self) -> dict:
+        return self._usage
+
+    def attach(self, result: dict) -> dict:
+        '''adds usage to response of measurement'''
+        if isinstance(result, dict) and self._usage is not None:
+            result['resources'] = self._usage
+        return result
@@ -0,0 +1,40 @@
+from flask import current_app
+from app.extensions import get_redis
+import datetime
+
+
+RESULT_PREFIX = 'test_result:'
+RUNNING_PREFIX = 'test_running:'
+
+
+def mark_running(channel, eta: datetime.datetime = None):
+    '''
+    flag expires by itself, so crashed tests don't stay running forever,
+    test is running from the moment it is queued, flag of test queued with `eta` lives until it starts
+    '''
+    ttl = current_app.config['RESULT_RUNNING_TTL']
+    if eta is not None:
+        if eta.tzinfo is None:
+            eta = eta.replace(tzinfo=datetime.timezone.utc)
+        ttl += max(int((eta - datetime.datetime.now(datetime.timezone.utc)).total_seconds()), 0)
+    get_redis().set(f'{RUNNING_PREFIX}{channel}', 1, ex=ttl)
+
+
+def is_running(channel):
+    return bool(get_redis().exists(f'{RUNNING_PREFIX}{channel}'))
+
+
+def cache_result(channel, content: str):
+    '''
+    stores terminal status of test (already serialized to json) and clears running flag
+    '''
+    pipeline = get_redis().pipeline()
+    pipeline.set(f'{RESULT_PREFIX}{channel}', content, ex=current_app.config['RESULT_CACHE_TTL'])
+    pipeline.delete(f'{RUNNING_PREFIX}{channel}')
+    pipeline.execute()
+
+
+def get_cached_result(channel):
+    '''returns json of terminal status or None'''
+    content = get_redis().get(f'{RESULT_PREFIX}{channel}')
+    return content.decode() if content is not None else None
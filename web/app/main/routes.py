@@ -1,17 +1,36 @@
-from flask import render_template, request, make_response, current_app
+from flask import render_template, request, make_response, current_app, Response, stream_with_context
 from app.main import bp
 import tempfile
 import os
-from aiohttp import ClientSession, ClientResponse
+from aiohttp import ClientSession, ClientResponse, ClientError, ClientResponseError, ClientTimeout, TCPConnector
 import time
 import asyncio
-import boto3
 from app.models.test import Test
 from app.models.monopoly import MonopolyMode
+from app.models.vps import Vps
+from app.main.registry import probe_all
+from app.main.source_cache import SourceCache
+from app.main.payload import iter_payload, get_payload_etag, PayloadReader
+from app.main.control import control_client, ControlUnavailable
+from app.main.clock import wait_until, wait_until_sync, measure_clock
+from app.main import profiling
+from app.main import single_flight
+from app.main import queues
+from app.main.status import SerializedStatus, VpsStatus, Measurement
+from app.main.result_cache import mark_running, is_running, cache_result, get_cached_result
+from app.main.storage import get_storage, parse_storages, PRIMARY_STORAGE
+from app.main.replication import ReplicationTracker, parse_replication
+from app.main.regressions import evaluate_in_thread as evaluate_regressions, get_regressions
+from app.main.resources import ResourceMeter
+from app.main.integrity import StreamHasher, IntegrityError, parse_verify, get_summary as get_integrity_summary
+from app.main.cancellation import run_with_deadline, request_cancel, is_cancel_requested, TestCancelled, track, cancel, is_cancelled
+from app.main import export
+from app.main import persistence
 from tldextract import extract
 import socket
 from flask_sse import sse
 import uuid
+import collections
 from celery import shared_task
 from app.extensions import db
 import datetime
@@ -22,24 +41,49 @@ CHUNK_SIZE = 1024 * 1024 * 1
 
 
 api_upload_url_test_endpoint = '/api/upload-url-test'
+api_upload_url_batch_endpoint = '/api/upload-url-test/batch'
 api_host_test = '/api/host-test'
+api_tests_export_endpoint = '/api/tests/export'
+api_vps_endpoint = '/api/vps'
+api_vps_probe_endpoint = '/api/vps/probe'
+api_tests_endpoint = '/api/tests'
+api_cancel_endpoint = '/api/cancel'
+api_profiles_endpoint = '/api/profiles'
+api_regressions_endpoint = '/api/regressions'
+api_analytics_endpoint = '/api/analytics'
 
 api_upload_url_endpoint = '/api/upload-url'
 api_upload_file_endpoint = '/api/upload-file'
 api_upload_tebi_endpoint = '/api/upload-tebi'
+api_upload_storage_endpoint = '/api/upload-storage'
 api_test_download_speed_endpoint = '/api/test-download-speed'
+api_payload_endpoint = '/api/payload/<int:size>'
+api_control_endpoint = '/api/control'
+api_clock_endpoint = '/api/clock'
 
 
 # Helper functions
 
 
-class UploadStatus:
+class UploadStatus(SerializedStatus):
     '''
     status structure:
         {
             "file_size": float kb,
             "tebi_status": int,
             "tebi_servers": "DE:2,SGP:1,USE:2,USW:2",
+            "tebi_replication": {
+                "DE": {"copies": 2, "expected": 2, "lag": float ms after upload (None while behind)}
+            } (not set when source is cached),
+            "source_cached": bool,
+            "integrity": {
+                "algorithm": str, "digest": str, "bytes": int, "cpu": float ms, "checks": [str]
+            } (source download, verified tests only, same for measurements of every storage),
+            "profile_id": str (profiled tests only),
+            "start_skew": {"tebi": float ms, "object": float ms} (coordinated start only),
+            "regressions": [
+                {"vps": str, "storage": str, "metric": str, "value": float ms, "baseline": float ms, "deviation": float ms, "score": float}
+            ] (set when test is finished, see `app.main.regressions.evaluate`),
             "ok": int,
             "failed": int,
             "finished": bool,
@@ -49,9 +93,16 @@ class UploadStatus:
                     "tebi": {
                         "ip": str,
                         "status": "1",
+                        "downloaded": float kb (while test is running, control channel only),
+                        "start_delay": float ms (coordinated start only),
                         "latency": "10.234",
                         "ttfb": "123.456",
-                        "time": "1234.765"
+                        "time": "1234.765",
+                        "throughput": float mb/s (cold connection),
+                        "warm": {
+                            "requests": int, "ttfb": float ms, "ttfb_min": float ms, "time": float ms, "throughput": float mb/s
+                        } (warm mode only, same for "object"),
+                        "resources": {"cpu_user": float ms, "net_rx": int bytes, ...} (see `app.main.resources.ResourceMeter`)
                     },
                     "object": {
                         "ip": str,
@@ -59,7 +110,8 @@ class UploadStatus:
                         "latency": "12.543",
                         "ttfb": "123.654",
                         "time": "123.456"
-                    }
+                    },
+                    "minio": {...} (every storage of the test, same as "tebi")
                 }
             }
         }
@@ -76,31 +128,44 @@ class UploadStatus:
         2 - speed test completed
     '''
 
-    def __init__(self, uuid) -> None:
+    __slots__ = (
+        '_uuid', '_storages', '_file_size', '_tebi_status', '_tebi_servers', '_tebi_replication',
+        '_source_cached', '_integrity', '_profile_id', '_start_skew', '_regressions', '_ok', '_failed', '_vps', '_finished', '_error_message',
+    )
+
+    def __init__(self, uuid, vps_urls: dict = None, storages: list = None) -> None:
+        super().__init__()
         self._uuid = str(uuid)
 
+        if vps_urls is None:
+            vps_urls = Vps.get_urls()
+        if storages is None:
+            storages = [PRIMARY_STORAGE]
+
+        self._storages = ['object', *storages]
+
         self._file_size = None
         self._tebi_status = None
         self._tebi_servers = None
+        self._tebi_replication = None
+        self._source_cached = None
+        self._integrity = None
+        self._profile_id = None
+        self._start_skew = {}
+        self._regressions = None
 
         self._ok = 0
         self._failed = 0
         self._vps = {}
 
-        for vps_name, vps_url in current_app.config['VPS_URLS'].items():
-            self._vps[vps_name] = {
-                'ip': get_ip_from_url(vps_url),
-                'tebi': {
-                    'status': 0
-                },
-                'object': {
-                    'status': 0
-                }
-            }
+        for vps_name, vps_url in vps_urls.items():
+            self._vps[vps_name] = VpsStatus(get_ip_from_url(vps_url), self._storages)
 
         self._finished = False
         self._error_message = None
 
+        mark_running(self._uuid)
+
     @property
     def uuid(self):
         return self._uuid
@@ -113,6 +178,8 @@ class UploadStatus:
     def file_size(self, value):
         self._file_size = value
 
+        self._changed()
+
     @property
     def tebi_status(self):
         return self._tebi_status
@@ -135,6 +202,61 @@ class UploadStatus:
 
         self._make_announcement()
 
+    @property
+    def tebi_replication(self):
+        return self._tebi_replication
+
+    @tebi_replication.setter
+    def tebi_replication(self, value):
+        self._tebi_replication = value
+
+        self._make_announcement()
+
+    @property
+    def source_cached(self):
+        return self._source_cached
+
+    @source_cached.setter
+    def source_cached(self, value):
+        self._source_cached = value
+
+        self._changed()
+
+    @property
+    def integrity(self):
+        return self._integrity
+
+    @integrity.setter
+    def integrity(self, value):
+        self._integrity = value
+
+        self._changed()
+
+    @property
+    def profile_id(self):
+        return self._profile_id
+
+    @profile_id.setter
+    def profile_id(self, value):
+        self._profile_id = value
+
+        self._changed()
+
+    @property
+    def regressions(self):
+        return self._regressions
+
+    @regressions.setter
+    def regressions(self, value):
+        self._regressions = value
+
+        self._changed()
+
+    @property
+    def storages(self):
+        '''storages measured by test except `object`'''
+        return self._storages[1:]
+
     @property
     def ok(self):
         return self._ok
@@ -143,6 +265,8 @@ class UploadStatus:
     def ok(self, value):
         self._ok = value
 
+        self._changed()
+
     @property
     def failed(self):
         return self._failed
@@ -151,62 +275,76 @@ class UploadStatus:
     def failed(self, value):
         self._failed = value
 
+        self._changed()
+
     def vps_update_status(self, vps_name: str, storage: str, status: int):
         '''update vps status
 
         Args:
             `vps_ip` (str): ip address of vps
-            `storage` (str): 'tebi' or 'object'
+            `storage` (str): 'object' or name of storage backend of the test
             `status` (str): 0 - waiting, 1 - speed test started, 2 - speed test completed
 
         Raises:
             ValueError: _description_
         '''
-        if storage not in ['tebi', 'object']:
-            raise ValueError('storage must be either \'tebi\' or \'object\'')
+        self._check_storage(storage)
 
         if vps_name not in self._vps.keys():
-            self._vps[vps_name] = {}
+            self._vps[vps_name] = VpsStatus(None, [])
+
+        self._vps[vps_name].storages.setdefault(storage, Measurement()).status = status
+
+        self._make_announcement()
+
+    def vps_progress_status(self, vps_name: str, storage: str, downloaded_bytes: int):
+        self._check_storage(storage)
 
-        if storage not in self._vps[vps_name].keys():
-            self._vps[vps_name][storage] = {}
+        if vps_name not in self._vps.keys():
+            raise ValueError(f'vps_name \'{vps_name}\' not found')
 
-        self._vps[vps_name][storage]['status'] = status
+        self._vps[vps_name].storages.setdefault(storage, Measurement()).downloaded = downloaded_bytes / 1024
 
         self._make_announcement()
 
-    def vps_complete_status(self, vps_name: str, storage: str, latency: float, ttfb: float, time: float, ip: str):
-        if storage not in ['tebi', 'object']:
-            raise ValueError('storage must be either \'tebi\' or \'object\'')
+    def vps_complete_status(
+        self, vps_name: str, storage: str, latency: float, ttfb: float, time: float, ip: str,
+        start_delay: float = None, throughput: float = None, warm: dict = None, integrity: dict = None, resources: dict = None
+    ):
+        self._check_storage(storage)
 
         if vps_name not in self._vps.keys():
             raise ValueError(f'vps_name \'{vps_name}\' not found')
 
-        self._vps[vps_name][storage] = {
-            'status': 2,
-            'latency': latency,
-            'ttfb': ttfb,
-            'time': time,
-            'ok': True,
-            'ip': ip
-        }
+        self._vps[vps_name].storages.setdefault(storage, Measurement()).reset(
+            status=2, latency=latency, ttfb=ttfb, time=time, ok=True, ip=ip, start_delay=start_delay,
+            throughput=throughput, warm=warm, integrity=integrity, resources=resources
+        )
 
         self.ok += 1
 
         self._make_announcement()
 
     def vps_failed_status(self, vps_name: str, storage: str):
-        if storage not in ['tebi', 'object']:
-            raise ValueError('storage must be either \'tebi\' or \'object\'')
+        self._check_storage(storage)
 
         if vps_name not in self._vps.keys():
             raise ValueError(f'vps_name \'{vps_name}\' not found')
 
         self.failed += 1
 
-        self._vps[vps_name][storage] = {
-            'ok': False
-        }
+        self._vps[vps_name].storages.setdefault(storage, Measurement()).reset(ok=False)
+
+    def set_start_skew(self, storage: str, skew: float):
+        self._check_storage(storage)
+
+        self._start_skew[storage] = skew
+
+        self._make_announcement()
+
+    def _check_storage(self, storage):
+        if storage not in self._storages:
+            raise ValueError(f'storage must be one of {", ".join(self._storages)}')
 
     def get_status(self):
         output = {}
@@ -226,39 +364,186 @@ class UploadStatus:
         if self._tebi_servers is not None:
             output['tebi_servers'] = self._tebi_servers
 
+        if self._tebi_replication is not None:
+            output['tebi_replication'] = self._tebi_replication
+
+        if self._source_cached is not None:
+            output['source_cached'] = self._source_cached
+
+        if self._integrity is not None:
+            output['integrity'] = self._integrity
+
+        if self._profile_id is not None:
+            output['profile_id'] = self._profile_id
+
+        if self._start_skew:
+            output['start_skew'] = self._start_skew
+
+        if self._regressions is not None:
+            output['regressions'] = self._regressions
+
         output['ok'] = self._ok
         output['failed'] = self._failed
-        output['vps'] = self._vps
+        output['vps'] = {vps_name: vps_status.to_dict() for vps_name, vps_status in self._vps.items()}
+
+        return output
+
+    def _make_announcement(self):
+        self._changed()
+        sse.publish(self.to_json(), channel=self._uuid)
+
+    def finished(self):
+        self._finished = True
+        self._make_announcement()
+        cache_result(self._uuid, self.to_json())
+
+    def finished_with_exception(self, error_message):
+        self._finished = True
+        self._error_message = error_message
+        self._make_announcement()
+        cache_result(self._uuid, self.to_json())
+
+
+class ReplicationStatus:
+    '''
+    replication fields of `UploadStatus` without announcements, replication of batch
+    is shared by cells and copied to their own status once done
+    '''
+    __slots__ = ('file_size', 'tebi_status', 'tebi_servers', 'tebi_replication', 'source_cached', 'integrity')
+
+    def __init__(self) -> None:
+        self.file_size = None
+        self.tebi_status = 0  # waiting
+        self.tebi_servers = None
+        self.tebi_replication = None
+        self.source_cached = None
+        self.integrity = None
+
+
+class BatchStatus(SerializedStatus):
+    '''
+    status structure:
+        {
+            "total": int,
+            "completed": int,
+            "finished": bool,
+            "cells": [
+                {
+                    "uuid": str,
+                    "url": str,
+                    "speed": int,
+                    "amount": int,
+                    "hosts": ["vps_name_1", "vps_name_2"],
+                    "status": int,
+                    "result": {...} UploadStatus status, only when cell is completed
+                }
+            ]
+        }
+
+    cell status:
+        0 - waiting
+        1 - test started
+        2 - test completed
+    '''
+
+    __slots__ = ('_uuid', '_cells', '_completed', '_finished', '_error_message')
+
+    def __init__(self, uuid, cells: list) -> None:
+        super().__init__()
+        self._uuid = str(uuid)
+        self._cells = [dict(cell, status=0) for cell in cells]
+        self._completed = 0
+
+        self._finished = False
+        self._error_message = None
+
+        mark_running(self._uuid)
+
+    @property
+    def uuid(self):
+        return self._uuid
+
+    def cell_update_status(self, index: int, status: int, result: dict = None):
+        if status not in [0, 1, 2]:
+            raise ValueError('status must be either 0, 1 or 2')
+
+        self._cells[index]['status'] = status
+        if result is not None:
+            self._cells[index]['result'] = result
+        if status == 2:
+            self._completed += 1
+
+        self._make_announcement()
+
+    def get_status(self):
+        output = {}
+
+        output['finished'] = self._finished
+
+        if self._error_message is not None:
+            output['error'] = self._error_message
+            return output
+
+        output['total'] = len(self._cells)
+        output['completed'] = self._completed
+        output['cells'] = self._cells
 
         return output
 
     def _make_announcement(self):
-        status = self.get_status()
-        sse.publish(status, channel=self._uuid)
+        self._changed()
+        sse.publish(self.to_json(), channel=self._uuid)
 
     def finished(self):
         self._finished = True
         self._make_announcement()
+        cache_result(self._uuid, self.to_json())
 
     def finished_with_exception(self, error_message):
         self._finished = True
         self._error_message = error_message
         self._make_announcement()
+        cache_result(self._uuid, self.to_json())
 
 
 @shared_task(ignore_result=False)
-def upload_url_task(url, channel_uuid, speed, monopoly, amount, retries=0):
-    asyncio.run(upload_url(
+def upload_url_task(url, channel_uuid, speed, monopoly, amount, retries=0, payload_size=None, coordinated=False, deadline=None, storages=None, profile_id=None, warm=0, verify=None, vps_urls=None, persist=True):
+    coro = upload_url(
         url=url,
         channel_uuid=channel_uuid,
         speed=speed,
         monopoly=monopoly,
         amount=amount,
         retries=retries,
-    ))
+        payload_size=payload_size,
+        coordinated=coordinated,
+        deadline=deadline,
+        storages=storages,
+        profile_id=profile_id,
+        warm=warm,
+        verify=verify,
+        vps_urls=vps_urls,
+        persist=persist,
+    )
+    if profile_id is not None:
+        coro = profiling.run_profiled(coro, 'upload_url_task', profile_id)
+    asyncio.run(coro)
 
 
-async def upload_url(url, channel_uuid, speed, monopoly, amount, retries=0):
+async def upload_url(url, channel_uuid, speed, monopoly, amount, retries=0, payload_size=None, coordinated=False, deadline=None, storages=None, profile_id=None, warm=0, verify=None, vps_urls=None, persist=True):
+    '''
+    `deadline` is time budget of test in seconds once it started (default `TEST_DEADLINE`),
+    `storages` are names of storage backends measured side by side (default primary storage),
+    `profile_id` is stored with the test when task is profiled,
+    `warm` is amount of requests measured on warm connection after the cold one,
+    `verify` is hash algorithm transfers are verified with,
+    `vps_urls` ({vps_name: vps_url}) replace vps registry for this test (fleet simulation),
+    without `persist` test isn't saved to history and doesn't update regression baselines
+    '''
+    if is_cancel_requested(channel_uuid):
+        UploadStatus(channel_uuid, {}).finished_with_exception('Test cancelled')
+        return
+
     monopoly_model: MonopolyMode = MonopolyMode.get()
     if not monopoly_model.start_mode(monopoly):
         max_retries = 20
@@ -280,46 +565,67 @@ async def upload_url(url, channel_uuid, speed, monopoly, amount, retries=0):
             'monopoly': monopoly,
             'amount': amount,
             'retries': retries,
+            'payload_size': payload_size,
+            'coordinated': coordinated,
+            'deadline': deadline,
+            'storages': storages,
+            'profile_id': profile_id,
+            'warm': warm,
+            'verify': verify,
+            'vps_urls': vps_urls,
+            'persist': persist,
         }
-        upload_url_task.apply_async(
-            kwargs=kwargs, eta=datetime.datetime.utcnow() + datetime.timedelta(seconds=wait_seconds)
-        )
+        eta = datetime.datetime.utcnow() + datetime.timedelta(seconds=wait_seconds)
+        mark_running(channel_uuid, eta)
+        queues.enqueue(upload_url_task, queues.RETRY, kwargs, eta=eta)
         return
     try:
         start_time = time.monotonic()
 
-        upload_status = UploadStatus(channel_uuid)
+        upload_status = UploadStatus(channel_uuid, vps_urls, storages)
+        upload_status.profile_id = profile_id
         upload_status.tebi_status = 0  # waiting
 
-        upload_object_task = asyncio.create_task(publish(api_upload_url_endpoint, {'url': url, 'speed': speed, 'amount': amount}, 'object', upload_status))
-
-        file_name, file_size = await replicate_url(url, upload_status)
+        deadline_at = time.time() + (deadline or current_app.config['TEST_DEADLINE'])
+        replication = asyncio.create_task(replicate_url_cached(url, upload_status, deadline_at, verify))
 
         try:
-            await asyncio.gather(upload_object_task)
-            await publish(api_upload_tebi_endpoint, {'file_name': file_name, 'speed': speed, 'amount': amount}, 'tebi', upload_status)
-            get_bucket().delete_objects(Delete={'Objects': [{'Key': file_name}]})
-        except Exception as e:
-            current_app.logger.error(e)
-            upload_status.finished_with_exception('error while uploading file to vps')
+            await run_with_deadline(
+                run_upload_test(
+                    url, upload_status, speed, amount, replication, payload_size, vps_urls,
+                    coordinated=coordinated, deadline_at=deadline_at, warm=warm, verify=verify
+                ),
+                [channel_uuid], deadline_at
+            )
+        except TestCancelled:
+            current_app.logger.info(f'Test {channel_uuid} cancelled')
+            upload_status.finished_with_exception('Test cancelled')
+            await abort_test(channel_uuid, vps_urls)
+        except asyncio.TimeoutError:
+            current_app.logger.info(f'Test {channel_uuid} exceeded its deadline')
+            upload_status.finished_with_exception('Deadline exceeded')
+            await abort_test(channel_uuid, vps_urls)
+        except IntegrityError as e:
+            current_app.logger.error(f'Source of test {channel_uuid} failed integrity check: {e}')
+            upload_status.finished_with_exception(f'Source integrity check failed: {e}')
+        except ClientResponseError as e:
+            current_app.logger.error(f'Source of test {channel_uuid} is not available: {e}')
+            upload_status.finished_with_exception(f'Couldn\'t get file from \'{url}\': {e.status} {e.message}')
+
+        if replication.done() and not replication.cancelled() and replication.exception() is None:
+            source_key, file_name = replication.result()
+            try:
+                await release_source(source_key, file_name)
+            except Exception as e:
+                current_app.logger.error(f'Couldn\'t release source \'{file_name}\': {e}')
 
+        if persist:
+            upload_status.regressions = await evaluate_regressions(upload_status.uuid, upload_status.get_status(), url, speed, amount, payload_size)
         upload_status.finished()
-        current_app.logger.info(f'finished {upload_status.get_status()}')
-
-        end_time = time.monotonic()
+        current_app.logger.info('finished %s', upload_status.to_json())
 
-        try:
-            db.session.begin_nested()
-            test = Test(
-                id=upload_status.uuid,
-                content=upload_status.get_status(),
-                url=url,
-                execution_time=round((end_time - start_time) * 1000, 3)
-            )
-            db.session.add(test)
-            db.session.commit()
-        except SQLAlchemyError:
-            db.session.rollback()
+        if persist:
+            save_test(upload_status, url, time.monotonic() - start_time)
 
     except Exception as e:
         current_app.logger.error(e)
@@ -328,201 +634,1161 @@ async def upload_url(url, channel_uuid, speed, monopoly, amount, retries=0):
         monopoly_model.end_mode(monopoly)
 
 
-async def replicate_url(url, upload_status: UploadStatus):
+@shared_task(ignore_result=False)
+def upload_url_batch_task(plan, retries=0):
+    asyncio.run(upload_url_batch(plan=plan, retries=retries))
+
+
+async def upload_url_batch(plan: dict, retries=0):
     '''
-    returns tuple `file_name`, `file_size`
+    plan structure:
+        {
+            "uuid": str,
+            "monopoly": bool,
+            "coordinated": bool,
+            "concurrency": int,
+            "deadline": int seconds for every cell (not required),
+            "storages": [str] names of storage backends (not required),
+            "warm": int requests on warm connection (not required),
+            "verify": str hash algorithm (not required),
+            "cells": [
+                {
+                    "uuid": str,
+                    "url": str,
+                    "speed": int,
+                    "amount": int,
+                    "payload_size": int or null,
+                    "hosts": ["vps_name_1", "vps_name_2"]
+                }
+            ]
+        }
+
+    every url is replicated to tebi once and shared by all cells using it
     '''
+    monopoly = plan['monopoly']
 
-    correct_replication_status = 'DE:2,SGP:1,USE:2,USW:2'
-    file_name: str = time.strftime('%Y-%m-%d_%H-%M-%S_') + url.split('/')[-1]
-    file_size = 0
+    if is_cancel_requested(plan['uuid']):
+        BatchStatus(plan['uuid'], plan['cells']).finished_with_exception('Test cancelled')
+        return
 
-    async with ClientSession() as session:
-        async with session.get(url) as resp:
-            if not resp.ok:
-                current_app.logger.error(f'Couldn\'t get file from \'{url}\'. Response: {resp}')
-                return {'error': f'Couldn\'t get file from \'{url}\'.'}, 400
+    monopoly_model: MonopolyMode = MonopolyMode.get()
+    if not monopoly_model.start_mode(monopoly):
+        max_retries = 20
+        wait_seconds = 10
 
-            downloaded_size = 0
-            with tempfile.NamedTemporaryFile(delete=False) as temp:
-                while True:
-                    chunk = await resp.content.read(CHUNK_SIZE)
-                    if not chunk:
-                        break
-                    downloaded_size += len(chunk)
-                    temp.write(chunk)
-                temp.seek(0)
+        retries += 1
 
-                temp.close()
-                os.unlink(temp.name)
+        if retries == max_retries:
+            current_app.logger.info('Couldn\'t wait for batch execution')
+            BatchStatus(plan['uuid'], plan['cells']).finished_with_exception('Couldn\'t wait for task execution. Max retries exceeded')
+            return
 
-            with tempfile.NamedTemporaryFile(delete=False) as new_temp_file:
-                upload_status.file_size = downloaded_size / 1024
+        current_app.logger.info(f'Waiting for batch execution {retries}/{max_retries}. Active tests: {monopoly_model.active_tests}, lock {monopoly_model.lock}. monopoly: {monopoly}, cells: {len(plan["cells"])}')
 
-                new_temp_file.truncate(downloaded_size)
+        eta = datetime.datetime.utcnow() + datetime.timedelta(seconds=wait_seconds)
+        mark_running(plan['uuid'], eta)
+        queues.enqueue(upload_url_batch_task, queues.RETRY, {'plan': plan, 'retries': retries}, eta=eta)
+        return
+    try:
+        batch_status = BatchStatus(plan['uuid'], plan['cells'])
+        vps_urls: dict = Vps.get_urls()
+        deadline = plan.get('deadline') or current_app.config['TEST_DEADLINE']
+
+        # replication has its own deadline and is cancelled once no cell waits for it
+        replications = {}
+        replication_users = collections.Counter(cell['url'] for cell in plan['cells'])
+        for url in replication_users:
+            replication_status = ReplicationStatus()
+            replications[url] = (replication_status, asyncio.create_task(asyncio.wait_for(
+                replicate_url_cached(url, replication_status, time.time() + deadline, plan.get('verify')), deadline
+            )))
+
+        semaphore = asyncio.Semaphore(plan['concurrency'])
+
+        async def wait_replication(upload_status: UploadStatus, url):
+            replication_status, replication = replications[url]
+            source_key, file_name = await asyncio.shield(replication)
+
+            upload_status.file_size = replication_status.file_size
+            upload_status.source_cached = replication_status.source_cached
+            upload_status.tebi_servers = replication_status.tebi_servers
+            upload_status.tebi_replication = replication_status.tebi_replication
+            upload_status.integrity = replication_status.integrity
+            upload_status.tebi_status = replication_status.tebi_status
+
+            return source_key, file_name
+
+        async def run_cell(index, cell):
+            try:
+                await run_cell_test(index, cell)
+            finally:
+                replication_users[cell['url']] -= 1
+                if not replication_users[cell['url']]:
+                    replications[cell['url']][1].cancel()
+
+        async def run_cell_test(index, cell):
+            async with semaphore:
+                batch_status.cell_update_status(index, 1)
+
+                start_time = time.monotonic()
+                cell_vps_urls = {vps_name: vps_urls[vps_name] for vps_name in cell['hosts'] if vps_name in vps_urls}
+
+                upload_status = UploadStatus(cell['uuid'], cell_vps_urls, plan.get('storages'))
+                upload_status.tebi_status = 0  # waiting
+
+                deadline_at = time.time() + deadline
+                try:
+                    await run_with_deadline(
+                        run_upload_test(
+                            cell['url'], upload_status, cell['speed'], cell['amount'],
+                            wait_replication(upload_status, cell['url']), cell['payload_size'], cell_vps_urls,
+                            plan.get('coordinated', False), deadline_at, plan.get('warm', 0), plan.get('verify')
+                        ),
+                        [plan['uuid'], cell['uuid']], deadline_at
+                    )
+                except TestCancelled:
+                    upload_status.finished_with_exception('Test cancelled')
+                    await abort_test(cell['uuid'], cell_vps_urls)
+                except asyncio.TimeoutError:
+                    upload_status.finished_with_exception('Deadline exceeded')
+                    await abort_test(cell['uuid'], cell_vps_urls)
+                except IntegrityError as e:
+                    upload_status.finished_with_exception(f'Source integrity check failed: {e}')
+                except ClientResponseError as e:
+                    upload_status.finished_with_exception(f'Couldn\'t get file from \'{cell["url"]}\': {e.status} {e.message}')
+                except Exception as e:
+                    current_app.logger.error(e)
+                    upload_status.finished_with_exception('error while running test')
+
+                upload_status.regressions = await evaluate_regressions(
+                    upload_status.uuid, upload_status.get_status(), cell['url'], cell['speed'], cell['amount'], cell['payload_size']
+                )
+                upload_status.finished()
+                save_test(upload_status, cell['url'], time.monotonic() - start_time)
+
+                batch_status.cell_update_status(index, 2, upload_status.get_status())
+
+        await asyncio.gather(*(run_cell(index, cell) for index, cell in enumerate(plan['cells'])))
+
+        results = await asyncio.gather(*(replication for _, replication in replications.values()), return_exceptions=True)
+        for url, result in zip(replications, results):
+            if isinstance(result, BaseException):
+                # failure is already reported by cells, cancelled replication cleans up itself
+                continue
+            try:
+                await release_source(*result)
+            except Exception as e:
+                current_app.logger.error(f'Couldn\'t release source of \'{url}\': {e}')
 
-                upload_status.tebi_status = 1  # uploading file
+        if is_cancel_requested(plan['uuid']):
+            batch_status.finished_with_exception('Test cancelled')
+        else:
+            batch_status.finished()
+        current_app.logger.info(f'finished batch {batch_status.uuid}, cells: {len(plan["cells"])}')
 
-                with open(new_temp_file.name, 'rb') as f:
-                    get_bucket().put_object(Key=file_name, Body=f)
+    except Exception as e:
+        current_app.logger.error(e)
+        raise e
+    finally:
+        monopoly_model.end_mode(monopoly)
 
-                new_temp_file.close()
-                os.unlink(new_temp_file.name)
 
-    upload_status.tebi_status = 2  # waiting for replication
+async def run_upload_test(url, upload_status: UploadStatus, speed, amount, replication, payload_size=None, vps_urls=None, coordinated=False, deadline_at=None, warm=0, verify=None):
+    '''
+    runs object test and, once `replication` is done, tests of all storages
+    of `upload_status` at once on every vps
 
-    s3_client = tebi_get_client()
+    `replication` is awaitable returning tuple `source_key`, `file_name`,
+    it is awaited while object test is already running
 
-    def is_all_replicated(replication_status):
-        return replication_status == correct_replication_status
+    returns result of `replication`
+    '''
+    object_json = {'url': url, 'speed': speed, 'amount': amount}
+    if warm:
+        object_json['warm'] = warm
+    if verify:
+        object_json['verify'] = verify
+    upload_object_task = asyncio.create_task(publish(
+        api_upload_url_endpoint, object_json, 'object', upload_status, vps_urls, coordinated, deadline_at
+    ))
 
-    replication_complete = False
-    tries = 0
-    while not replication_complete and tries < 20:
+    try:
         try:
-            resp = s3_client.head_object(Bucket=current_app.config['TEBI_BUCKET'], Key=file_name)
-            replication_status = resp.get('ResponseMetadata', {}).get('HTTPHeaders', {}).get('x-tb-replication', None)
-
-            if is_all_replicated(replication_status):
-                replication_complete = True
-                upload_status.tebi_status = 3  # replication complete
-                upload_status.tebi_servers = replication_status
+            source_key, file_name = await replication
+        except Exception:
+            await asyncio.gather(upload_object_task, return_exceptions=True)
+            raise
 
+        try:
+            await asyncio.gather(upload_object_task)
+            await asyncio.gather(*(
+                publish_storage(storage, file_name, upload_status, speed, amount, payload_size, vps_urls, coordinated, deadline_at, warm, verify)
+                for storage in upload_status.storages
+            ))
         except Exception as e:
-            print(f"Error checking replication status: {e}")
-            break
-
-        if not replication_complete:
-            tries += 1
-            await asyncio.sleep(2)
-
-    return file_name, file_size
-
+            current_app.logger.error(e)
+            upload_status.finished_with_exception('error while uploading file to vps')
+    finally:
+        # no-op when finished, stops object test when cancelled
+        upload_object_task.cancel()
 
-async def publish(upload_endpoint, json_data, storage_type, upload_status: UploadStatus):
-    vps_urls: dict = current_app.config['VPS_URLS'].copy()
+    return source_key, file_name
 
-    async def make_post(session, vps_name, vps_url, endpoint, json, storage_type) -> tuple[ClientResponse, dict]:
-        upload_status.vps_update_status(vps_name, storage_type, 1)
 
-        resp: ClientResponse
-        async with session.post(f'{vps_url}{endpoint}', json=json) as resp:
-            if not resp.ok:
-                current_app.logger.error(f'Couldn\'t publish to host \'{vps_url}{endpoint}\'. Response: {resp.status} {resp.reason}')
-                upload_status.vps_failed_status(vps_name, storage_type)
-                return
+async def publish_storage(storage, file_name, upload_status: UploadStatus, speed, amount, payload_size=None, vps_urls=None, coordinated=False, deadline_at=None, warm=0, verify=None):
+    '''
+    runs test of `storage` on every vps, `file_name` is replicated to primary storage only,
+    so other storages get a copy of the same size for the duration of the test
+    (vps seed fixtures of `payload_size` by themselves)
 
-            resp_dict: dict = await resp.json()
+    digest of verified source is sent along to primary storage, so vps compare
+    what they download with what was uploaded
+    '''
+    storage_json = {'file_name': file_name, 'speed': speed, 'amount': amount}
+    if payload_size is not None:
+        storage_json['payload_size'] = payload_size
+    if warm:
+        storage_json['warm'] = warm
+    if verify:
+        storage_json['verify'] = verify
+
+    if storage == PRIMARY_STORAGE:
+        integrity = upload_status.integrity
+        if payload_size is None and integrity is not None and integrity['algorithm'] == verify:
+            storage_json['digest'] = integrity['digest']
+        await publish(api_upload_tebi_endpoint, storage_json, storage, upload_status, vps_urls, coordinated, deadline_at)
+        return
 
-            upload_status.vps_complete_status(
-                vps_name=vps_name,
-                storage=storage_type,
-                ip=resp_dict.get('file_ip'),
-                time=float(resp_dict.get('time')),
-                ttfb=float(resp_dict.get('ttfb')),
-                latency=float(resp_dict.get('latency')),
-            )
+    backend = get_storage(storage)
+    staged = payload_size is None
+    try:
+        await asyncio.to_thread(backend.ensure_bucket)
+        if staged:
+            await asyncio.to_thread(backend.get_bucket().upload_fileobj, PayloadReader(int(upload_status.file_size * 1024)), file_name)
+    except Exception as e:
+        current_app.logger.error(f'Couldn\'t stage \'{file_name}\' on storage \'{storage}\': {e}')
+        for vps_name in (vps_urls if vps_urls is not None else Vps.get_urls()):
+            upload_status.vps_failed_status(vps_name, storage)
+        return
 
-    async with ClientSession() as session:
-        for vps_name, vps_url in vps_urls.items():
+    try:
+        await publish(api_upload_storage_endpoint, dict(storage_json, storage=storage), storage, upload_status, vps_urls, coordinated, deadline_at)
+    finally:
+        if staged:
             try:
-                await make_post(session, vps_name, vps_url, upload_endpoint, json_data, storage_type)
+                await asyncio.to_thread(backend.delete_object, file_name)
             except Exception as e:
-                current_app.logger.error(e)
-                upload_status.vps_failed_status(vps_name, storage_type)
+                current_app.logger.error(f'Couldn\'t delete \'{file_name}\' from storage \'{storage}\': {e}')
 
 
-async def upload_file(file, file_name):
-    with tempfile.NamedTemporaryFile(delete=False) as temp:
-        file.save(temp.name)
+async def abort_test(test_id, vps_urls: dict = None):
+    '''asks every vps to stop transfers of `test_id`, best effort'''
+    if vps_urls is None:
+        vps_urls = Vps.get_urls()
 
-        # here can be saving file
+    async def post_cancel(session, vps_url):
+        try:
+            async with session.post(f'{vps_url}{api_cancel_endpoint}', json={'test_id': test_id}) as resp:
+                await resp.read()
+        except Exception as e:
+            current_app.logger.info(f'Couldn\'t abort test {test_id} on \'{vps_url}\': {e!r}')
 
-        temp.close()
-        os.unlink(temp.name)
+    async with ClientSession(timeout=ClientTimeout(total=current_app.config['VPS_PROBE_TIMEOUT'])) as session:
+        await asyncio.gather(*(post_cancel(session, vps_url) for vps_url in vps_urls.values()))
 
 
-async def upload_file_by_chunks(stream: ClientResponse, downloading_speed):
-    with tempfile.NamedTemporaryFile(delete=False) as temp:
-        start_time = time.monotonic()
-        total_bytes_downloaded = 0
+def save_test(upload_status: UploadStatus, url, execution_time):
+    '''test is buffered and written to database in a batch (`app.main.persistence`)'''
+    persistence.save_test(upload_status.uuid, url, format_download_time(execution_time), upload_status.to_json())
 
-        while True:
-            chunk = await stream.content.read(CHUNK_SIZE)
-            if not chunk:
-                break
-            temp.write(chunk)
 
-            total_bytes_downloaded += len(chunk)
+async def replicate_url(url, upload_status: UploadStatus, deadline_at=None, verify=None):
+    '''
+    returns tuple `file_name`, `file_size`, download and replication wait stop at `deadline_at`,
+    lag of every region of `TEBI_REPLICATION_TOPOLOGY` is stored to `upload_status.tebi_replication`
 
-            elapsed_time = time.monotonic() - start_time
-            expected_time = total_bytes_downloaded / (downloading_speed * 1024 * 1024)
-            if elapsed_time < expected_time:
-                time.sleep(expected_time - elapsed_time)
-        temp.seek(0)
+    with `verify` (hash algorithm) source is hashed while downloaded and compared with its
+    Content-Length and ETag, digest is stored to `upload_status.integrity`
 
-        # here can be saving file
+    raises `ClientResponseError` if source can't be downloaded, `IntegrityError` if it doesn't match,
+    uploaded file is deleted when replication doesn't return (error, cancel or deadline)
+    '''
 
-        temp.close()
-        os.unlink(temp.name)
+    file_name: str = time.strftime('%Y-%m-%d_%H-%M-%S_') + url.split('/')[-1]
+    uploading = False
+    returned = False
 
-    actual_download_speed = total_bytes_downloaded / (1024 * 1024 * elapsed_time)
-    current_app.logger.info(f'downloading speed object: {actual_download_speed}mbps')
+    try:
+        timeout = ClientTimeout(total=max(deadline_at - time.time(), 0)) if deadline_at is not None else ClientTimeout()
+        async with ClientSession(timeout=timeout) as session:
+            async with session.get(url) as resp:
+                if not resp.ok:
+                    current_app.logger.error(f'Couldn\'t get file from \'{url}\'. Response: {resp}')
+                resp.raise_for_status()
+
+                hasher = StreamHasher(verify) if verify else None
+                file_size = 0
+                with tempfile.TemporaryFile() as temp:
+                    while True:
+                        chunk = await resp.content.read(CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        file_size += len(chunk)
+                        temp.write(chunk)
+                        if hasher is not None:
+                            hasher.update(chunk)
+
+                    if hasher is not None:
+                        checks = hasher.verify_response(resp.headers)
+                        upload_status.integrity = get_integrity_summary([hasher], checks)
+
+                    upload_status.file_size = file_size / 1024
+                    upload_status.tebi_status = 1  # uploading file
+
+                    temp.seek(0)
+                    uploading = True
+                    get_bucket().put_object(Key=file_name, Body=temp)
+
+        upload_status.tebi_status = 2  # waiting for replication
+
+        primary_storage = get_storage(PRIMARY_STORAGE)
+
+        tracker = ReplicationTracker(parse_replication(current_app.config['TEBI_REPLICATION_TOPOLOGY']))
+        poll_interval = current_app.config['TEBI_REPLICATION_POLL_INTERVAL']
+        replication_deadline = time.time() + current_app.config['TEBI_REPLICATION_TIMEOUT']
+        if deadline_at is not None:
+            replication_deadline = min(replication_deadline, deadline_at)
+
+        while not tracker.complete and time.time() < replication_deadline:
+            try:
+                resp = primary_storage.head_object(file_name)
+                replication_status = resp.get('ResponseMetadata', {}).get('HTTPHeaders', {}).get('x-tb-replication', None)
 
+                tracker.update(replication_status)
+            except Exception as e:
+                current_app.logger.error(f'Error checking replication status of \'{file_name}\': {e}')
+                break
 
-def get_ip_from_url(url):
-    ext = extract(url)
+            if not tracker.complete:
+                await asyncio.sleep(poll_interval)
 
-    if not ext.suffix:
-        return ext.domain
+        upload_status.tebi_replication = tracker.get_regions()
+        if tracker.complete:
+            upload_status.tebi_status = 3  # replication complete
+            upload_status.tebi_servers = tracker.header
+        else:
+            current_app.logger.info(f'Replication of \'{file_name}\' incomplete: {tracker.header}')
 
-    subdomain = ext.subdomain if ext.subdomain else 'www'
-    return socket.gethostbyname(subdomain + '.' + ext.domain + '.' + ext.suffix)
+        returned = True
+        return file_name, file_size
+    finally:
+        # nobody will release file of failed replication
+        if uploading and not returned:
+            try:
+                delete_tebi_object(file_name)
+            except Exception as e:
+                current_app.logger.error(f'Couldn\'t delete \'{file_name}\': {e}')
 
 
-def format_download_time(seconds: float):
-    return round(seconds * 1000, 3)
+async def replicate_url_cached(url, upload_status: UploadStatus, deadline_at=None, verify=None):
+    '''
+    same as `replicate_url`, but reuses file already replicated to tebi
+    if source behind `url` didn't change
 
+    returns tuple `source_key`, `file_name`. `source_key` is None if file
+    is not cached and must be deleted after test
+    '''
+    source_cache = SourceCache()
+    source_key = None
+    if source_cache.enabled:
+        source_key = SourceCache.make_key(url, await SourceCache.get_validators(url))
 
-def tebi_get_client():
-    return boto3.client(
-        service_name='s3',
-        aws_access_key_id=current_app.config['TEBI_KEY'],
-        aws_secret_access_key=current_app.config['TEBI_SECRET'],
-        endpoint_url='https://s3.tebi.io'
-    )
+    if source_key is None:
+        upload_status.source_cached = False
+        file_name, _ = await replicate_url(url, upload_status, deadline_at, verify)
+        return None, file_name
 
+    lock = await source_cache.lock(source_key)
+    try:
+        entry = source_cache.acquire(source_key)
+        if entry is not None:
+            current_app.logger.info(f'Source cache hit for \'{url}\': {entry["file_name"]}')
+            upload_status.source_cached = True
+            upload_status.file_size = entry['file_size']
+            upload_status.tebi_status = 3  # replication complete
+            upload_status.tebi_servers = entry['tebi_servers']
+            return source_key, entry['file_name']
+
+        upload_status.source_cached = False
+        file_name, _ = await replicate_url(url, upload_status, deadline_at, verify)
+
+        if upload_status.tebi_status != 3:
+            return None, file_name
+
+        source_cache.add(source_key, url, file_name, upload_status.file_size, upload_status.tebi_servers)
+        return source_key, file_name
+    finally:
+        lock.release()
 
-def get_bucket():
-    return boto3.resource(
-        service_name='s3',
-        aws_access_key_id=current_app.config['TEBI_KEY'],
-        aws_secret_access_key=current_app.config['TEBI_SECRET'],
-        endpoint_url='https://s3.tebi.io'
-    ).Bucket(current_app.config['TEBI_BUCKET'])
 
+async def release_source(source_key, file_name):
+    '''
+    deletes uncached source, cached one is only released, unused entries are deleted
+    by `job_evict_source_cache`, so tests don't wait for storage
+    '''
+    if source_key is None:
+        await asyncio.to_thread(delete_tebi_object, file_name)
+        return
 
-def calculate_downloading_speed(speed):
-    return speed * 1024 * 1024 / 8
+    SourceCache().release(file_name)
 
 
-@bp.before_request
-def before_request():
-    request.start_time = time.time()
+def delete_tebi_object(file_name):
+    get_storage(PRIMARY_STORAGE).delete_object(file_name)
 
 
-@bp.after_request
-def after_request(response):
-    ttfb = time.time() - request.start_time
-    response.headers['X-TTFB'] = str(ttfb)
-    return response
+async def publish(upload_endpoint, json_data, storage_type, upload_status: UploadStatus, vps_urls: dict = None, coordinated=False, deadline_at=None):
+    '''
+    runs test on every vps one by one, or on all vps at once if `coordinated`
 
+    coordinated start: clock offset and rtt of every vps are measured, then every vps
+    gets `start_at` in its own clock and waits for it before transfer
 
-# Routes
+    vps with open circuit are marked failed without being contacted,
+    every vps gets `test_id` and remaining time until `deadline_at` as `timeout`
+    '''
+    if vps_urls is None:
+        vps_urls = Vps.get_urls()
+    vps_urls = vps_urls.copy()
+
+    registry = {vps.name: vps for vps in Vps.query.filter(Vps.name.in_(list(vps_urls.keys())))}
+    for vps_name in list(vps_urls.keys()):
+        vps = registry.get(vps_name)
+        if vps is not None and vps.circuit_open:
+            current_app.logger.info('Skipping \'%s\', circuit is open until %s', vps_name, vps.circuit_open_until)
+            upload_status.vps_failed_status(vps_name, storage_type)
+            del vps_urls[vps_name]
+
+    async def make_command(session, vps_name, vps_url, endpoint, json, storage_type):
+        '''
+        returns tuple `status`, `json`, sent over control channel when it is enabled
+        and sub-host supports it, otherwise as http post
+        '''
+        if current_app.config['CONTROL_CHANNEL']:
+            def on_progress(progress):
+                upload_status.vps_progress_status(vps_name, storage_type, progress.get('bytes', 0))
 
+            try:
+                return await asyncio.wait_for(control_client.request(
+                    f'{vps_url}{api_control_endpoint}', current_app.config['CONTROL_HEARTBEAT'], endpoint, json, on_progress,
+                    current_app.config['CONTROL_UNAVAILABLE_TTL']
+                ), json.get('timeout'))
+            except ControlUnavailable as e:
+                # command wasn't sent, closed channel fails the command instead
+                current_app.logger.info('Control channel to \'%s\' is not available, using http: %s', vps_url, e)
 
-@bp.route('/')
-async def index():
+        resp: ClientResponse
+        request_timeout = ClientTimeout(total=json['timeout']) if json.get('timeout') is not None else None
+        async with session.post(f'{vps_url}{endpoint}', json=json, timeout=request_timeout) as resp:
+            if not resp.ok:
+                return resp.status, {'error': resp.reason}
+            return resp.status, await resp.json()
+
+    async def make_post(session, vps_name, vps_url, endpoint, json, storage_type):
+        upload_status.vps_update_status(vps_name, storage_type, 1)
+
+        json = dict(json, test_id=upload_status.uuid)
+        if deadline_at is not None:
+            json['timeout'] = max(deadline_at - time.time(), 0)
+
+        status, resp_dict = await make_command(session, vps_name, vps_url, endpoint, json, storage_type)
+        if status != 200:
+            # counted as failure of host by `try_post`
+            raise ClientError(f'Host \'{vps_url}{endpoint}\' answered {status}: {resp_dict.get("error")}')
+        if 'error' in resp_dict:
+            current_app.logger.error('Couldn\'t publish to host \'%s%s\'. Response: %s %s', vps_url, endpoint, status, resp_dict.get('error'))
+            upload_status.vps_failed_status(vps_name, storage_type)
+            return
+
+        upload_status.vps_complete_status(
+            vps_name=vps_name,
+            storage=storage_type,
+            ip=resp_dict.get('file_ip'),
+            time=float(resp_dict.get('time')),
+            ttfb=float(resp_dict.get('ttfb')),
+            latency=float(resp_dict.get('latency')),
+            start_delay=resp_dict.get('start_delay'),
+            throughput=resp_dict.get('throughput'),
+            warm=resp_dict.get('warm'),
+            integrity=resp_dict.get('integrity'),
+            resources=resp_dict.get('resources'),
+        )
+        return resp_dict
+
+    async def try_post(session, vps_name, vps_url, endpoint, json, storage_type):
+        vps = registry.get(vps_name)
+        try:
+            resp_dict = await make_post(session, vps_name, vps_url, endpoint, json, storage_type)
+        except Exception as e:
+            current_app.logger.error(e)
+            upload_status.vps_failed_status(vps_name, storage_type)
+            if vps is not None:
+                vps.record_failure()
+            return None
+
+        if vps is not None and vps.failures:
+            vps.record_success()
+        return resp_dict
+
+    timeout = ClientTimeout(total=current_app.config['VPS_REQUEST_TIMEOUT'], sock_connect=current_app.config['VPS_CONNECT_TIMEOUT'])
+    async with ClientSession(timeout=timeout) as session:
+        if not coordinated:
+            for vps_name, vps_url in vps_urls.items():
+                await try_post(session, vps_name, vps_url, upload_endpoint, json_data, storage_type)
+            return
+
+        async def try_measure_clock(vps_name, vps_url):
+            try:
+                return await measure_clock(session, f'{vps_url}{api_clock_endpoint}', current_app.config['CLOCK_SAMPLES'])
+            except Exception as e:
+                current_app.logger.error(f'Couldn\'t measure clock of \'{vps_url}\': {e}')
+                upload_status.vps_failed_status(vps_name, storage_type)
+
+        clocks = dict(zip(vps_urls.keys(), await asyncio.gather(*(
+            try_measure_clock(vps_name, vps_url) for vps_name, vps_url in vps_urls.items()
+        ))))
+        clocks = {vps_name: clock for vps_name, clock in clocks.items() if clock is not None}
+        if not clocks:
+            return
+
+        start_at = time.time() + max(rtt for _, rtt in clocks.values()) + current_app.config['COORDINATED_START_MARGIN']
+        current_app.logger.info('Coordinated start at %s, clocks: %s', start_at, clocks)
+
+        results = await asyncio.gather(*(
+            try_post(session, vps_name, vps_urls[vps_name], upload_endpoint, dict(json_data, start_at=start_at + offset), storage_type)
+            for vps_name, (offset, _) in clocks.items()
+        ))
+
+        # actual start of every vps in main host clock
+        started_at = [
+            resp_dict['started_at'] - clocks[vps_name][0]
+            for vps_name, resp_dict in zip(clocks.keys(), results)
+            if resp_dict and resp_dict.get('started_at') is not None
+        ]
+        if started_at:
+            upload_status.set_start_skew(storage_type, format_download_time(max(started_at) - min(started_at)))
+
+
+async def upload_file(file, file_name):
+    with tempfile.NamedTemporaryFile(delete=False) as temp:
+        file.save(temp.name)
+
+        # here can be saving file
+
+        temp.close()
+        os.unlink(temp.name)
+
+
+def parse_speed(json: dict):
+    '''
+    returns tuple `speed`, `error`
+    '''
+    try:
+        speed = int(json.get('speed', 100))
+    except (TypeError, ValueError):
+        return None, 'Speed must be integer'
+
+    if speed < 1:
+        return None, 'Speed must be greater than 1'
+    return speed, None
+
+
+def parse_start_at(json: dict):
+    '''
+    returns tuple `start_at`, `error`
+    '''
+    if json.get('start_at') is None:
+        return None, None
+
+    try:
+        start_at = float(json.get('start_at'))
+    except (TypeError, ValueError):
+        return None, '\'start_at\' must be unix timestamp'
+
+    if start_at - time.time() > current_app.config['COORDINATED_START_MAX_WAIT']:
+        return None, '\'start_at\' is too far in the future'
+    return start_at, None
+
+
+def parse_deadline(json: dict):
+    '''
+    returns tuple `test_id`, `timeout`, `error`, `timeout` is seconds left until deadline of test
+    '''
+    test_id = json.get('test_id')
+    if json.get('timeout') is None:
+        return test_id, None, None
+
+    try:
+        timeout = float(json.get('timeout'))
+    except (TypeError, ValueError):
+        return None, None, '\'timeout\' must be number of seconds'
+
+    if timeout < 0:
+        return None, None, '\'timeout\' must not be negative'
+    return test_id, timeout, None
+
+
+def parse_warm(json: dict):
+    '''
+    returns tuple `warm`, `error`, `warm` is amount of measured requests on warm connection
+    '''
+    try:
+        warm = int(json.get('warm', 0))
+    except (TypeError, ValueError):
+        return None, '\'warm\' must be integer'
+
+    if warm < 0 or warm > current_app.config['WARM_MAX_REQUESTS']:
+        return None, f'\'warm\' must be between 0 and {current_app.config["WARM_MAX_REQUESTS"]}'
+    return warm, None
+
+
+def parse_upload_url_request(json: dict):
+    '''
+    returns tuple `params`, `error`, `params` are keyword arguments of `measure_upload_url`
+    '''
+    amount = int(json.get('amount', 1))
+    if amount < 1 or amount > 100:
+        return None, 'amount must be greater than 0 and less than 100'
+
+    url = json.get('url')
+    if not url:
+        return None, 'No url provided'
+
+    speed, error = parse_speed(json)
+    if error:
+        return None, error
+
+    start_at, error = parse_start_at(json)
+    if error:
+        return None, error
+
+    test_id, timeout, error = parse_deadline(json)
+    if error:
+        return None, error
+
+    warm, error = parse_warm(json)
+    if error:
+        return None, error
+
+    verify, digest, error = parse_verify(json)
+    if error:
+        return None, error
+
+    return {
+        'url': url, 'speed': speed, 'amount': amount, 'start_at': start_at, 'test_id': test_id, 'timeout': timeout,
+        'warm': warm, 'verify': verify, 'digest': digest,
+    }, None
+
+
+def parse_upload_tebi_request(json: dict):
+    '''
+    returns tuple `params`, `error`, `params` are keyword arguments of `measure_upload_tebi`
+    '''
+    storage = json.get('storage', PRIMARY_STORAGE)
+    if get_storage(storage) is None:
+        return None, f'Unknown storage \'{storage}\''
+
+    amount = int(json.get('amount', 1))
+    payload_size = None
+    file_name = None
+    if amount >= 2 and amount <= 100:
+        payload_size, error = get_payload_size(json.get('payload_size', CHUNK_SIZE))
+        if error:
+            return None, error
+    elif amount == 1:
+        file_name = json.get('file_name')
+        if not file_name:
+            return None, 'No file_name provided'
+    else:
+        return None, 'amount must be greater than 0 and less than 100'
+
+    speed, error = parse_speed(json)
+    if error:
+        return None, error
+
+    start_at, error = parse_start_at(json)
+    if error:
+        return None, error
+
+    test_id, timeout, error = parse_deadline(json)
+    if error:
+        return None, error
+
+    warm, error = parse_warm(json)
+    if error:
+        return None, error
+
+    verify, digest, error = parse_verify(json)
+    if error:
+        return None, error
+
+    return {
+        'file_name': file_name, 'speed': speed, 'amount': amount, 'payload_size': payload_size,
+        'start_at': start_at, 'test_id': test_id, 'timeout': timeout, 'storage': storage, 'warm': warm,
+        'verify': verify, 'digest': digest,
+    }, None
+
+
+async def measure_upload_url(url, speed, amount, session: ClientSession = None, on_progress=None, start_at=None, test_id=None, timeout=None, warm=0, verify=None, digest=None):
+    '''
+    downloads `url` with `speed` limit over a new connection, `session` is reused if provided,
+    `on_progress(downloaded_bytes, elapsed_seconds)` is called after every chunk,
+    transfer doesn't start before local unix timestamp `start_at`,
+    it is stopped after `timeout` seconds or when `test_id` is cancelled
+
+    with `warm` requests a connection of `session` is warmed up by an unmeasured HEAD
+    request and then `url` is downloaded `warm` times over pooled connections of `session`
+
+    with `verify` (hash algorithm) every transfer is hashed and compared with Content-Length,
+    ETag and `digest`, mismatch fails the measurement
+
+    resources used by the process and host meanwhile are returned as `resources` (see `ResourceMeter`)
+
+    returns response of `api_upload_url`
+    '''
+    if session is None:
+        async with ClientSession() as session:
+            return await measure_upload_url(url, speed, amount, session, on_progress, start_at, test_id, timeout, warm, verify, digest)
+
+    if is_cancelled(test_id):
+        return {'error': 'Test cancelled'}
+
+    with track(test_id), ResourceMeter() as meter:
+        try:
+            result = await asyncio.wait_for(_measure_upload_url(url, speed, amount, session, on_progress, start_at, warm, verify, digest), timeout)
+        except asyncio.TimeoutError:
+            current_app.logger.info('Deadline of test %s exceeded while uploading \'%s\'', test_id, url)
+            return {'error': 'Deadline exceeded'}
+        except asyncio.CancelledError:
+            if not is_cancelled(test_id):
+                raise
+            current_app.logger.info('Test %s cancelled while uploading \'%s\'', test_id, url)
+            return {'error': 'Test cancelled'}
+    return meter.attach(result)
+
+
+async def _measure_upload_url(url, speed, amount, session: ClientSession, on_progress=None, start_at=None, warm=0, verify=None, digest=None):
+    if start_at is not None:
+        await wait_until(start_at)
+    started_at = time.time()
+
+    hashers = []
+    checks = []
+
+    # cold request never reuses a pooled connection of `session`, dns, tcp and tls are measured
+    start_time = time.monotonic()
+    async with ClientSession(connector=TCPConnector(force_close=True)) as cold_session, cold_session.get(url) as resp:
+        if resp.ok:
+            ttfb = time.monotonic() - start_time
+            hasher = StreamHasher(verify) if verify else None
+
+            transfer_start_time = time.monotonic()
+            downloaded_bytes = 0
+            for i in range(amount):
+                downloaded_bytes += await upload_file_by_chunks(resp, speed, on_progress, hasher)
+            elapsed_time = time.monotonic() - start_time
+            transfer_time = time.monotonic() - transfer_start_time
+
+            if hasher is not None:
+                hashers.append(hasher)
+                try:
+                    checks += hasher.verify_response(resp.headers, digest)
+                except IntegrityError as e:
+                    current_app.logger.error('Integrity check of \'%s\' failed: %s', url, e)
+                    return {'error': f'Integrity check failed: {e}', 'integrity': get_integrity_summary(hashers, checks)}
+
+            result = {
+                'vps_name': current_app.config['HOST_NAME'],
+                'file_ip': await asyncio.to_thread(get_ip_from_url, url),
+                'time': format_download_time(elapsed_time),
+                'ttfb': format_download_time(ttfb),
+                'latency': format_download_time(ttfb / 2),
+                'throughput': format_throughput(downloaded_bytes, transfer_time),
+                **get_start_info(start_at, started_at),
+            }
+        else:
+            current_app.logger.error('Couldn\'t upload file by url \'%s\'. Response: %s', url, resp)
+            return {
+                'error': f'Couldn\'t upload file by url \'{url}\'. Response: {resp}',
+            }
+
+    if warm:
+        async with session.head(url) as resp:
+            pass
+
+        samples = []
+        for i in range(warm):
+            request_start_time = time.monotonic()
+            async with session.get(url) as resp:
+                if not resp.ok:
+                    current_app.logger.error('Couldn\'t upload file by url \'%s\' on warm connection. Response: %s', url, resp)
+                    return {
+                        'error': f'Couldn\'t upload file by url \'{url}\' on warm connection. Response: {resp}',
+                    }
+                request_ttfb = time.monotonic() - request_start_time
+                hasher = StreamHasher(verify) if verify else None
+
+                transfer_start_time = time.monotonic()
+                downloaded_bytes = await upload_file_by_chunks(resp, speed, hasher=hasher)
+                samples.append((request_ttfb, time.monotonic() - request_start_time, downloaded_bytes, time.monotonic() - transfer_start_time))
+
+                if hasher is not None:
+                    hashers.append(hasher)
+                    try:
+                        checks += hasher.verify_response(resp.headers, digest)
+                    except IntegrityError as e:
+                        current_app.logger.error('Integrity check of \'%s\' on warm connection failed: %s', url, e)
+                        return {'error': f'Integrity check failed: {e}', 'integrity': get_integrity_summary(hashers, checks)}
+        result['warm'] = summarize_warm(samples)
+
+    if hashers:
+        result['integrity'] = get_integrity_summary(hashers, checks)
+    return result
+
+
+def measure_upload_tebi(file_name, speed, amount, payload_size=None, on_progress=None, start_at=None, test_id=None, timeout=None, storage=PRIMARY_STORAGE, warm=0, verify=None, digest=None):
+    '''
+    downloads `file_name` from `storage` (tebi by default) `amount` times with `speed` limit,
+    generated fixture of `payload_size` bytes is used if `payload_size` is set,
+    `on_progress(downloaded_bytes, elapsed_seconds)` is called after every chunk,
+    transfer doesn't start before local unix timestamp `start_at`,
+    it is stopped after `timeout` seconds or when `test_id` is cancelled
+
+    every download above gets a new client (cold connection), with `warm` requests
+    one client is warmed up by an unmeasured request and then downloads `file_name`
+    `warm` times over its pooled connection
+
+    with `verify` (hash algorithm) every download is hashed and compared with ContentLength,
+    ETag and `digest`, mismatch fails the measurement
+
+    resources used by the process and host meanwhile are returned as `resources` (see `ResourceMeter`)
+
+    blocking, returns response of `api_upload_tebi`
+    '''
+    with ResourceMeter() as meter:
+        result = _measure_upload_tebi(file_name, speed, amount, payload_size, on_progress, start_at, test_id, timeout, storage, warm, verify, digest)
+    return meter.attach(result)
+
+
+def _measure_upload_tebi(file_name, speed, amount, payload_size, on_progress, start_at, test_id, timeout, storage, warm, verify, digest):
+    deadline = time.monotonic() + timeout if timeout is not None else None
+
+    def interrupted():
+        if is_cancelled(test_id):
+            current_app.logger.info('Test %s cancelled while uploading \'%s\'', test_id, file_name)
+            return {'error': 'Test cancelled'}
+        if deadline is not None and time.monotonic() > deadline:
+            current_app.logger.info('Deadline of test %s exceeded while uploading \'%s\'', test_id, file_name)
+            return {'error': 'Deadline exceeded'}
+        return None
+
+    backend = get_storage(storage)
+
+    if payload_size is not None:
+        file_name = ensure_storage_fixture(payload_size, storage)
+
+    if start_at is not None:
+        wait_until_sync(start_at)
+    started_at = time.time()
+
+    error = interrupted()
+    if error:
+        return error
+
+    head_start_time = time.monotonic()
+    backend.head_object(file_name)
+    latency = time.monotonic() - head_start_time
+
+    hashers = []
+    checks = []
+
+    def verified(response, hasher):
+        '''returns error response if download doesn't match the object'''
+        if hasher is None:
+            return None
+
+        hashers.append(hasher)
+        try:
+            checks.extend(hasher.verify(response.get('ContentLength'), response.get('ETag'), digest))
+        except IntegrityError as e:
+            current_app.logger.error('Integrity check of \'%s\' on \'%s\' failed: %s', file_name, storage, e)
+            return {'error': f'Integrity check failed: {e}', 'integrity': get_integrity_summary(hashers, checks)}
+        return None
+
+    start_time = time.monotonic()
+    total_bytes_downloaded = 0
+    ttfb = None
+
+    for i in range(amount):
+        request_start_time = time.monotonic()
+        response = backend.get_bucket().Object(file_name).get()
+        body = response['Body']
+        if ttfb is None:
+            ttfb = time.monotonic() - request_start_time
+        hasher = StreamHasher(verify) if verify else None
+
+        with tempfile.NamedTemporaryFile() as temp:
+            while True:
+                chunk = body.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                temp.write(chunk)
+                if hasher is not None:
+                    hasher.update(chunk)
+
+                total_bytes_downloaded += len(chunk)
+
+                error = interrupted()
+                if error:
+                    body.close()
+                    return error
+
+                elapsed_time = time.monotonic() - start_time
+                if on_progress is not None:
+                    on_progress(total_bytes_downloaded, elapsed_time)
+
+                expected_time = total_bytes_downloaded / (speed * 1024 * 1024)
+                if elapsed_time < expected_time:
+                    time.sleep(expected_time - elapsed_time)
+
+            # here can be saving file
+
+        error = verified(response, hasher)
+        if error:
+            return error
+
+    elapsed_time = time.monotonic() - start_time
+    actual_download_speed = total_bytes_downloaded / (1024 * 1024 * elapsed_time)
+    current_app.logger.info('downloading speed %s: %smbps', storage, actual_download_speed)
+
+    result = {
+        'vps_name': current_app.config['HOST_NAME'],
+        'file_ip': get_ip_from_url(backend.endpoint_url),
+        'time': format_download_time(elapsed_time),
+        'ttfb': format_download_time(ttfb),
+        'latency': format_download_time(latency / 2),
+        'throughput': format_throughput(total_bytes_downloaded, elapsed_time - ttfb),
+        **get_start_info(start_at, started_at),
+    }
+
+    if warm:
+        bucket = backend.get_bucket()
+        samples = []
+        for i in range(warm + 1):
+            request_start_time = time.monotonic()
+            response = bucket.Object(file_name).get()
+            body = response['Body']
+            request_ttfb = time.monotonic() - request_start_time
+            hasher = StreamHasher(verify) if verify else None
+
+            transfer_start_time = time.monotonic()
+            downloaded_bytes = 0
+            while True:
+                chunk = body.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                downloaded_bytes += len(chunk)
+                if hasher is not None:
+                    hasher.update(chunk)
+
+                error = interrupted()
+                if error:
+                    body.close()
+                    return error
+
+                elapsed_time = time.monotonic() - transfer_start_time
+                expected_time = downloaded_bytes / (speed * 1024 * 1024)
+                if elapsed_time < expected_time:
+                    time.sleep(expected_time - elapsed_time)
+
+            # first request only opens the connection
+            if i:
+                samples.append((request_ttfb, time.monotonic() - request_start_time, downloaded_bytes, time.monotonic() - transfer_start_time))
+
+            error = verified(response, hasher)
+            if error:
+                return error
+        result['warm'] = summarize_warm(samples)
+
+    if hashers:
+        result['integrity'] = get_integrity_summary(hashers, checks)
+    return result
+
+
+def get_start_info(start_at, started_at):
+    '''
+    `started_at` (local unix timestamp) and `start_delay` (ms after `start_at`) of coordinated start
+    '''
+    if start_at is None:
+        return {}
+    return {'started_at': started_at, 'start_delay': format_download_time(started_at - start_at)}
+
+
+async def upload_file_by_chunks(stream: ClientResponse, downloading_speed, on_progress=None, hasher: StreamHasher = None):
+    with tempfile.NamedTemporaryFile(delete=False) as temp:
+        start_time = time.monotonic()
+        total_bytes_downloaded = 0
+
+        while True:
+            chunk = await stream.content.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            temp.write(chunk)
+            if hasher is not None:
+                hasher.update(chunk)
+
+            total_bytes_downloaded += len(chunk)
+
+            elapsed_time = time.monotonic() - start_time
+            if on_progress is not None:
+                on_progress(total_bytes_downloaded, elapsed_time)
+
+            expected_time = total_bytes_downloaded / (downloading_speed * 1024 * 1024)
+            if elapsed_time < expected_time:
+                await asyncio.sleep(expected_time - elapsed_time)
+        temp.seek(0)
+
+        # here can be saving file
+
+        temp.close()
+        os.unlink(temp.name)
+
+    actual_download_speed = total_bytes_downloaded / (1024 * 1024 * elapsed_time)
+    current_app.logger.info('downloading speed object: %smbps', actual_download_speed)
+    return total_bytes_downloaded
+
+
+def get_ip_from_url(url):
+    ext = extract(url)
+
+    if not ext.suffix:
+        return ext.domain
+
+    subdomain = ext.subdomain if ext.subdomain else 'www'
+    return socket.gethostbyname(subdomain + '.' + ext.domain + '.' + ext.suffix)
+
+
+def format_download_time(seconds: float):
+    return round(seconds * 1000, 3)
+
+
+def format_throughput(downloaded_bytes, seconds: float):
+    '''mb/s, same unit as `speed`'''
+    return round(downloaded_bytes / (1024 * 1024 * max(seconds, 1e-9)), 3)
+
+
+def summarize_warm(samples: list):
+    '''
+    summary of requests on warm connection, `samples` are tuples
+    `ttfb` seconds, `time` seconds, `downloaded_bytes`, `transfer_time` seconds
+
+    returns:
+        {
+            "requests": int,
+            "ttfb": float ms (mean),
+            "ttfb_min": float ms,
+            "time": float ms (mean),
+            "throughput": float mb/s (total bytes by total transfer time)
+        }
+    '''
+    return {
+        'requests': len(samples),
+        'ttfb': format_download_time(sum(sample[0] for sample in samples) / len(samples)),
+        'ttfb_min': format_download_time(min(sample[0] for sample in samples)),
+        'time': format_download_time(sum(sample[1] for sample in samples) / len(samples)),
+        'throughput': format_throughput(sum(sample[2] for sample in samples), sum(sample[3] for sample in samples)),
+    }
+
+
+def tebi_get_client():
+    return get_storage(PRIMARY_STORAGE).get_client()
+
+
+def get_bucket():
+    return get_storage(PRIMARY_STORAGE).get_bucket()
+
+
+def get_payload_url(size):
+    payload_host_url = current_app.config['PAYLOAD_HOST_URL'] or current_app.config['MAIN_HOST_URL']
+    return f'{payload_host_url}/api/payload/{size}'
+
+
+def get_deadline(json: dict):
+    '''
+    returns tuple `deadline` (seconds or None for `TEST_DEADLINE`), `error`
+    '''
+    if json.get('deadline') is None:
+        return None, None
+
+    try:
+        deadline = int(json.get('deadline'))
+    except (TypeError, ValueError):
+        return None, '\'deadline\' must be integer'
+
+    # running flag of test expires after `RESULT_RUNNING_TTL`
+    if deadline < 1 or deadline > current_app.config['RESULT_RUNNING_TTL']:
+        return None, f'\'deadline\' must be greater than 0 and not greater than {current_app.config["RESULT_RUNNING_TTL"]}'
+    return deadline, None
+
+
+def get_payload_size(value):
+    '''
+    returns tuple `payload_size`, `error`
+    '''
+    try:
+        payload_size = int(value)
+    except (TypeError, ValueError):
+        return None, '\'payload_size\' must be integer'
+
+    if payload_size < 1 or payload_size > current_app.config['PAYLOAD_MAX_SIZE']:
+        return None, f'\'payload_size\' must be greater than 0 and not greater than {current_app.config["PAYLOAD_MAX_SIZE"]}'
+    return payload_size, None
+
+
+def ensure_storage_fixture(size, storage=PRIMARY_STORAGE):
+    '''uploads payload of `size` bytes to `storage` if it isn't there yet, returns fixture file name'''
+    file_name = f'fixtures/payload_{size}.bin'
+
+    backend = get_storage(storage)
+    if backend.exists(file_name):
+        return file_name
+
+    current_app.logger.info(f'Seeding storage fixture \'{file_name}\' on \'{storage}\'')
+    backend.get_bucket().upload_fileobj(PayloadReader(size), file_name)
+    return file_name
+
+
+def calculate_downloading_speed(speed):
+    return speed * 1024 * 1024 / 8
+
+
+@bp.before_request
+def before_request():
+    request.start_time = time.time()
+
+
+@bp.after_request
+def after_request(response):
+    ttfb = time.time() - request.start_time
+    response.headers['X-TTFB'] = str(ttfb)
+    return response
+
+
+# Routes
+
+
+@bp.route('/')
+async def index():
     if not current_app.config['MAIN_HOST']:
         return make_response('This is not main server', 400)
 
@@ -538,6 +1804,237 @@ async def tests():
     return render_template('tests.html', tests=tests)
 
 
+def parse_timestamp_arg(args, name):
+    '''
+    returns tuple `datetime`, `error`, `datetime` (utc) is None if query param `name` is not set
+    '''
+    value = args.get(name)
+    if not value:
+        return None, None
+
+    try:
+        return datetime.datetime.fromtimestamp(int(value), tz=datetime.timezone.utc), None
+    except (ValueError, OverflowError, OSError):
+        return None, f'\'{name}\' must be unix timestamp'
+
+
+@bp.route(api_tests_export_endpoint, methods=['GET'])
+def api_tests_export():
+    '''
+    streams test history
+
+    query params:
+        format: ndjson | csv | parquet (default ndjson, parquet requires pyarrow)
+        kind: tests | measurements (default measurements, one row per vps and storage)
+        from: int (unix timestamp, utc, not required)
+        to: int (unix timestamp, utc, not required)
+        host: vps name, can be repeated (not required), with kind tests only tests measured on
+            these vps are exported and their content has only these vps
+    '''
+    if not current_app.config['MAIN_HOST']:
+        return make_response({'error': 'This is not main server'}, 400)
+
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in export.EXPORT_FORMATS:
+        return make_response({'error': f'\'format\' must be one of: {", ".join(export.EXPORT_FORMATS)}'}, 400)
+
+    kind = request.args.get('kind', 'measurements')
+    if kind not in export.EXPORT_KINDS:
+        return make_response({'error': f'\'kind\' must be one of: {", ".join(export.EXPORT_KINDS)}'}, 400)
+
+    date_from, error = parse_timestamp_arg(request.args, 'from')
+    if error:
+        return make_response({'error': error}, 400)
+
+    date_to, error = parse_timestamp_arg(request.args, 'to')
+    if error:
+        return make_response({'error': error}, 400)
+
+    hosts = request.args.getlist('host')
+
+    records = export.iter_export_records(kind, date_from, date_to, hosts, current_app.config['EXPORT_BATCH_SIZE'])
+    columns = export.TEST_COLUMNS if kind == 'tests' else export.MEASUREMENT_COLUMNS
+
+    if export_format == 'ndjson':
+        body, mimetype = export.export_ndjson(records), 'application/x-ndjson'
+    elif export_format == 'csv':
+        body, mimetype = export.export_csv(records, columns), 'text/csv'
+    else:
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            return make_response({'error': 'parquet export requires pyarrow'}, 400)
+        body, mimetype = export.export_parquet(records, columns), 'application/vnd.apache.parquet'
+
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename=tests_{kind}.{export_format}'
+    return response
+
+
+@bp.route(api_vps_endpoint, methods=['GET'])
+def api_vps_list():
+    if not current_app.config['MAIN_HOST']:
+        return make_response({'error': 'This is not main server'}, 400)
+
+    return {'vps': [vps.to_dict() for vps in Vps.query.order_by(Vps.name)]}
+
+
+@bp.route(api_vps_endpoint, methods=['POST'])
+def api_vps_add():
+    '''
+    adds or updates vps
+
+    request example:
+    {
+        "name": "vps_name_1",
+        "url": "http://10.10.10.10:5000",
+        "enabled": bool (default true)
+    }
+    '''
+    if not current_app.config['MAIN_HOST']:
+        return make_response({'error': 'This is not main server'}, 400)
+
+    name = request.json.get('name')
+    url = request.json.get('url')
+    enabled = request.json.get('enabled', True)
+    if not name or not url:
+        return make_response({'error': '\'name\' and \'url\' are required'}, 400)
+    if not isinstance(enabled, bool):
+        return make_response({'error': '\'enabled\' must be bool'}, 400)
+
+    try:
+        db.session.begin_nested()
+        vps = db.session.get(Vps, name) or Vps(name=name, failures=0)
+        vps.url = url.rstrip('/')
+        vps.enabled = enabled
+        vps.circuit_open_until = None
+        db.session.add(vps)
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        current_app.logger.error(e)
+        return make_response({'error': 'Couldn\'t save vps'}, 500)
+
+    return vps.to_dict()
+
+
+@bp.route(f'{api_vps_endpoint}/<name>', methods=['DELETE'])
+def api_vps_delete(name):
+    if not current_app.config['MAIN_HOST']:
+        return make_response({'error': 'This is not main server'}, 400)
+
+    vps = db.session.get(Vps, name)
+    if vps is None:
+        return make_response({'error': f'vps \'{name}\' not found'}, 404)
+
+    try:
+        db.session.begin_nested()
+        db.session.delete(vps)
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        current_app.logger.error(e)
+        return make_response({'error': 'Couldn\'t delete vps'}, 500)
+
+    return {'deleted': name}
+
+
+@bp.route(api_vps_probe_endpoint, methods=['POST'])
+async def api_vps_probe():
+    if not current_app.config['MAIN_HOST']:
+        return make_response({'error': 'This is not main server'}, 400)
+
+    return {'rtt': await probe_all()}
+
+
+@bp.route(api_regressions_endpoint, methods=['GET'])
+def api_regressions():
+    '''
+    lists detected regressions, latest first
+
+    query params:
+        from: int (unix timestamp, utc, not required)
+        host: vps name (not required)
+        storage: storage name or object (not required)
+        limit: int (default 100, max 1000)
+    '''
+    if not current_app.config['MAIN_HOST']:
+        return make_response({'error': 'This is not main server'}, 400)
+
+    date_from, error = parse_timestamp_arg(request.args, 'from')
+    if error:
+        return make_response({'error': error}, 400)
+
+    try:
+        limit = int(request.args.get('limit', 100))
+    except ValueError:
+        return make_response({'error': '\'limit\' must be integer'}, 400)
+    if not 1 <= limit <= 1000:
+        return make_response({'error': '\'limit\' must be between 1 and 1000'}, 400)
+
+    return {'regressions': get_regressions(date_from, request.args.get('host'), request.args.get('storage'), limit)}
+
+
+@bp.route(api_analytics_endpoint, methods=['GET'])
+def api_analytics():
+    '''
+    percentiles, vps ranking, latency / throughput correlation and hour of day heatmap
+    of measurements (see `app.main.analytics.get_analytics`)
+
+    query params:
+        from: int (unix timestamp, utc, not required)
+        to: int (unix timestamp, utc, not required)
+        host: vps name, can be repeated (not required)
+        storage: storage name or object (not required)
+        metric: latency | ttfb | time | throughput (default time), ranked and mapped by heatmap
+    '''
+    if not current_app.config['MAIN_HOST']:
+        return make_response({'error': 'This is not main server'}, 400)
+
+    from app.main import analytics
+
+    date_from, error = parse_timestamp_arg(request.args, 'from')
+    if error:
+        return make_response({'error': error}, 400)
+
+    date_to, error = parse_timestamp_arg(request.args, 'to')
+    if error:
+        return make_response({'error': error}, 400)
+
+    metric = request.args.get('metric', 'time')
+    if metric not in analytics.METRICS:
+        return make_response({'error': f'\'metric\' must be one of: {", ".join(analytics.METRICS)}'}, 400)
+
+    return analytics.get_analytics(date_from, date_to, request.args.getlist('host'), request.args.get('storage'), metric)
+
+
+@bp.route(f'{api_tests_endpoint}/<test_uuid>', methods=['DELETE'])
+def api_test_cancel(test_uuid):
+    '''
+    cancels running or scheduled test or batch plan, its channel gets terminal error event,
+    unknown tests get 404, finished ones 409
+    '''
+    if not current_app.config['MAIN_HOST']:
+        return make_response({'error': 'This is not main server'}, 400)
+
+    if get_cached_result(test_uuid) is not None:
+        return make_response({'error': 'Test is already finished'}, 409)
+
+    # tests are flagged running from the moment they are queued until they finish
+    if not is_running(test_uuid):
+        try:
+            finished = db.session.get(Test, uuid.UUID(test_uuid)) is not None
+        except ValueError:
+            finished = False
+        if finished:
+            return make_response({'error': 'Test is already finished'}, 409)
+        return make_response({'error': f'Test \'{test_uuid}\' not found'}, 404)
+
+    request_cancel(test_uuid)
+    current_app.logger.info(f'Cancel of test {test_uuid} requested')
+    return {'uuid': test_uuid, 'cancel_requested': True}
+
+
 @bp.route(api_upload_url_test_endpoint, methods=['POST'])
 async def api_upload_url_test():
     '''
@@ -545,10 +2042,22 @@ async def api_upload_url_test():
     {
         "url": "http://kyi.download.datapacket.com/10mb.bin",
         "amount": int (default 1),
+        "payload_size": int bytes (default 1048576, used when amount >= 2),
         "speed": int mb/s (default 100),
         "monopoly": bool (default false),
+        "coordinated": bool (default false, all hosts start at the same moment),
+        "deadline": int seconds (default TEST_DEADLINE),
+        "storages": ["tebi", "minio"] (default ["tebi"], measured at the same time),
+        "profile": bool (default false, requires PROFILING),
+        "warm": int (default 0, requests measured on warm connection after the cold one, max WARM_MAX_REQUESTS),
+        "verify": "md5" | "sha256" | "crc32c" (not required, every transfer is hashed, mismatch fails the measurement),
+        "single_flight": bool (default true, has effect when SINGLE_FLIGHT_WINDOW is set),
         "eta": int (unix timestamp, utc, not required)
     }
+
+    with single flight, request identical to a test submitted within `SINGLE_FLIGHT_WINDOW`
+    that is not finished yet gets uuid of that test instead of starting a new one,
+    scheduled (`eta`) and profiled tests always run by themselves
     '''
     if not current_app.config['MAIN_HOST']:
         return make_response({'error': 'This is not main server'}, 400)
@@ -557,8 +2066,12 @@ async def api_upload_url_test():
 
     amount = int(request.json.get('amount', 1))
     if amount >= 2 and amount <= 100:
-        url = 'http://kyi.download.datapacket.com/1mb.bin'
+        payload_size, error = get_payload_size(request.json.get('payload_size', CHUNK_SIZE))
+        if error:
+            return make_response({'error': error}, 400)
+        url = get_payload_url(payload_size)
     elif amount == 1:
+        payload_size = None
         url = request.json.get('url')
         if not url:
             return make_response({'error': 'No url provided'}, 400)
@@ -579,6 +2092,42 @@ async def api_upload_url_test():
 
     monopoly = request.json.get('monopoly', False)
 
+    # coordinated start
+
+    coordinated = bool(request.json.get('coordinated', False))
+
+    # deadline
+
+    deadline, error = get_deadline(request.json)
+    if error:
+        return make_response({'error': error}, 400)
+
+    # storages
+
+    storages, error = parse_storages(request.json.get('storages'))
+    if error:
+        return make_response({'error': error}, 400)
+
+    # warm connection
+
+    warm, error = parse_warm(request.json)
+    if error:
+        return make_response({'error': error}, 400)
+
+    # integrity
+
+    verify, _, error = parse_verify(request.json)
+    if error:
+        return make_response({'error': error}, 400)
+
+    # profile
+
+    profile_id = None
+    if request.json.get('profile'):
+        if not current_app.config['PROFILING']:
+            return make_response({'error': 'Profiling is disabled'}, 400)
+        profile_id = uuid.uuid4().hex
+
     # eta (estimated time of arrival)
 
     try:
@@ -594,95 +2143,205 @@ async def api_upload_url_test():
 
     channel_uuid = str(uuid.uuid4())
 
-    kwargs = {
-        'url': url,
-        'channel_uuid': channel_uuid,
-        'speed': speed,
-        'monopoly': monopoly,
-        'amount': amount
-    }
-    if not eta_datetime:
-        upload_url_task.delay(
-            **kwargs
+    # single flight
+
+    coalesced = False
+    if current_app.config['SINGLE_FLIGHT_WINDOW'] and request.json.get('single_flight', True) and not eta_datetime and profile_id is None:
+        flight_key = single_flight.make_key(
+            url=url, speed=speed, amount=amount, payload_size=payload_size,
+            monopoly=bool(monopoly), coordinated=coordinated, storages=storages, warm=warm, verify=verify
         )
+        leader_uuid = single_flight.join(flight_key, channel_uuid)
+        coalesced = leader_uuid != channel_uuid
+        channel_uuid = leader_uuid
+
+    if coalesced:
+        current_app.logger.info('Upload url test coalesced into running test %s', channel_uuid)
     else:
-        upload_url_task.apply_async(
-            kwargs=kwargs, eta=eta_datetime
-        )
+        kwargs = {
+            'url': url,
+            'channel_uuid': channel_uuid,
+            'speed': speed,
+            'monopoly': monopoly,
+            'amount': amount,
+            'payload_size': payload_size,
+            'coordinated': coordinated,
+            'deadline': deadline,
+            'storages': storages,
+            'profile_id': profile_id,
+            'warm': warm,
+            'verify': verify,
+        }
+        mark_running(channel_uuid, eta_datetime)
+        if not eta_datetime:
+            queues.enqueue(upload_url_task, queues.INTERACTIVE, kwargs)
+        else:
+            queues.enqueue(upload_url_task, queues.SCHEDULED, kwargs, eta=eta_datetime)
 
     main_host_url = current_app.config['MAIN_HOST_URL']
     if current_app.config['DEBUG']:
-        return {'sse_stream_url': f'/stream?channel={channel_uuid}', 'uuid': channel_uuid}
+        response = {'sse_stream_url': f'/stream?channel={channel_uuid}', 'uuid': channel_uuid}
     else:
-        return {'sse_stream_url': f'{main_host_url}/stream?channel={channel_uuid}', 'uuid': channel_uuid}
+        response = {'sse_stream_url': f'{main_host_url}/stream?channel={channel_uuid}', 'uuid': channel_uuid}
 
+    if profile_id is not None:
+        response['profile_id'] = profile_id
+    if coalesced:
+        response['coalesced'] = True
+    return response
 
-@bp.route(api_upload_tebi_endpoint, methods=['POST'])
-async def api_upload_tebi():
+
+@bp.route(api_upload_url_batch_endpoint, methods=['POST'])
+async def api_upload_url_batch():
     '''
+    runs every combination of urls x speeds x amounts x hosts as one plan
+
     request example:
     {
-        "file_name": "file_name.bin",
-        "speed": int mb/s,
-        "amount": int (default 1),
+        "urls": ["http://kyi.download.datapacket.com/10mb.bin"],
+        "speeds": [int mb/s] (default [100]),
+        "amounts": [int] (default [1]),
+        "hosts": [["vps_name_1"], ["vps_name_1", "vps_name_2"]] (default all vps),
+        "payload_size": int bytes (default 1048576, used when amount >= 2),
+        "concurrency": int (default BATCH_CONCURRENCY),
+        "monopoly": bool (default false),
+        "coordinated": bool (default false, all hosts of a cell start at the same moment),
+        "deadline": int seconds for every cell (default TEST_DEADLINE),
+        "storages": ["tebi", "minio"] (default ["tebi"], measured at the same time),
+        "warm": int (default 0, requests measured on warm connection after the cold one),
+        "verify": "md5" | "sha256" | "crc32c" (not required, every transfer is hashed, mismatch fails the measurement)
     }
     '''
+    if not current_app.config['MAIN_HOST']:
+        return make_response({'error': 'This is not main server'}, 400)
 
-    amount = int(request.json.get('amount', 1))
-    if amount >= 2 and amount <= 100:
-        file_name = '1mb.bin'
-    elif amount == 1:
-        file_name = request.json.get('file_name')
-        if not file_name:
-            return make_response({'error': 'No file_name provided'}, 400)
-    else:
-        return make_response({'error': 'amount must be greater than 0 and less than 100'}, 400)
+    urls = request.json.get('urls', [])
+    speeds = request.json.get('speeds', [100])
+    amounts = request.json.get('amounts', [1])
+    vps_urls: dict = Vps.get_urls()
+    hosts = request.json.get('hosts', [list(vps_urls.keys())])
 
-    try:
-        speed = int(request.json.get('speed', 100))
+    for name, value in (('urls', urls), ('speeds', speeds), ('amounts', amounts), ('hosts', hosts)):
+        if not isinstance(value, list) or not value:
+            return make_response({'error': f'\'{name}\' must be non-empty list'}, 400)
 
-        if speed < 1:
-            make_response({'error': 'Speed must be greater than 1'}, 400)
+    try:
+        speeds = [int(speed) for speed in speeds]
+        amounts = [int(amount) for amount in amounts]
+        concurrency = int(request.json.get('concurrency', current_app.config['BATCH_CONCURRENCY']))
     except ValueError:
-        return make_response({'error': 'Speed must be integer'}, 400)
-
-    head_start_time = time.monotonic()
-    tebi_get_client().head_object(Bucket=current_app.config['TEBI_BUCKET'], Key=file_name)
-    latency = time.monotonic() - head_start_time
+        return make_response({'error': '\'speeds\', \'amounts\' and \'concurrency\' must be integers'}, 400)
 
-    with tempfile.NamedTemporaryFile(delete=False) as temp:
-        start_time = time.monotonic()
-        total_bytes_downloaded = 0
+    if any(speed < 1 for speed in speeds):
+        return make_response({'error': '\'speed\' must be greater than 1'}, 400)
+    if any(amount < 1 or amount > 100 for amount in amounts):
+        return make_response({'error': '\'amount\' must be greater than 0 and less than 100'}, 400)
+    if concurrency < 1:
+        return make_response({'error': '\'concurrency\' must be greater than 0'}, 400)
+
+    for host_subset in hosts:
+        if not isinstance(host_subset, list) or not host_subset:
+            return make_response({'error': '\'hosts\' must be list of non-empty lists of vps names'}, 400)
+        unknown = [vps_name for vps_name in host_subset if vps_name not in vps_urls]
+        if unknown:
+            return make_response({'error': f'Unknown vps: {", ".join(unknown)}'}, 400)
+
+    payload_size = None
+    if any(amount >= 2 for amount in amounts):
+        payload_size, error = get_payload_size(request.json.get('payload_size', CHUNK_SIZE))
+        if error:
+            return make_response({'error': error}, 400)
+
+    deadline, error = get_deadline(request.json)
+    if error:
+        return make_response({'error': error}, 400)
+
+    storages, error = parse_storages(request.json.get('storages'))
+    if error:
+        return make_response({'error': error}, 400)
+
+    warm, error = parse_warm(request.json)
+    if error:
+        return make_response({'error': error}, 400)
+
+    verify, _, error = parse_verify(request.json)
+    if error:
+        return make_response({'error': error}, 400)
 
-        for i in range(amount):
-            start_time = time.monotonic()
-            body = get_bucket().Object(file_name).get()['Body']
-            ttfb = time.monotonic() - start_time
+    monopoly = request.json.get('monopoly', False)
 
-            while True:
-                chunk = body.read(CHUNK_SIZE)
-                if not chunk:
-                    break
-                temp.write(chunk)
+    cells = []
+    seen = set()
+    for url in urls:
+        for speed in speeds:
+            for amount in amounts:
+                for host_subset in hosts:
+                    cell_url = get_payload_url(payload_size) if amount >= 2 else url
+                    key = (cell_url, speed, amount, tuple(sorted(host_subset)))
+                    if key in seen:
+                        continue
+                    seen.add(key)
+
+                    cells.append({
+                        'uuid': str(uuid.uuid4()),
+                        'url': cell_url,
+                        'speed': speed,
+                        'amount': amount,
+                        'payload_size': payload_size if amount >= 2 else None,
+                        'hosts': list(host_subset),
+                    })
+
+    if len(cells) > current_app.config['BATCH_MAX_CELLS']:
+        return make_response({'error': f'Plan has {len(cells)} cells, max is {current_app.config["BATCH_MAX_CELLS"]}'}, 400)
+
+    plan = {
+        'uuid': str(uuid.uuid4()),
+        'monopoly': monopoly,
+        'coordinated': bool(request.json.get('coordinated', False)),
+        'concurrency': concurrency,
+        'deadline': deadline,
+        'storages': storages,
+        'warm': warm,
+        'verify': verify,
+        'cells': cells,
+    }
 
-                total_bytes_downloaded += len(chunk)
+    current_app.logger.info(f'Upload url batch, cells: {len(cells)}, concurrency: {concurrency}, monopoly: {monopoly}')
 
-                elapsed_time = time.monotonic() - start_time
-                expected_time = total_bytes_downloaded / (speed * 1024 * 1024)
-                if elapsed_time < expected_time:
-                    time.sleep(expected_time - elapsed_time)
-            temp.close()
-            os.unlink(temp.name)
-        actual_download_speed = total_bytes_downloaded / (1024 * 1024 * elapsed_time)
-        current_app.logger.info(f'downloading speed tebi: {actual_download_speed}mbps')
+    mark_running(plan['uuid'])
+    queues.enqueue(upload_url_batch_task, queues.SCHEDULED, {'plan': plan})
 
+    main_host_url = '' if current_app.config['DEBUG'] else current_app.config['MAIN_HOST_URL']
     return {
-        'vps_name': current_app.config['HOST_NAME'],
-        'file_ip': get_ip_from_url('https://s3.tebi.io'),
-        'time': format_download_time(time.monotonic() - start_time),
-        'ttfb': format_download_time(ttfb),
-        'latency': format_download_time(latency / 2),
+        'sse_stream_url': f'{main_host_url}/stream?channel={plan["uuid"]}',
+        'uuid': plan['uuid'],
+        'cells': [
+            dict(cell, sse_stream_url=f'{main_host_url}/stream?channel={cell["uuid"]}') for cell in cells
+        ],
+    }
+
+
+@bp.route(api_upload_tebi_endpoint, methods=['POST'])
+@bp.route(api_upload_storage_endpoint, methods=['POST'])
+async def api_upload_tebi():
+    '''
+    request example:
+    {
+        "storage": "tebi" (default, any name of `STORAGE_BACKENDS`),
+        "file_name": "file_name.bin",
+        "speed": int mb/s,
+        "amount": int (default 1),
+        "payload_size": int bytes (default 1048576, used when amount >= 2),
+        "warm": int (default 0, measured requests on warm connection after the cold one),
+        "verify": "md5" | "sha256" | "crc32c" (not required, hash and verify every download),
+        "digest": str (not required, known hex digest of the file),
     }
+    '''
+    params, error = parse_upload_tebi_request(request.json)
+    if error:
+        return make_response({'error': error}, 400)
+
+    return measure_upload_tebi(**params)
 
 
 @bp.route(api_upload_url_endpoint, methods=['POST'])
@@ -693,47 +2352,44 @@ async def api_upload_url():
         "url": "http://kyi.download.datapacket.com/10mb.bin",
         "speed": int mb/s,
         "amount": int (default 1),
+        "warm": int (default 0, measured requests on warm connection after the cold one),
+        "verify": "md5" | "sha256" | "crc32c" (not required, hash and verify every download),
+        "digest": str (not required, known hex digest of the file),
     }
     '''
+    params, error = parse_upload_url_request(request.json)
+    if error:
+        return make_response({'error': error}, 400)
 
-    amount = int(request.json.get('amount', 1))
-    if amount >= 2 and amount <= 100:
-        url = 'http://kyi.download.datapacket.com/1mb.bin'
-    elif amount == 1:
-        url = request.json.get('url')
-        if not url:
-            return make_response({'error': 'No url provided'}, 400)
-    else:
-        return make_response({'error': 'amount must be greater than 0 and less than 100'}, 400)
+    return await measure_upload_url(**params)
 
-    try:
-        speed = int(request.json.get('speed', 100))
 
-        if speed < 1:
-            make_response({'error': 'Speed must be greater than 1'}, 400)
-    except ValueError:
-        return make_response({'error': 'Speed must be integer'}, 400)
+@bp.route(f'{api_profiles_endpoint}/<profile_id>', methods=['GET'])
+def api_profile(profile_id):
+    '''
+    summary of profile saved on this host, full stats are in `PROFILES_DIR/<profile_id>.prof`
+    '''
+    summary = profiling.load_summary(profile_id)
+    if summary is None:
+        return make_response({'error': f'Profile \'{profile_id}\' not found'}, 404)
+    return summary
 
-    async with ClientSession() as session:
-        start_time = time.monotonic()
-        async with session.get(url) as resp:
-            if resp.ok:
-                ttfb = time.monotonic() - start_time
-
-                for i in range(amount):
-                    await upload_file_by_chunks(resp, speed)
-                return {
-                    'vps_name': current_app.config['HOST_NAME'],
-                    'file_ip': get_ip_from_url(url),
-                    'time': format_download_time(time.monotonic() - start_time),
-                    'ttfb': format_download_time(ttfb),
-                    'latency': format_download_time(ttfb / 2)
-                }
-            else:
-                current_app.logger.error(f'Couldn\'t upload file by url \'{url}\'. Response: {resp}')
-                return {
-                    'error': f'Couldn\'t upload file by url \'{url}\'. Response: {resp}',
-                }
+
+@bp.route(api_cancel_endpoint, methods=['POST'])
+def api_cancel():
+    '''
+    stops measurements of test on this vps
+
+    request example:
+    {
+        "test_id": "uuid"
+    }
+    '''
+    test_id = request.json.get('test_id')
+    if not test_id:
+        return make_response({'error': 'No test_id provided'}, 400)
+
+    return {'test_id': test_id, 'cancelled': cancel(test_id)}
 
 
 @bp.route(api_upload_file_endpoint, methods=['POST'])
@@ -742,9 +2398,33 @@ async def api_upload_file():
     file_name = file.filename
 
     x1 = time.monotonic()
-    await upload_file(file, file_name)
+    with ResourceMeter() as meter:
+        await upload_file(file, file_name)
 
-    return {
+    return meter.attach({
         'vps_name': current_app.config['HOST_NAME'],
         'download_time': format_download_time(time.monotonic() - x1),
+    })
+
+
+@bp.route(api_payload_endpoint, methods=['GET'])
+def api_payload(size):
+    '''
+    streams `size` bytes of deterministic incompressible data
+    '''
+    if size < 1 or size > current_app.config['PAYLOAD_MAX_SIZE']:
+        return make_response({'error': f'size must be greater than 0 and not greater than {current_app.config["PAYLOAD_MAX_SIZE"]}'}, 400)
+
+    response = Response(iter_payload(size), mimetype='application/octet-stream')
+    response.headers['Content-Length'] = str(size)
+    response.headers['ETag'] = get_payload_etag(size)
+    response.headers['Cache-Control'] = 'no-store, no-transform'
+    return response
+
+
+@bp.route(api_clock_endpoint, methods=['GET'])
+def api_clock():
+    return {
+        'vps_name': current_app.config['HOST_NAME'],
+        'time': time.time(),
     }
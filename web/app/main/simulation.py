@@ -0,0 +1,295 @@
+from flask import current_app
+from aiohttp import web
+from app.extensions import get_redis
+from app.main.clock import wait_until
+from app.main.payload import iter_payload, get_payload_etag
+from app.main.resources import get_rss_kb
+from app.main.result_cache import get_cached_result
+from app.main.storage import PRIMARY_STORAGE
+import asyncio
+import random
+import resource
+import threading
+import time
+import uuid
+import orjson
+
+
+HOST_PREFIX = 'sim-'
+SOURCE_PATH = '/sim/source'
+
+
+class FakeHost:
+    '''
+    simulated sub-host, `latency` (ms, one way) and `bandwidth` (mb/s) are drawn once per host,
+    `jitter` (ms) is added to every response, `failure_rate` of measurements fail
+    '''
+    __slots__ = ('name', 'latency', 'jitter', 'bandwidth', 'failure_rate')
+
+    def __init__(self, name, latency, jitter, bandwidth, failure_rate) -> None:
+        self.name = name
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.failure_rate = failure_rate
+
+
+class FakeFleet:
+    '''
+    `hosts` fake sub-hosts in this process, every host listens on a port of its own,
+    so the orchestrator keeps a connection pool per host as with real vps
+
+    hosts are served by one event loop in a thread of its own, their work doesn't
+    show up in event loop lag of the orchestrator and their cpu time is known (`get_cpu_time()`)
+
+    every host answers measurement endpoints after simulated transfer of `size` bytes,
+    the first one also serves the source file (`source_url`)
+    '''
+
+    def __init__(self, hosts, size, latency=20, jitter=5, bandwidth=100, failure_rate=0, seed=None) -> None:
+        self.size = size
+
+        rng = random.Random(seed)
+        self.hosts = [
+            FakeHost(
+                name=f'{HOST_PREFIX}{index:04d}',
+                latency=latency * rng.uniform(0.5, 1.5),
+                jitter=jitter,
+                bandwidth=bandwidth * rng.uniform(0.5, 1.5),
+                failure_rate=failure_rate,
+            )
+            for index in range(1, hosts + 1)
+        ]
+        self._rng = rng
+        self._ports = {}
+        self._loop = None
+        self._runner = None
+        self._thread = None
+
+    def start(self) -> dict:
+        '''starts hosts, returns their urls in format of `VPS_URLS`'''
+        started = threading.Event()
+        self._loop = asyncio.new_event_loop()
+
+        def run():
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self._start())
+            started.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name='fake-fleet', daemon=True)
+        self._thread.start()
+        started.wait()
+        return self.get_vps_urls()
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    async def _start(self):
+        from app.main.routes import (
+            api_upload_url_endpoint, api_upload_tebi_endpoint, api_upload_storage_endpoint, api_clock_endpoint, api_cancel_endpoint
+        )
+
+        app = web.Application()
+        app.router.add_post(api_upload_url_endpoint, self._measure)
+        app.router.add_post(api_upload_tebi_endpoint, self._measure)
+        app.router.add_post(api_upload_storage_endpoint, self._measure)
+        app.router.add_get(api_clock_endpoint, self._clock)
+        app.router.add_post(api_cancel_endpoint, self._cancel)
+        app.router.add_get(SOURCE_PATH, self._source)
+
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        for host in self.hosts:
+            site = web.TCPSite(self._runner, '127.0.0.1', 0)
+            await site.start()
+            self._ports[self._runner.addresses[-1][1]] = host
+
+    def get_vps_urls(self) -> dict:
+        return {host.name: f'http://127.0.0.1:{port}' for port, host in self._ports.items()}
+
+    @property
+    def source_url(self):
+        return f'{next(iter(self.get_vps_urls().values()))}{SOURCE_PATH}'
+
+    def get_cpu_time(self) -> float:
+        '''cpu seconds spent by thread of hosts'''
+        return time.clock_gettime(time.pthread_getcpuclockid(self._thread.ident))
+
+    async def _measure(self, request: web.Request):
+        host = self._ports[request.url.port]
+        json = await request.json()
+
+        if json.get('start_at') is not None:
+            await wait_until(json['start_at'])
+        started_at = time.time()
+
+        ttfb = (2 * host.latency + abs(self._rng.gauss(0, host.jitter))) / 1000
+        transfer = self.size * json.get('amount', 1) / (host.bandwidth * 1024 * 1024)
+        timeout = json.get('timeout')
+        if timeout is not None and ttfb + transfer > timeout:
+            await asyncio.sleep(timeout)
+            return web.json_response({'error': 'Deadline exceeded'})
+
+        await asyncio.sleep(ttfb + transfer)
+        if self._rng.random() < host.failure_rate:
+            return web.json_response({'error': 'Simulated failure'}, status=503)
+
+        result = {
+            'vps_name': host.name,
+            'file_ip': '127.0.0.1',
+            'time': round((ttfb + transfer) * 1000, 3),
+            'ttfb': round(ttfb * 1000, 3),
+            'latency': round(ttfb * 500, 3),
+            'throughput': round(host.bandwidth, 3),
+        }
+        if json.get('start_at') is not None:
+            result['started_at'] = started_at
+            result['start_delay'] = round((started_at - json['start_at']) * 1000, 3)
+        return web.json_response(result)
+
+    async def _clock(self, request: web.Request):
+        host = self._ports[request.url.port]
+        await asyncio.sleep(host.latency / 1000)
+        return web.json_response({'vps_name': host.name, 'time': time.time()})
+
+    async def _cancel(self, request: web.Request):
+        return web.json_response({'status': 'ok'})
+
+    async def _source(self, request: web.Request):
+        response = web.StreamResponse(headers={
+            'Content-Length': str(self.size),
+            'ETag': get_payload_etag(self.size),
+            'Content-Type': 'application/octet-stream',
+        })
+        await response.prepare(request)
+        if request.method != 'HEAD':
+            for chunk in iter_payload(self.size):
+                await response.write(chunk)
+        await response.write_eof()
+        return response
+
+
+class SseCounter:
+    '''counts messages and bytes published to sse `channel` (redis pub/sub) in a thread'''
+
+    def __init__(self, channel) -> None:
+        self.messages = 0
+        self.bytes = 0
+
+        self._pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+        self._pubsub.subscribe(channel)
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='sse-counter', daemon=True)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            message = self._pubsub.get_message(timeout=0.1)
+            if message is not None:
+                self.messages += 1
+                self.bytes += len(message['data'])
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        # messages published right before the test finished may still be in flight
+        time.sleep(0.2)
+        self._stopped.set()
+        self._thread.join()
+        self._pubsub.close()
+
+
+async def _watch_loop(interval, lags: list, rss: list):
+    while True:
+        sleep_start = time.monotonic()
+        await asyncio.sleep(interval)
+        lags.append(max(time.monotonic() - sleep_start - interval, 0))
+        rss.append(get_rss_kb() or 0)
+
+
+async def run_step(fleet: FakeFleet, vps_urls: dict, speed=None, coordinated=False) -> dict:
+    '''
+    runs one test with `upload_url` on `vps_urls` and measures the orchestrator meanwhile,
+    test isn't saved to history and doesn't touch regression baselines:
+        {
+            "hosts": int,
+            "ok": int, "failed": int (measurements),
+            "completion": float s (whole test, source replication included),
+            "cpu": float ms (orchestrator process without fake hosts),
+            "rss": int kb (at start), "rss_peak": int kb (sampled while test runs),
+            "loop_lag": {"max": float ms, "mean": float ms},
+            "sse": {"messages": int, "bytes": int}
+        }
+    '''
+    from app.main.routes import upload_url
+
+    channel = str(uuid.uuid4())
+    lags, rss = [], [get_rss_kb() or 0]
+
+    rusage_start, fleet_cpu_start = resource.getrusage(resource.RUSAGE_SELF), fleet.get_cpu_time()
+    start_time = time.monotonic()
+    with SseCounter(channel) as sse_counter:
+        watcher = asyncio.create_task(_watch_loop(current_app.config['PROFILE_LOOP_LAG_INTERVAL'], lags, rss))
+        try:
+            await upload_url(
+                url=fleet.source_url,
+                channel_uuid=channel,
+                speed=speed,
+                monopoly=False,
+                amount=1,
+                coordinated=coordinated,
+                storages=[PRIMARY_STORAGE],
+                vps_urls=vps_urls,
+                persist=False,
+            )
+        finally:
+            watcher.cancel()
+    completion = time.monotonic() - start_time
+    rusage_end, fleet_cpu_end = resource.getrusage(resource.RUSAGE_SELF), fleet.get_cpu_time()
+
+    process_cpu = (rusage_end.ru_utime + rusage_end.ru_stime) - (rusage_start.ru_utime + rusage_start.ru_stime)
+    status = orjson.loads(get_cached_result(channel) or '{}')
+
+    return {
+        'hosts': len(vps_urls),
+        'ok': status.get('ok', 0),
+        'failed': status.get('failed', 0),
+        'completion': round(completion, 3),
+        'cpu': round((process_cpu - (fleet_cpu_end - fleet_cpu_start)) * 1000, 3),
+        'rss': rss[0],
+        'rss_peak': max(rss),
+        'loop_lag': {
+            'max': round(max(lags, default=0) * 1000, 3),
+            'mean': round(sum(lags) / len(lags) * 1000, 3) if lags else 0,
+        },
+        'sse': {'messages': sse_counter.messages, 'bytes': sse_counter.bytes},
+    }
+
+
+async def simulate(host_counts: list, size, latency=20, jitter=5, bandwidth=100, failure_rate=0, coordinated=False, seed=None, on_step=None) -> list:
+    '''
+    runs one test per host count of `host_counts` against the same fake fleet,
+    returns results of `run_step` in the same order, `on_step(result)` is called after every step
+
+    tests run like regular ones but aren't saved: they need database (admission), redis and
+    primary storage (`tebi`) of the environment, source (`size` bytes) is uploaded to that storage once and then served
+    from source cache until `SOURCE_CACHE_TTL` passes, so point `STORAGE_BACKENDS` at a local
+    stand-in (minio service of compose) instead of production tebi when running simulations
+    '''
+    fleet = FakeFleet(max(host_counts), size, latency, jitter, bandwidth, failure_rate, seed)
+    vps_urls = fleet.start()
+    try:
+        results = []
+        for host_count in host_counts:
+            result = await run_step(fleet, dict(list(vps_urls.items())[:host_count]), coordinated=coordinated)
+            results.append(result)
+            if on_step is not None:
+                on_step(result)
+        return results
+    finally:
+        fleet.stop()
@@ -0,0 +1,38 @@
+from flask import current_app
+from app.extensions import get_redis
+from app.main.result_cache import get_cached_result
+from app.main.cancellation import is_cancel_requested
+import hashlib
+import orjson
+
+
+FLIGHT_PREFIX = 'test_flight:'
+
+
+def make_key(**params) -> str:
+    '''key of test parameters, requests with the same parameters run as one test'''
+    return hashlib.sha256(orjson.dumps(params, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+
+def join(key, channel) -> str:
+    '''
+    returns channel of test with parameters `key` submitted within `SINGLE_FLIGHT_WINDOW`
+    and not finished yet, otherwise registers `channel` as such test and returns it
+
+    caller has to start the test only when returned channel is its own
+    '''
+    flight_key = f'{FLIGHT_PREFIX}{key}'
+
+    def attempt(pipeline):
+        leader = pipeline.get(flight_key)
+        if leader is not None:
+            leader = leader.decode()
+            if get_cached_result(leader) is None and not is_cancel_requested(leader):
+                return leader
+
+        pipeline.multi()
+        pipeline.set(flight_key, channel, ex=current_app.config['SINGLE_FLIGHT_WINDOW'])
+        return channel
+
+    # retried if another request registered its test in the meantime
+    return get_redis().transaction(attempt, flight_key, value_from_callable=True)
@@ -0,0 +1,195 @@
+from flask import current_app
+from aiohttp import ClientSession
+from app.extensions import get_redis
+import asyncio
+import hashlib
+import json
+import time
+
+
+class SourceCache:
+    '''
+    cache of source files that are already uploaded and replicated to tebi,
+    keyed by url + validators (ETag, Last-Modified, Content-Length)
+
+    every replicated file is an entry of its own (redis hash `source_cache:entry:<file_name>`):
+        {
+            "key": str,
+            "url": str,
+            "file_name": str,
+            "file_size": float kb,
+            "tebi_servers": "DE:2,SGP:1,USE:2,USW:2",
+            "created": float unix timestamp,
+            "refs": int
+        }
+    and `source_cache:current:<key>` holds file name of the entry served for the key
+
+    Entry is served only while `created + ttl` is in the future. Expired
+    entries and entries replaced by a newer one for the same key are deleted
+    from redis and tebi by `evict()` once nobody holds a reference to them,
+    a reference is released on the entry it was taken on.
+    '''
+
+    prefix = 'source_cache:'
+    entry_prefix = 'source_cache:entry:'
+    current_prefix = 'source_cache:current:'
+    index_key = 'source_cache:entries'
+    lock_timeout = 60 * 10
+
+    # decrements refs only of an existing entry, so a late release doesn't recreate evicted one
+    _release_script = '''
+        if redis.call('exists', KEYS[1]) == 1 then
+            return redis.call('hincrby', KEYS[1], 'refs', -1)
+        end
+        return nil
+    '''
+
+    def __init__(self, ttl=None) -> None:
+        self._redis = get_redis()
+        self._ttl = current_app.config['SOURCE_CACHE_TTL'] if ttl is None else ttl
+        self._release = self._redis.register_script(self._release_script)
+
+    @property
+    def enabled(self):
+        return self._ttl > 0
+
+    @staticmethod
+    async def get_validators(url) -> dict:
+        try:
+            async with ClientSession() as session:
+                async with session.head(url, allow_redirects=True) as resp:
+                    if not resp.ok:
+                        return {}
+                    return {
+                        'etag': resp.headers.get('ETag', ''),
+                        'last_modified': resp.headers.get('Last-Modified', ''),
+                        'size': resp.headers.get('Content-Length', ''),
+                    }
+        except Exception as e:
+            current_app.logger.error(f'Couldn\'t get validators for \'{url}\': {e}')
+            return {}
+
+    @staticmethod
+    def make_key(url, validators: dict):
+        '''returns None if source can't be validated, such source is never cached'''
+        if not validators.get('etag') and not validators.get('last_modified'):
+            return None
+
+        raw = json.dumps([url, validators.get('etag'), validators.get('last_modified'), validators.get('size')])
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    async def lock(self, key):
+        '''waits for the per-key lock without blocking event loop'''
+        lock = self._get_lock(key)
+        while not lock.acquire(blocking=False):
+            await asyncio.sleep(1)
+        return lock
+
+    def acquire(self, key):
+        '''
+        returns current entry of `key` and takes a reference to it, None if there is no fresh entry,
+        must be called under `lock(key)`
+        '''
+        file_name = self._redis.get(self.current_prefix + key)
+        if file_name is None:
+            return None
+
+        entry = self._get(file_name.decode())
+        if entry is None or self._is_expired(entry):
+            return None
+
+        entry['refs'] = self._redis.hincrby(self.entry_prefix + entry['file_name'], 'refs', 1)
+        return entry
+
+    def add(self, key, url, file_name, file_size, tebi_servers):
+        '''
+        adds entry with one reference taken by the caller and serves it for `key`,
+        previous entry of `key` is kept until its references are released,
+        must be called under `lock(key)`
+        '''
+        entry = {
+            'key': key,
+            'url': url,
+            'file_name': file_name,
+            'file_size': file_size,
+            'tebi_servers': tebi_servers,
+            'created': time.time(),
+            'refs': 1,
+        }
+        pipe = self._redis.pipeline()
+        pipe.hset(self.entry_prefix + file_name, mapping=entry)
+        pipe.sadd(self.index_key, file_name)
+        pipe.set(self.current_prefix + key, file_name)
+        pipe.execute()
+        return entry
+
+    def release(self, file_name):
+        '''releases reference taken by `acquire()` or `add()` on entry of `file_name`'''
+        self._release(keys=[self.entry_prefix + file_name])
+
+    def evict(self, delete_object) -> int:
+        '''
+        removes expired and replaced entries without references
+
+        Args:
+            `delete_object` (callable): deletes file from storage by file name
+
+        returns amount of evicted entries
+        '''
+        evicted = 0
+        for raw_file_name in self._redis.smembers(self.index_key):
+            file_name = raw_file_name.decode()
+
+            entry = self._get(file_name)
+            if entry is None:
+                self._redis.srem(self.index_key, file_name)
+                continue
+
+            lock = self._get_lock(entry['key'])
+            if not lock.acquire(blocking=False):
+                continue
+            try:
+                # references are taken only under the lock, released ones can only go down
+                entry = self._get(file_name)
+                if entry is None or entry['refs'] > 0:
+                    continue
+
+                current = self._redis.get(self.current_prefix + entry['key'])
+                is_current = current is not None and current.decode() == file_name
+                if is_current and not self._is_expired(entry):
+                    continue
+
+                try:
+                    delete_object(file_name)
+                except Exception as e:
+                    current_app.logger.error(f'Couldn\'t delete cached source \'{file_name}\': {e}')
+                    continue
+
+                pipe = self._redis.pipeline()
+                if is_current:
+                    pipe.delete(self.current_prefix + entry['key'])
+                pipe.delete(self.entry_prefix + file_name)
+                pipe.srem(self.index_key, file_name)
+                pipe.execute()
+                evicted += 1
+            finally:
+                lock.release()
+
+        return evicted
+
+    def _get_lock(self, key):
+        return self._redis.lock(f'{self.prefix}{key}:lock', timeout=self.lock_timeout)
+
+    def _get(self, file_name):
+        raw = self._redis.hgetall(self.entry_prefix + file_name)
+        if not raw:
+            return None
+
+        entry = {k.decode(): v.decode() for k, v in raw.items()}
+        entry['file_size'] = float(entry['file_size'])
+        entry['created'] = float(entry['created'])
+        entry['refs'] = int(entry['refs'])
+        return entry
+
+    def _is_expired(self, entry):
+        return entry['created'] + self._ttl < time.time()
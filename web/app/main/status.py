@@ -0,0 +1,69 @@
+import orjson
+
+
+def dumps(obj) -> str:
+    '''the only serialization path of statuses, sse, result cache and database take the same string'''
+    return orjson.dumps(obj).decode()
+
+
+class Measurement:
+    '''
+    state of one storage test on one vps, fields that are None are not serialized
+
+    status:
+        0 - waiting
+        1 - speed test started
+        2 - speed test completed
+    '''
+    __slots__ = ('status', 'downloaded', 'latency', 'ttfb', 'time', 'throughput', 'warm', 'integrity', 'resources', 'ok', 'ip', 'start_delay')
+
+    def __init__(self, status=0) -> None:
+        self.reset(status=status)
+
+    def reset(self, **fields):
+        for field in self.__slots__:
+            setattr(self, field, fields.get(field))
+
+    def to_dict(self):
+        output = {}
+        for field in self.__slots__:
+            value = getattr(self, field)
+            if value is not None:
+                output[field] = value
+        return output
+
+
+class VpsStatus:
+    __slots__ = ('ip', 'storages')
+
+    def __init__(self, ip, storages) -> None:
+        self.ip = ip
+        self.storages = {storage: Measurement() for storage in storages}
+
+    def to_dict(self):
+        output = {} if self.ip is None else {'ip': self.ip}
+        for storage, measurement in self.storages.items():
+            output[storage] = measurement.to_dict()
+        return output
+
+
+class SerializedStatus:
+    '''
+    keeps serialized `get_status()` until the next `_changed()`,
+    status is serialized once per mutation however many times it is read
+    '''
+    __slots__ = ('_json',)
+
+    def __init__(self) -> None:
+        self._json = None
+
+    def get_status(self) -> dict:
+        raise NotImplementedError
+
+    def _changed(self):
+        self._json = None
+
+    def to_json(self) -> str:
+        if self._json is None:
+            self._json = dumps(self.get_status())
+        return self._json
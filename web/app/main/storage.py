@@ -0,0 +1,115 @@
+from flask import current_app
+from botocore.exceptions import ClientError
+import boto3
+
+
+class StorageBackend:
+    '''
+    S3-compatible object storage, configured by name in `STORAGE_BACKENDS`:
+        {
+            "tebi": {
+                "endpoint_url": "https://s3.tebi.io",
+                "key": str,
+                "secret": str,
+                "bucket": str,
+                "region": str (not required)
+            },
+            "minio": {"endpoint_url": "http://minio:9000", ...}
+        }
+
+    `tebi` is the primary backend: sources are replicated there and it is
+    the only backend with replication tracking. `object` is reserved for
+    direct download of source url and can't be used as a name
+    '''
+
+    def __init__(self, name, endpoint_url, key, secret, bucket, region=None) -> None:
+        self.name = name
+        self.endpoint_url = endpoint_url
+        self.bucket_name = bucket
+
+        self._key = key
+        self._secret = secret
+        self._region = region
+
+    def _session_kwargs(self):
+        return {
+            'service_name': 's3',
+            'aws_access_key_id': self._key,
+            'aws_secret_access_key': self._secret,
+            'endpoint_url': self.endpoint_url,
+            'region_name': self._region,
+        }
+
+    def get_client(self):
+        return boto3.client(**self._session_kwargs())
+
+    def get_bucket(self):
+        return boto3.resource(**self._session_kwargs()).Bucket(self.bucket_name)
+
+    def head_object(self, file_name):
+        return self.get_client().head_object(Bucket=self.bucket_name, Key=file_name)
+
+    def exists(self, file_name):
+        try:
+            self.head_object(file_name)
+            return True
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') not in ('404', 'NoSuchKey', 'NotFound'):
+                raise e
+            return False
+
+    def ensure_bucket(self):
+        '''creates bucket if it is missing, local stand-ins start empty'''
+        client = self.get_client()
+        try:
+            client.head_bucket(Bucket=self.bucket_name)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') not in ('404', 'NoSuchBucket', 'NotFound'):
+                raise e
+            current_app.logger.info(f'Creating bucket \'{self.bucket_name}\' on storage \'{self.name}\'')
+            client.create_bucket(Bucket=self.bucket_name)
+
+    def delete_object(self, file_name):
+        self.get_bucket().delete_objects(Delete={'Objects': [{'Key': file_name}]})
+
+
+PRIMARY_STORAGE = 'tebi'
+
+
+def validate_storage_backends(backends: dict):
+    '''raises `ValueError` if `STORAGE_BACKENDS` can't be used, checked once at startup'''
+    if PRIMARY_STORAGE not in backends:
+        raise ValueError(f'STORAGE_BACKENDS must contain primary storage \'{PRIMARY_STORAGE}\'')
+    if 'object' in backends:
+        raise ValueError('\'object\' is reserved and can\'t be name of storage in STORAGE_BACKENDS')
+
+
+def get_storage_names():
+    return list(current_app.config['STORAGE_BACKENDS'].keys())
+
+
+def get_storage(name) -> StorageBackend:
+    '''returns None if storage `name` is not configured'''
+    settings = current_app.config['STORAGE_BACKENDS'].get(name)
+    if settings is None:
+        return None
+    return StorageBackend(name, **settings)
+
+
+def parse_storages(value):
+    '''
+    returns tuple `storages`, `error`, `value` is list of storage names (default primary storage only)
+    '''
+    if value is None:
+        return [PRIMARY_STORAGE], None
+
+    if not isinstance(value, list) or not value:
+        return None, '\'storages\' must be non-empty list'
+
+    storage_names = get_storage_names()
+    unknown = [name for name in value if name not in storage_names]
+    if unknown:
+        return None, f'Unknown storage: {", ".join(map(str, unknown))}'
+
+    # order is kept, duplicates are dropped
+    return list(dict.fromkeys(value)), None
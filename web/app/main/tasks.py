@@ -4,6 +4,7 @@ from app.extensions import db
 from app.models.test import Test
 from datetime import datetime, timedelta, timezone
 import uuid
+import asyncio
 
 
 @scheduler.task('cron', id='job_tests', hour='0,6,12,18', minute=0, misfire_grace_time=3600, timezone='Europe/Kiev')
@@ -11,21 +12,55 @@ def job_tests():
     with scheduler.app.app_context():
         current_app.logger.info('Starting job tests...')
         from app.main.routes import upload_url_task
+        from app.main.result_cache import mark_running
+        from app.main import queues
         if current_app.config['DEBUG']:
             url = 'http://kyi.download.datapacket.com/1mb.bin'
         else:
             url = 'http://kyi.download.datapacket.com/100mb.bin'
 
-        upload_url_task.delay(
-            url=url,
-            channel_uuid=uuid.uuid4(),
-            speed=100,
-            monopoly=False,
-            amount=1
-        )
+        channel_uuid = uuid.uuid4()
+        mark_running(channel_uuid)
+        queues.enqueue(upload_url_task, queues.SCHEDULED, {
+            'url': url,
+            'channel_uuid': channel_uuid,
+            'speed': 100,
+            'monopoly': False,
+            'amount': 1,
+        })
 
 
 @scheduler.task('cron', id='job_clean_tests', day='*', hour=0, minute=0, misfire_grace_time=3600, timezone='Europe/Kiev')
 def job_clean_tests():
-    db.create_all()
-    Test.query.filter(Test.datetime < datetime.now(timezone('Europe/Kiev')) - timedelta(days=7)).delete()
+    with scheduler.app.app_context():
+        db.create_all()
+        Test.query.filter(Test.datetime < datetime.now(timezone.utc) - timedelta(days=7)).delete()
+        db.session.commit()
+
+
+@scheduler.task('interval', id='job_evict_source_cache', minutes=30, misfire_grace_time=600)
+def job_evict_source_cache():
+    with scheduler.app.app_context():
+        from app.main.routes import delete_tebi_object
+        from app.main.source_cache import SourceCache
+
+        evicted = SourceCache().evict(delete_tebi_object)
+        current_app.logger.info(f'Evicted {evicted} cached sources')
+
+
+@scheduler.task('interval', id='job_probe_vps', minutes=1, misfire_grace_time=60)
+def job_probe_vps():
+    with scheduler.app.app_context():
+        from app.main.registry import probe_all
+
+        asyncio.run(probe_all())
+
+
+@scheduler.task('interval', id='job_flush_results', minutes=1, misfire_grace_time=60)
+def job_flush_results():
+    '''flushes tests whose scheduled flush was lost (worker restarted, redis was unavailable)'''
+    with scheduler.app.app_context():
+        from app.main.persistence import flush, replay_spill
+
+        replay_spill()
+        flush()
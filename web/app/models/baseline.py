@@ -0,0 +1,67 @@
+from app.extensions import db
+
+
+class Baseline(db.Model):
+    '''
+    rolling baseline of one metric of one storage on one vps, updated incrementally per test:
+        ewma - exponentially weighted moving average of the metric
+        ewmad - exponentially weighted mean absolute deviation from `ewma`
+
+    `ewmad` approximates median absolute deviation, which can't be updated exactly
+    without history: for normal noise it is ~1.19x MAD (0.80 vs 0.67 sigma), and it is
+    not robust to outliers by itself, so values more than `clip` spreads above `ewma` are
+    clipped before update (see `update`), one slow outlier moves it by at most `alpha * clip` spreads
+
+    `scope` separates baselines of metrics depending on test parameters
+    (transfer `time` depends on file, speed and amount), empty for latency and ttfb
+    '''
+    vps = db.Column(db.String(64), primary_key=True)
+    storage = db.Column(db.String(64), primary_key=True)
+    metric = db.Column(db.String(16), primary_key=True)
+    scope = db.Column(db.String(32), primary_key=True, default='')
+    ewma = db.Column(db.Float)
+    ewmad = db.Column(db.Float)
+    samples = db.Column(db.Integer, default=0)
+    updated = db.Column(db.DateTime(timezone=True))
+
+    def __repr__(self):
+        return f'<Baseline "{self.vps}/{self.storage}/{self.metric}">'
+
+    def get_spread(self, min_ratio: float) -> float:
+        '''deviation used for scoring, at least `min_ratio` of `ewma` so steady metrics don't flag noise'''
+        return max(self.ewmad, abs(self.ewma) * min_ratio, 1e-9)
+
+    def get_score(self, value: float, min_ratio: float) -> float:
+        '''how many spreads `value` is above baseline'''
+        return (value - self.ewma) / self.get_spread(min_ratio)
+
+    def update(self, value: float, alpha: float, clip: float = None):
+        '''
+        adds `value` to baseline, values above `clip` spreads are added as `clip`,
+        so one outlier or regression doesn't drag baseline up at once
+        '''
+        if not self.samples:
+            self.ewma = value
+            self.ewmad = 0.0
+            self.samples = 1
+            return
+
+        if clip is not None:
+            value = min(value, self.ewma + clip * self.get_spread(0))
+
+        deviation = value - self.ewma
+        self.ewma += alpha * deviation
+        self.ewmad += alpha * (abs(deviation) - self.ewmad)
+        self.samples += 1
+
+    def to_dict(self):
+        return {
+            'vps': self.vps,
+            'storage': self.storage,
+            'metric': self.metric,
+            'scope': self.scope,
+            'ewma': self.ewma,
+            'ewmad': self.ewmad,
+            'samples': self.samples,
+            'updated': self.updated.isoformat() if self.updated else None,
+        }
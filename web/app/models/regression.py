@@ -0,0 +1,38 @@
+from app.extensions import db
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy import func
+
+
+class Regression(db.Model):
+    '''
+    measurement of a test significantly above its baseline (see `Baseline`),
+    `deviation` is `value - baseline`, `score` is deviation in spreads of baseline
+    '''
+    id = db.Column(db.Integer, primary_key=True)
+    test_id = db.Column(UUID(as_uuid=True), index=True)
+    datetime = db.Column(db.DateTime(timezone=True), index=True, default=func.now())
+    url = db.Column(db.String(256))
+    vps = db.Column(db.String(64))
+    storage = db.Column(db.String(64))
+    metric = db.Column(db.String(16))
+    value = db.Column(db.Float)
+    baseline = db.Column(db.Float)
+    deviation = db.Column(db.Float)
+    score = db.Column(db.Float)
+
+    def __repr__(self):
+        return f'<Regression "{self.vps}/{self.storage}/{self.metric}">'
+
+    def to_dict(self):
+        return {
+            'test_id': str(self.test_id),
+            'datetime': self.datetime.isoformat() if self.datetime else None,
+            'url': self.url,
+            'vps': self.vps,
+            'storage': self.storage,
+            'metric': self.metric,
+            'value': self.value,
+            'baseline': self.baseline,
+            'deviation': self.deviation,
+            'score': self.score,
+        }
@@ -18,6 +18,10 @@ class Test(db.Model):
 
     @validates('content')
     def validate_content(self, key, content):
+        # already serialized status (`UploadStatus.to_json()`) is stored as is
+        if isinstance(content, str):
+            return content
+
         if not isinstance(content, dict):
             raise ValueError('Content must be a dict')
 
@@ -0,0 +1,82 @@
+from app.extensions import db
+from flask import current_app
+from sqlalchemy.exc import SQLAlchemyError
+import datetime
+
+
+class Vps(db.Model):
+    '''
+    registry of sub-hosts with health and circuit breaker state
+
+    circuit breaker:
+        closed - `circuit_open_until` is empty or in the past, tests are sent to vps
+        open - `failures` reached `CIRCUIT_FAILURE_THRESHOLD`, vps is skipped
+               until `circuit_open_until`, then one attempt is let through
+    '''
+    name = db.Column(db.String(64), primary_key=True)
+    url = db.Column(db.String(256), nullable=False)
+    enabled = db.Column(db.Boolean, default=True)
+    rtt = db.Column(db.Float)
+    last_probe = db.Column(db.DateTime(timezone=True))
+    failures = db.Column(db.Integer, default=0)
+    circuit_open_until = db.Column(db.DateTime(timezone=True))
+
+    def __repr__(self):
+        return f'<Vps "{self.name}">'
+
+    @classmethod
+    def get_urls(cls) -> dict:
+        '''
+        returns {vps_name: vps_url} of enabled vps
+        '''
+        return {vps.name: vps.url for vps in cls.query.filter_by(enabled=True).order_by(cls.name)}
+
+    @property
+    def circuit_open(self) -> bool:
+        if self.circuit_open_until is None:
+            return False
+
+        circuit_open_until = self.circuit_open_until
+        if circuit_open_until.tzinfo is None:
+            circuit_open_until = circuit_open_until.replace(tzinfo=datetime.timezone.utc)
+        return circuit_open_until > datetime.datetime.now(datetime.timezone.utc)
+
+    def record_success(self, rtt: float = None):
+        try:
+            db.session.begin_nested()
+            self.failures = 0
+            self.circuit_open_until = None
+            if rtt is not None:
+                self.rtt = rtt
+                self.last_probe = datetime.datetime.now(datetime.timezone.utc)
+            db.session.commit()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            raise e
+
+    def record_failure(self, probe: bool = False):
+        try:
+            db.session.begin_nested()
+            now = datetime.datetime.now(datetime.timezone.utc)
+            self.failures = (self.failures or 0) + 1
+            if probe:
+                self.rtt = None
+                self.last_probe = now
+            if self.failures >= current_app.config['CIRCUIT_FAILURE_THRESHOLD']:
+                self.circuit_open_until = now + datetime.timedelta(seconds=current_app.config['CIRCUIT_COOLDOWN'])
+            db.session.commit()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            raise e
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'url': self.url,
+            'enabled': self.enabled,
+            'rtt': self.rtt,
+            'last_probe': self.last_probe.isoformat() if self.last_probe else None,
+            'failures': self.failures,
+            'circuit_open': self.circuit_open,
+            'circuit_open_until': self.circuit_open_until.isoformat() if self.circuit_open_until else None,
+        }
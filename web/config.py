@@ -17,6 +17,11 @@ class Config:
     BASE_DIR = os.path.abspath(os.path.dirname(__file__))
     LOGS_DIR = os.path.join(BASE_DIR, 'logs')
 
+    # Logging ('text' or 'json' lines), files are reopened after external logrotate, which is safe
+    # when several processes write the same file, size rotation (`LOG_ROTATE`) is for single process hosts only
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
+    LOG_ROTATE = convert_to_bool(os.environ.get('LOG_ROTATE', False))
+
     SECRET_KEY = os.environ.get('SECRET_KEY')
     DEBUG = convert_to_bool(os.environ.get('FLASK_DEBUG', default=0))
     HOST_NAME = os.environ.get('HOST_NAME')
@@ -26,19 +31,167 @@ class Config:
     TEBI_SECRET = os.environ.get('TEBI_SECRET')
     TEBI_BUCKET = os.environ.get('TEBI_BUCKET')
 
+    # Object storage backends (S3-compatible, see `app.main.storage.StorageBackend`)
+
+    STORAGE_BACKENDS = json.loads(os.environ.get('STORAGE_BACKENDS', '{}')) or {
+        'tebi': {'endpoint_url': 'https://s3.tebi.io', 'key': TEBI_KEY, 'secret': TEBI_SECRET, 'bucket': TEBI_BUCKET},
+    }
+
+    # Payload generator
+
+    PAYLOAD_HOST_URL = os.environ.get('PAYLOAD_HOST_URL')
+    PAYLOAD_MAX_SIZE = int(os.environ.get('PAYLOAD_MAX_SIZE', 1024 * 1024 * 1024 * 10))
+
+    # Sub-host agent (max measurements running at once)
+
+    AGENT_MAX_CONCURRENCY = int(os.environ.get('AGENT_MAX_CONCURRENCY', 100))
+
+    # Control channel (websocket between main host and sub-hosts)
+
+    CONTROL_CHANNEL = convert_to_bool(os.environ.get('CONTROL_CHANNEL', False))
+    CONTROL_HEARTBEAT = float(os.environ.get('CONTROL_HEARTBEAT', 15))
+    CONTROL_PROGRESS_INTERVAL = float(os.environ.get('CONTROL_PROGRESS_INTERVAL', 0.5))
+    # sub-host without control channel is sent commands over http for this long (seconds)
+    CONTROL_UNAVAILABLE_TTL = float(os.environ.get('CONTROL_UNAVAILABLE_TTL', 300))
+
+    # Coordinated start (seconds)
+
+    CLOCK_SAMPLES = int(os.environ.get('CLOCK_SAMPLES', 5))
+    COORDINATED_START_MARGIN = float(os.environ.get('COORDINATED_START_MARGIN', 1))
+    COORDINATED_START_MAX_WAIT = float(os.environ.get('COORDINATED_START_MAX_WAIT', 60))
+
+    # Opt-in profiling (`X-Profile` header or `profile` of test request), profiles are saved to PROFILES_DIR
+
+    PROFILING = convert_to_bool(os.environ.get('PROFILING', False))
+    PROFILES_DIR = os.environ.get('PROFILES_DIR', os.path.join(LOGS_DIR, 'profiles'))
+    PROFILE_LOOP_LAG_INTERVAL = float(os.environ.get('PROFILE_LOOP_LAG_INTERVAL', 0.01))
+    PROFILE_TOP = int(os.environ.get('PROFILE_TOP', 30))
+
+    # Warm connection mode (max measured requests after the cold one)
+
+    WARM_MAX_REQUESTS = int(os.environ.get('WARM_MAX_REQUESTS', 10))
+
+    # Test deadlines and cancellation (seconds)
+
+    TEST_DEADLINE = int(os.environ.get('TEST_DEADLINE', 60 * 30))
+    CANCEL_POLL_INTERVAL = float(os.environ.get('CANCEL_POLL_INTERVAL', 0.5))
+
     SQLALCHEMY_DATABASE_URI = None
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     if MAIN_HOST:
         MAIN_HOST_URL = os.environ.get('MAIN_HOST_URL')
         HOSTS_URLS = os.environ.get('HOSTS_URLS').split(',') if os.environ.get('HOSTS_URLS') else []
-        VPS_URLS = json.loads(os.environ.get('VPS_URLS'))
+        # initial vps registry, seeded once by `vps_registry` migration
+        VPS_URLS = json.loads(os.environ.get('VPS_URLS', '{}'))
+
+        # Vps health (seconds)
+
+        VPS_CONNECT_TIMEOUT = float(os.environ.get('VPS_CONNECT_TIMEOUT', 10))
+        VPS_REQUEST_TIMEOUT = float(os.environ.get('VPS_REQUEST_TIMEOUT', 60 * 5))
+        VPS_PROBE_TIMEOUT = float(os.environ.get('VPS_PROBE_TIMEOUT', 5))
+        CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_FAILURE_THRESHOLD', 3))
+        CIRCUIT_COOLDOWN = int(os.environ.get('CIRCUIT_COOLDOWN', 60))
 
         REDIS_URL = os.environ.get('REDIS_URL')
 
+        # Source cache (seconds replicated source is reused, 0 disables cache)
+
+        SOURCE_CACHE_TTL = int(os.environ.get('SOURCE_CACHE_TTL', 60 * 60))
+
+        # Tebi replication (expected copies per region, seconds)
+
+        TEBI_REPLICATION_TOPOLOGY = os.environ.get('TEBI_REPLICATION_TOPOLOGY', 'DE:2,SGP:1,USE:2,USW:2')
+        TEBI_REPLICATION_POLL_INTERVAL = float(os.environ.get('TEBI_REPLICATION_POLL_INTERVAL', 0.5))
+        TEBI_REPLICATION_TIMEOUT = float(os.environ.get('TEBI_REPLICATION_TIMEOUT', 40))
+
+        # Finished test results for late sse subscribers (seconds)
+
+        RESULT_CACHE_TTL = int(os.environ.get('RESULT_CACHE_TTL', 60 * 60 * 24))
+        RESULT_RUNNING_TTL = int(os.environ.get('RESULT_RUNNING_TTL', 60 * 60 * 6))
+
+        # Regression detection against rolling baselines (EWMA of every metric per vps and storage),
+        # measurement is flagged when it is more than REGRESSION_THRESHOLD spreads above baseline,
+        # spread is at least REGRESSION_MIN_RATIO of baseline
+
+        REGRESSION_ALPHA = float(os.environ.get('REGRESSION_ALPHA', 0.1))
+        REGRESSION_THRESHOLD = float(os.environ.get('REGRESSION_THRESHOLD', 4))
+        REGRESSION_MIN_SAMPLES = int(os.environ.get('REGRESSION_MIN_SAMPLES', 10))
+        REGRESSION_MIN_RATIO = float(os.environ.get('REGRESSION_MIN_RATIO', 0.1))
+
+        # Single flight (seconds identical test requests join the first one, 0 disables)
+
+        SINGLE_FLIGHT_WINDOW = int(os.environ.get('SINGLE_FLIGHT_WINDOW', 0))
+
+        # Write-behind persistence of finished tests: results are buffered in redis and written to database
+        # in batches (seconds), buffer is spilled to PERSIST_SPILL_DIR while redis is unavailable
+
+        PERSIST_BATCH_SIZE = int(os.environ.get('PERSIST_BATCH_SIZE', 500))
+        PERSIST_FLUSH_INTERVAL = float(os.environ.get('PERSIST_FLUSH_INTERVAL', 5))
+        PERSIST_FLUSH_LOCK_TIMEOUT = int(os.environ.get('PERSIST_FLUSH_LOCK_TIMEOUT', 60 * 5))
+        PERSIST_RETRIES = int(os.environ.get('PERSIST_RETRIES', 3))
+        PERSIST_RETRY_DELAY = float(os.environ.get('PERSIST_RETRY_DELAY', 0.5))
+        PERSIST_OUTAGE_INTERVAL = float(os.environ.get('PERSIST_OUTAGE_INTERVAL', 30))
+        PERSIST_SPILL_DIR = os.environ.get('PERSIST_SPILL_DIR', os.path.join(LOGS_DIR, 'spill'))
+
+        # Analytics over test history (rows fetched from database at once, memoized queries per process)
+
+        ANALYTICS_BATCH_SIZE = int(os.environ.get('ANALYTICS_BATCH_SIZE', 5000))
+        ANALYTICS_MEMO_SIZE = int(os.environ.get('ANALYTICS_MEMO_SIZE', 128))
+
+        # Export of test history (rows fetched from database at once)
+
+        EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))
+
+        # Batch test plans
+
+        BATCH_CONCURRENCY = int(os.environ.get('BATCH_CONCURRENCY', 2))
+        BATCH_MAX_CELLS = int(os.environ.get('BATCH_MAX_CELLS', 100))
+
+        # Celery queues, workers consume them separately (`-Q`), so scheduled sweeps and
+        # admission retries don't delay interactive tests. Priority 0 is the highest,
+        # a worker consuming several queues drains them in order of priority
+
+        CELERY_QUEUES = {
+            'interactive': {
+                'name': os.environ.get('CELERY_QUEUE_INTERACTIVE', 'interactive'),
+                'priority': int(os.environ.get('CELERY_PRIORITY_INTERACTIVE', 0)),
+            },
+            'retry': {
+                'name': os.environ.get('CELERY_QUEUE_RETRY', 'retry'),
+                'priority': int(os.environ.get('CELERY_PRIORITY_RETRY', 3)),
+            },
+            'scheduled': {
+                'name': os.environ.get('CELERY_QUEUE_SCHEDULED', 'scheduled'),
+                'priority': int(os.environ.get('CELERY_PRIORITY_SCHEDULED', 6)),
+            },
+            # flushes of finished tests, short and never queued behind tests
+            'persist': {
+                'name': os.environ.get('CELERY_QUEUE_PERSIST', 'persist'),
+                'priority': int(os.environ.get('CELERY_PRIORITY_PERSIST', 0)),
+            },
+        }
+
         CELERY = {
             'broker_url': REDIS_URL,
             'result_backend': REDIS_URL,
             'task_ignore_result': True,
+            'task_default_queue': CELERY_QUEUES['interactive']['name'],
+            'task_default_priority': CELERY_QUEUES['interactive']['priority'],
+            'task_routes': {
+                'app.main.routes.upload_url_task': {'queue': CELERY_QUEUES['interactive']['name']},
+                'app.main.routes.upload_url_batch_task': {'queue': CELERY_QUEUES['scheduled']['name']},
+                'app.main.persistence.flush_task': {'queue': CELERY_QUEUES['persist']['name']},
+            },
+            # tests are long and wait on network, a worker process reserves only the task it runs,
+            # so queued tests go to whichever process frees up first
+            'worker_prefetch_multiplier': int(os.environ.get('CELERY_PREFETCH_MULTIPLIER', 1)),
+            'broker_transport_options': {
+                'priority_steps': list(range(10)),
+                'sep': ':',
+                'queue_order_strategy': 'priority',
+                # tests with `eta` stay unacknowledged on a worker until they run
+                'visibility_timeout': int(os.environ.get('CELERY_VISIBILITY_TIMEOUT', 60 * 60 * 24)),
+            },
         }
 
         # Scheduler
@@ -0,0 +1,81 @@
+import os
+
+# tests run as main host, config is read from environment once it is imported
+os.environ.setdefault('MAIN_HOST', 'True')
+os.environ.setdefault('HOST_NAME', 'main')
+os.environ.setdefault('SECRET_KEY', 'test')
+os.environ.setdefault('FLASK_DEBUG', '0')
+os.environ.setdefault('REDIS_URL', 'redis://localhost:6379/15')
+
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.ext.compiler import compiles
+import pytest
+
+
+@compiles(JSONB, 'sqlite')
+def compile_jsonb_sqlite(type_, compiler, **kwargs):
+    return 'JSON'
+
+
+@pytest.fixture(scope='session')
+def flask_app(tmp_path_factory):
+    '''app can be created once per process, blueprints are set up at import'''
+    from app import create_app
+    from config import Config
+
+    tmp_path = tmp_path_factory.mktemp('app')
+
+    class TestConfig(Config):
+        SQLALCHEMY_DATABASE_URI = 'sqlite://'
+        LOGS_DIR = str(tmp_path / 'logs')
+        PERSIST_SPILL_DIR = str(tmp_path / 'spill')
+        PERSIST_RETRY_DELAY = 0
+
+    return create_app(TestConfig)
+
+
+@pytest.fixture
+def app(flask_app):
+    '''app context with empty database, config changes are undone after test'''
+    from app.extensions import db
+
+    config = dict(flask_app.config)
+    with flask_app.app_context():
+        db.create_all()
+        yield flask_app
+        db.session.remove()
+        db.drop_all()
+    flask_app.config.clear()
+    flask_app.config.update(config)
+
+
+@pytest.fixture
+def redis(app):
+    '''in-memory redis behind `get_redis()`'''
+    import fakeredis
+    from app import extensions
+
+    client = fakeredis.FakeRedis()
+    extensions._redis_clients[app.config['REDIS_URL']] = client
+    yield client
+    del extensions._redis_clients[app.config['REDIS_URL']]
+
+
+@pytest.fixture
+def enqueued(monkeypatch):
+    '''tasks sent by `queues.enqueue`, nothing reaches celery'''
+    from app.main import queues
+
+    sent = []
+    monkeypatch.setattr(queues, 'enqueue', lambda task, kind, kwargs, eta=None: sent.append((task.name, kind, eta)))
+    return sent
+
+
+@pytest.fixture
+def announced(monkeypatch):
+    '''channels of sse announcements, nothing is published'''
+    from flask_sse import sse
+
+    channels = []
+    monkeypatch.setattr(sse, 'publish', lambda message, channel: channels.append(channel))
+    return channels
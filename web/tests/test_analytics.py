@@ -0,0 +1,125 @@
+from app.extensions import db
+from app.main import analytics
+from app.main.persistence import LANDED_KEY
+from app.models import test as test_model
+import datetime
+import json
+import uuid
+import numpy as np
+import pytest
+
+
+NOW = datetime.datetime(2024, 5, 1, 12, tzinfo=datetime.timezone.utc)
+
+
+def add_test(test_datetime, vps):
+    '''`vps` is {vps_name: time ms} of successful tebi measurements'''
+    content = {'vps': {name: {'ip': '127.0.0.1', 'tebi': {'ok': True, 'time': value}} for name, value in vps.items()}}
+    db.session.add(test_model.Test(id=uuid.uuid4(), datetime=test_datetime, url='http://example.com/1mb.bin', execution_time=1, content=json.dumps(content)))
+    db.session.commit()
+
+
+def test_group_quantiles_match_numpy():
+    rng = np.random.default_rng(1)
+    codes = rng.integers(0, 5, 1000)
+    codes[codes == 3] = 4  # group 3 stays empty
+    values = rng.exponential(100, 1000)
+
+    output = analytics.group_quantiles(codes, values, 6, (0, 0.5, 0.95, 1))
+
+    for group in (0, 1, 2, 4):
+        assert output[group] == pytest.approx(np.quantile(values[codes == group], (0, 0.5, 0.95, 1)))
+    assert np.isnan(output[3]).all()
+    assert np.isnan(output[5]).all()
+
+
+def test_group_quantiles_of_single_value():
+    output = analytics.group_quantiles(np.array([1]), np.array([7.0]), 2, (0.5, 0.99))
+
+    assert output[1].tolist() == [7.0, 7.0]
+
+
+def test_ranks_average_ties():
+    ranks = analytics._ranks(np.array([10.0, 20.0, 20.0, 5.0, 20.0]))
+
+    assert ranks.tolist() == [1, 3, 3, 0, 3]
+
+
+def test_spearman_of_monotonic_relation():
+    columns = {
+        'latency': np.array([1.0, 2.0, 3.0, 4.0]),
+        'throughput': np.array([100.0, 50.0, 20.0, 1.0]),
+        'host': np.array([0, 0, 1, 1]),
+        'ok': np.ones(4, dtype=bool),
+    }
+
+    correlation = analytics.get_correlation(columns, np.ones(4, dtype=bool), ['a', 'b'])
+
+    assert correlation['spearman'] == pytest.approx(-1)
+    assert correlation['vps'] == {'a': -1, 'b': -1}
+
+
+def test_sync_loads_only_new_tests(app, redis):
+    add_test(NOW - datetime.timedelta(hours=2), {'a': 100})
+    store = analytics.MeasurementStore()
+    store.sync()
+
+    add_test(NOW - datetime.timedelta(hours=1), {'a': 200, 'b': 300})
+    store.sync()
+
+    assert store.analyze()['measurements'] == 3
+    assert store.hosts == ['a', 'b']
+
+
+def test_sync_picks_up_tests_written_late(app, redis):
+    add_test(NOW, {'a': 100})
+    store = analytics.MeasurementStore()
+    store.sync()
+    first = store.analyze()
+
+    # test finished before the last loaded one, its batch was flushed after the sync
+    late = NOW - datetime.timedelta(minutes=5)
+    add_test(late, {'b': 300})
+    store.sync()
+    assert store.analyze() is first
+
+    redis.xadd(LANDED_KEY, {'from': late.isoformat()})
+    store.sync()
+
+    assert store.analyze()['measurements'] == 2
+    assert store.hosts == ['a', 'b']
+
+
+def test_sync_reloads_when_landed_stream_was_trimmed(app, redis):
+    redis.xadd(LANDED_KEY, {'from': NOW.isoformat()})
+    add_test(NOW, {'a': 100})
+    store = analytics.MeasurementStore()
+    store.sync()
+
+    add_test(NOW - datetime.timedelta(days=1), {'b': 300})
+    # more batches landed than the stream keeps, entries seen by the store are gone
+    redis.delete(LANDED_KEY)
+    redis.xadd(LANDED_KEY, {'from': NOW.isoformat()})
+    store.sync()
+
+    assert store.analyze()['measurements'] == 2
+
+
+def test_analyze_ranks_vps(app, redis):
+    for index in range(5):
+        add_test(NOW + datetime.timedelta(minutes=index), {'fast': 100 + index, 'slow': 500 + index})
+    store = analytics.MeasurementStore()
+    store.sync()
+
+    ranking = store.analyze(metric='time')['ranking']
+
+    assert [row['vps'] for row in ranking] == ['fast', 'slow']
+    assert ranking[0]['median'] == 102
+    assert ranking[0]['failure_rate'] == 0
+
+
+def test_api_rejects_invalid_timestamp(app):
+    response = app.test_client().get('/api/analytics?from=yesterday')
+
+    assert response.status_code == 400
+    assert response.json == {'error': '\'from\' must be unix timestamp'}
@@ -0,0 +1,51 @@
+from app.models.baseline import Baseline
+import pytest
+
+
+def make_baseline(*values, alpha=0.5):
+    baseline = Baseline(vps='vps', storage='tebi', metric='ttfb', scope='', samples=0)
+    for value in values:
+        baseline.update(value, alpha)
+    return baseline
+
+
+def test_first_value_starts_baseline():
+    baseline = make_baseline(100)
+
+    assert baseline.ewma == 100
+    assert baseline.ewmad == 0
+    assert baseline.samples == 1
+
+
+def test_update_moves_average_and_spread():
+    baseline = make_baseline(100, 120)
+
+    assert baseline.ewma == pytest.approx(110)
+    assert baseline.ewmad == pytest.approx(10)
+    assert baseline.samples == 2
+
+
+def test_update_clips_outlier():
+    clipped = make_baseline(100, 120)
+    clipped.update(10_000, 0.5, clip=3)
+
+    # 110 + 3 spreads of 10
+    assert clipped.ewma == pytest.approx(110 + 0.5 * 30)
+    assert clipped.ewmad == pytest.approx(10 + 0.5 * (30 - 10))
+
+
+def test_clip_doesnt_change_values_below_it():
+    clipped, unclipped = make_baseline(100, 120), make_baseline(100, 120)
+    clipped.update(105, 0.5, clip=3)
+    unclipped.update(105, 0.5)
+
+    assert clipped.ewma == unclipped.ewma
+    assert clipped.ewmad == unclipped.ewmad
+
+
+def test_score_uses_min_ratio_for_steady_metric():
+    baseline = make_baseline(100, 100, 100)
+
+    assert baseline.ewmad == 0
+    assert baseline.get_spread(0.1) == pytest.approx(10)
+    assert baseline.get_score(130, 0.1) == pytest.approx(3)
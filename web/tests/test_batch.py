@@ -0,0 +1,147 @@
+from app.extensions import db
+from app.main import routes
+from app.models.vps import Vps
+import asyncio
+import pytest
+
+
+@pytest.fixture
+def vps(app):
+    db.session.add(Vps(name='vps_1', url='http://10.10.10.10:5000', enabled=True, failures=0))
+    db.session.add(Vps(name='vps_2', url='http://10.10.10.11:5000', enabled=True, failures=0))
+    db.session.commit()
+
+
+@pytest.fixture
+def batch(app, redis, vps, announced, monkeypatch):
+    '''
+    `upload_url_batch` with replication and tests replaced by fakes,
+    returns calls of fakes and saved results by cell uuid
+    '''
+    app.config['CANCEL_POLL_INTERVAL'] = 0.01
+    calls = {'replicate': [], 'release': [], 'replication_cancelled': [], 'saved': {}}
+
+    async def replicate_url_cached(url, upload_status, deadline_at=None, verify=None):
+        calls['replicate'].append(url)
+        try:
+            await asyncio.sleep(calls.get('replication_time', 0))
+        except asyncio.CancelledError:
+            calls['replication_cancelled'].append(url)
+            raise
+        upload_status.file_size = 1024
+        upload_status.tebi_status = 3
+        return None, f'file_of_{url}'
+
+    async def run_upload_test(url, upload_status, speed, amount, replication, *args):
+        test = calls.get('test')
+        try:
+            if test is not None:
+                await test(upload_status)
+        except BaseException:
+            replication.close()
+            raise
+        return await replication
+
+    async def release_source(source_key, file_name):
+        calls['release'].append(file_name)
+
+    async def abort_test(test_id, vps_urls):
+        pass
+
+    async def evaluate_regressions(*args):
+        return []
+
+    def save_test(upload_status, url, execution_time):
+        calls['saved'][upload_status.uuid] = upload_status.get_status()
+
+    monkeypatch.setattr(routes, 'replicate_url_cached', replicate_url_cached)
+    monkeypatch.setattr(routes, 'run_upload_test', run_upload_test)
+    monkeypatch.setattr(routes, 'release_source', release_source)
+    monkeypatch.setattr(routes, 'abort_test', abort_test)
+    monkeypatch.setattr(routes, 'save_test', save_test)
+    monkeypatch.setattr(routes, 'evaluate_regressions', evaluate_regressions)
+    return calls
+
+
+def make_plan(*urls, deadline=60):
+    return {
+        'uuid': 'batch',
+        'monopoly': False,
+        'concurrency': 2,
+        'deadline': deadline,
+        'cells': [
+            {'uuid': f'cell_{index}', 'url': url, 'speed': 100, 'amount': 1, 'payload_size': None, 'hosts': ['vps_1']}
+            for index, url in enumerate(urls)
+        ],
+    }
+
+
+def test_plan_skips_duplicate_cells(app, redis, vps, enqueued):
+    resp = app.test_client().post('/api/upload-url-test/batch', json={
+        'urls': ['http://example.com/1mb.bin'],
+        'speeds': [100, 200],
+        'hosts': [['vps_1', 'vps_2'], ['vps_2', 'vps_1'], ['vps_1']],
+    })
+
+    assert resp.status_code == 200
+    assert [(cell['speed'], cell['hosts']) for cell in resp.json['cells']] == [
+        (100, ['vps_1', 'vps_2']), (100, ['vps_1']), (200, ['vps_1', 'vps_2']), (200, ['vps_1']),
+    ]
+    assert enqueued == [('app.main.routes.upload_url_batch_task', 'scheduled', None)]
+
+
+def test_plan_rejects_unknown_vps(app, redis, vps, enqueued):
+    resp = app.test_client().post('/api/upload-url-test/batch', json={
+        'urls': ['http://example.com/1mb.bin'],
+        'hosts': [['vps_3']],
+    })
+
+    assert resp.status_code == 400
+    assert resp.json == {'error': 'Unknown vps: vps_3'}
+    assert enqueued == []
+
+
+def test_cells_share_replication(batch, announced):
+    asyncio.run(routes.upload_url_batch(make_plan('http://a/1mb.bin', 'http://a/1mb.bin', 'http://b/1mb.bin')))
+
+    assert sorted(batch['replicate']) == ['http://a/1mb.bin', 'http://b/1mb.bin']
+    assert sorted(batch['release']) == ['file_of_http://a/1mb.bin', 'file_of_http://b/1mb.bin']
+    assert all(status['finished'] and status['file_size'] == 1024 for status in batch['saved'].values())
+    # shared replication isn't announced on channels of its own
+    assert set(announced) == {'batch', 'cell_0', 'cell_1', 'cell_2'}
+
+
+def test_replication_is_cancelled_when_no_cell_waits(batch):
+    batch['replication_time'] = 10
+
+    async def test(upload_status):
+        raise RuntimeError('vps failed')
+
+    batch['test'] = test
+    asyncio.run(routes.upload_url_batch(make_plan('http://a/1mb.bin', 'http://a/1mb.bin')))
+
+    assert batch['replication_cancelled'] == ['http://a/1mb.bin']
+    assert batch['release'] == []
+    assert [status['error'] for status in batch['saved'].values()] == ['error while running test'] * 2
+
+
+def test_cell_deadline(batch):
+    async def test(upload_status):
+        await asyncio.sleep(10)
+
+    batch['test'] = test
+    asyncio.run(routes.upload_url_batch(make_plan('http://a/1mb.bin', deadline=0.05)))
+
+    assert batch['saved']['cell_0']['error'] == 'Deadline exceeded'
+    assert batch['release'] == ['file_of_http://a/1mb.bin']
+
+
+def test_cancelled_cell(batch):
+    async def test(upload_status):
+        routes.request_cancel(upload_status.uuid)
+        await asyncio.sleep(10)
+
+    batch['test'] = test
+    asyncio.run(routes.upload_url_batch(make_plan('http://a/1mb.bin', 'http://b/1mb.bin')))
+
+    assert [status['error'] for status in batch['saved'].values()] == ['Test cancelled'] * 2
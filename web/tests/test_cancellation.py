@@ -0,0 +1,168 @@
+from aiohttp import web, ClientResponseError
+from aiohttp.test_utils import TestServer
+from app.main import cancellation, routes
+import asyncio
+import time
+import pytest
+
+
+@pytest.fixture
+def poll(app, redis):
+    app.config['CANCEL_POLL_INTERVAL'] = 0.01
+    return app
+
+
+def test_run_with_deadline_returns_result(poll):
+    async def measure():
+        await asyncio.sleep(0.01)
+        return 'result'
+
+    assert asyncio.run(cancellation.run_with_deadline(measure(), ['test'], time.time() + 1)) == 'result'
+
+
+def test_run_with_deadline_times_out(poll):
+    stopped = []
+
+    async def measure():
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            stopped.append(True)
+            raise
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(cancellation.run_with_deadline(measure(), ['test'], time.time() + 0.05))
+    assert stopped == [True]
+
+
+def test_run_with_deadline_cancels_on_request(poll):
+    async def measure():
+        cancellation.request_cancel('batch')
+        await asyncio.sleep(10)
+
+    with pytest.raises(cancellation.TestCancelled):
+        asyncio.run(cancellation.run_with_deadline(measure(), ['batch', 'cell'], time.time() + 1))
+
+
+def test_cancel_requested_before_start(poll):
+    cancellation.request_cancel('cell')
+
+    async def measure():
+        await asyncio.sleep(10)
+
+    with pytest.raises(cancellation.TestCancelled):
+        asyncio.run(cancellation.run_with_deadline(measure(), [None, 'cell']))
+
+
+class Bucket:
+    def __init__(self, on_put=None) -> None:
+        self.objects = set()
+        self.on_put = on_put
+
+    def put_object(self, Key, Body):
+        self.objects.add(Key)
+        if self.on_put is not None:
+            self.on_put()
+
+
+class Storage:
+    '''primary storage, replication of uploaded files never completes'''
+
+    def __init__(self, bucket: Bucket) -> None:
+        self.bucket = bucket
+
+    def get_bucket(self):
+        return self.bucket
+
+    def head_object(self, key):
+        return {'ResponseMetadata': {'HTTPHeaders': {'x-tb-replication': 'DE:1'}}}
+
+    def delete_object(self, key):
+        self.bucket.objects.discard(key)
+
+
+@pytest.fixture
+def storage(app, monkeypatch):
+    app.config['TEBI_REPLICATION_POLL_INTERVAL'] = 0.01
+    app.config['TEBI_REPLICATION_TIMEOUT'] = 10
+    storage = Storage(Bucket())
+    monkeypatch.setattr(routes, 'get_storage', lambda name: storage)
+    return storage
+
+
+def replicate(source, deadline=None, cancel_after=None):
+    '''replicates `source` handler of local server, returns result or raised exception'''
+    async def main():
+        app = web.Application()
+        app.router.add_get('/1mb.bin', source)
+        server = TestServer(app)
+        await server.start_server()
+        try:
+            deadline_at = time.time() + deadline if deadline is not None else None
+            task = asyncio.create_task(routes.replicate_url(
+                str(server.make_url('/1mb.bin')), routes.ReplicationStatus(), deadline_at
+            ))
+            if cancel_after is not None:
+                await asyncio.sleep(cancel_after)
+                task.cancel()
+            try:
+                return await task
+            except BaseException as e:
+                return e
+        finally:
+            await server.close()
+
+    return asyncio.run(main())
+
+
+async def source(request):
+    return web.Response(body=b'x' * 1024)
+
+
+async def slow_source(request):
+    resp = web.StreamResponse()
+    await resp.prepare(request)
+    await resp.write(b'x' * 1024)
+    await asyncio.sleep(10)
+    return resp
+
+
+async def missing_source(request):
+    return web.Response(status=404)
+
+
+def test_replication_wait_returns_incomplete_at_deadline(storage):
+    file_name, file_size = replicate(source, deadline=0.2)
+
+    assert file_size == 1024
+    assert storage.bucket.objects == {file_name}
+
+
+def test_cancelled_replication_wait_deletes_file(storage):
+    result = replicate(source, cancel_after=0.2)
+
+    assert isinstance(result, asyncio.CancelledError)
+    assert storage.bucket.objects == set()
+
+
+def test_cancel_right_after_upload_deletes_file(storage):
+    storage.bucket.on_put = lambda: asyncio.current_task().cancel()
+
+    result = replicate(source)
+
+    assert isinstance(result, asyncio.CancelledError)
+    assert storage.bucket.objects == set()
+
+
+def test_deadline_during_download_uploads_nothing(storage):
+    result = replicate(slow_source, deadline=0.1)
+
+    assert isinstance(result, asyncio.TimeoutError)
+    assert storage.bucket.objects == set()
+
+
+def test_missing_source_raises(storage):
+    result = replicate(missing_source)
+
+    assert isinstance(result, ClientResponseError)
+    assert result.status == 404
@@ -0,0 +1,155 @@
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from app.main import routes
+from app.main.control import ControlClient, ControlUnavailable, ControlClosed
+import asyncio
+
+
+RESULT = {'vps_name': 'vps_1', 'file_ip': '10.0.0.1', 'time': 20, 'ttfb': 5, 'latency': 2.5}
+
+
+def make_sub_host(control=None):
+    '''
+    sub-host answering `/api/upload-url` over http, `control(ws, data)` handles
+    commands of control channel if set, returns app and its requests
+    '''
+    requests = []
+
+    @web.middleware
+    async def record(request, handler):
+        requests.append((request.method, request.path))
+        return await handler(request)
+
+    async def upload_url(request):
+        return web.json_response(RESULT)
+
+    async def control_channel(request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        async for msg in ws:
+            await control(ws, msg.json())
+        return ws
+
+    app = web.Application(middlewares=[record])
+    app.router.add_post('/api/upload-url', upload_url)
+    if control is not None:
+        app.router.add_get('/api/control', control_channel)
+    return app, requests
+
+
+async def answer(ws, data):
+    await ws.send_json({'type': 'progress', 'id': data['id'], 'bytes': 1024, 'elapsed': 0.1})
+    await ws.send_json({'type': 'result', 'id': data['id'], 'status': 200, 'json': RESULT})
+
+
+async def hang_up(ws, data):
+    await ws.close()
+
+
+async def close(client: ControlClient):
+    for channel in client._channels.values():
+        if channel._ws is not None:
+            await channel._ws.close()
+    await client._session.close()
+
+
+def run_command(app, unavailable_ttl=60, times=1):
+    '''sends command `times` over new `ControlClient`, returns results or raised exceptions'''
+    async def main():
+        client = ControlClient()
+        server = TestServer(app)
+        await server.start_server()
+        progress = []
+        try:
+            results = []
+            for _ in range(times):
+                try:
+                    results.append(await client.request(
+                        str(server.make_url('/api/control')), 15, '/api/upload-url', {}, progress.append, unavailable_ttl
+                    ))
+                except ConnectionError as e:
+                    results.append(e)
+            await asyncio.sleep(0)
+            return results, progress
+        finally:
+            await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(close(client), client._loop))
+            client._loop.call_soon_threadsafe(client._loop.stop)
+            await server.close()
+
+    return asyncio.run(main())
+
+
+def test_command_over_control_channel():
+    app, requests = make_sub_host(answer)
+
+    results, progress = run_command(app)
+
+    assert results == [(200, RESULT)]
+    assert progress[0]['bytes'] == 1024
+
+
+def test_sub_host_without_control_channel_is_remembered():
+    app, requests = make_sub_host()
+
+    results, _ = run_command(app, times=2)
+
+    assert all(isinstance(result, ControlUnavailable) for result in results)
+    # second command isn't tried over control channel
+    assert requests == [('GET', '/api/control')]
+
+
+def test_sub_host_without_control_channel_is_asked_again_after_ttl():
+    app, requests = make_sub_host()
+
+    results, _ = run_command(app, unavailable_ttl=0, times=2)
+
+    assert all(isinstance(result, ControlUnavailable) for result in results)
+    assert requests == [('GET', '/api/control')] * 2
+
+
+def test_channel_closed_while_command_runs():
+    app, requests = make_sub_host(hang_up)
+
+    results, _ = run_command(app)
+
+    assert isinstance(results[0], ControlClosed)
+
+
+def run_publish(app, control):
+    '''publishes object test to sub-host with control channel enabled, returns test status and requests'''
+    sub_host, requests = make_sub_host(control)
+    app.config['CONTROL_CHANNEL'] = True
+
+    async def main():
+        client = ControlClient()
+        routes.control_client, control_client = client, routes.control_client
+        server = TestServer(sub_host)
+        await server.start_server()
+        try:
+            vps_urls = {'vps_1': str(server.make_url('')).rstrip('/')}
+            upload_status = routes.UploadStatus('test', vps_urls, [])
+            await routes.publish(routes.api_upload_url_endpoint, {'url': 'http://example.com/1mb.bin'}, 'object', upload_status, vps_urls)
+            return upload_status.get_status()
+        finally:
+            routes.control_client = control_client
+            if client._loop is not None:
+                await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(close(client), client._loop))
+                client._loop.call_soon_threadsafe(client._loop.stop)
+            await server.close()
+
+    return asyncio.run(main()), requests
+
+
+def test_publish_falls_back_to_http(app, redis, announced):
+    status, requests = run_publish(app, None)
+
+    assert (status['ok'], status['failed']) == (1, 0)
+    assert status['vps']['vps_1']['object']['status'] == 2
+    assert requests == [('GET', '/api/control'), ('POST', '/api/upload-url')]
+
+
+def test_publish_fails_command_when_channel_closes(app, redis, announced):
+    status, requests = run_publish(app, hang_up)
+
+    assert (status['ok'], status['failed']) == (0, 1)
+    assert requests == [('GET', '/api/control')]
@@ -0,0 +1,65 @@
+from app.main.integrity import StreamHasher, IntegrityError, is_supported
+import hashlib
+import pytest
+
+
+DATA = b'0123456789' * 1000
+MD5 = hashlib.md5(DATA).hexdigest()
+SHA256 = hashlib.sha256(DATA).hexdigest()
+
+
+def make_hasher(algorithm, data=DATA, chunk_size=4096):
+    hasher = StreamHasher(algorithm)
+    for offset in range(0, len(data), chunk_size):
+        hasher.update(data[offset:offset + chunk_size])
+    return hasher
+
+
+def test_chunks_hash_like_whole_file():
+    hasher = make_hasher('sha256')
+
+    assert hasher.hexdigest() == SHA256
+    assert hasher.size == len(DATA)
+
+
+def test_verify_passes_all_checks():
+    checks = make_hasher('md5').verify(size=str(len(DATA)), etag=f'"{MD5.upper()}"', digest=MD5)
+
+    assert checks == ['size', 'etag', 'digest']
+
+
+def test_verify_without_declared_values_checks_nothing():
+    assert make_hasher('md5').verify() == []
+
+
+def test_verify_fails_on_size():
+    with pytest.raises(IntegrityError, match='expected'):
+        make_hasher('sha256', DATA[:-1]).verify(size=len(DATA))
+
+
+def test_verify_fails_on_etag():
+    with pytest.raises(IntegrityError, match='etag'):
+        make_hasher('md5', DATA[:-1]).verify(etag=MD5)
+
+
+def test_verify_skips_etag_that_is_not_md5():
+    # multipart upload etag and etag of other algorithm can't be compared
+    assert make_hasher('md5').verify(etag=f'"{MD5}-2"') == []
+    assert make_hasher('sha256').verify(etag=MD5) == []
+
+
+def test_verify_fails_on_digest():
+    with pytest.raises(IntegrityError, match='digest'):
+        make_hasher('sha256').verify(digest=MD5)
+
+
+def test_verify_response_ignores_size_of_encoded_body():
+    hasher = make_hasher('md5')
+
+    assert hasher.verify_response({'Content-Length': '10', 'Content-Encoding': 'gzip'}) == []
+    assert hasher.verify_response({'Content-Length': str(len(DATA)), 'ETag': MD5}) == ['size', 'etag']
+
+
+@pytest.mark.skipif(not is_supported('crc32c'), reason='crc32c package is not installed')
+def test_crc32c_digest():
+    assert make_hasher('crc32c', b'123456789').hexdigest() == 'e3069283'
@@ -0,0 +1,140 @@
+from app.extensions import db
+from app.main import persistence, queues
+from app.models import test as test_model
+from redis.exceptions import ConnectionError
+from sqlalchemy.exc import IntegrityError, OperationalError
+import uuid
+import pytest
+
+
+def count_tests():
+    return db.session.query(test_model.Test).count()
+
+
+def make_records(amount):
+    return [persistence.make_record(uuid.uuid4(), 'http://example.com/1mb.bin', 1.5, '{"vps": {}}') for _ in range(amount)]
+
+
+def test_save_test_buffers_and_schedules_flush(app, redis, enqueued):
+    app.config['PERSIST_BATCH_SIZE'] = 2
+    for _ in range(2):
+        persistence.save_test(uuid.uuid4(), 'http://example.com/1mb.bin', 1.5, '{}')
+
+    assert redis.llen(persistence.PENDING_KEY) == 2
+    # delayed flush of the first test, then one right away for the full batch
+    assert [(kind, eta is None) for _, kind, eta in enqueued] == [(queues.PERSIST, False), (queues.PERSIST, True)]
+
+
+def test_flush_writes_batches(app, redis):
+    redis.rpush(persistence.PENDING_KEY, *make_records(7))
+
+    assert persistence.flush(batch_size=3) == 7
+    assert count_tests() == 7
+    assert redis.llen(persistence.PENDING_KEY) == 0
+    assert redis.xlen(persistence.LANDED_KEY) == 3
+
+
+def test_flush_skips_tests_already_written(app, redis):
+    records = make_records(2)
+    redis.rpush(persistence.PENDING_KEY, *records)
+    persistence.flush()
+
+    # batch retried after a crash between commit and trim
+    redis.rpush(persistence.PENDING_KEY, *records)
+    persistence.flush()
+
+    assert count_tests() == 2
+    assert redis.llen(persistence.PENDING_KEY) == 0
+
+
+def test_flush_runs_once_at_a_time(app, redis):
+    redis.rpush(persistence.PENDING_KEY, *make_records(1))
+    redis.set(persistence.FLUSH_LOCK_KEY, 'other')
+
+    assert persistence.flush() == 0
+    assert redis.llen(persistence.PENDING_KEY) == 1
+
+
+def test_flush_keeps_batch_when_lock_is_lost(app, redis, monkeypatch):
+    redis.rpush(persistence.PENDING_KEY, *make_records(4))
+    write_batch = persistence.write_batch
+
+    def write_batch_slowly(records):
+        written = write_batch(records)
+        # lock expired while database was slow and another flusher took it
+        redis.set(persistence.FLUSH_LOCK_KEY, 'other')
+        return written
+
+    monkeypatch.setattr(persistence, 'write_batch', write_batch_slowly)
+
+    assert persistence.flush(batch_size=2) == 2
+    assert redis.llen(persistence.PENDING_KEY) == 4
+    assert redis.xlen(persistence.LANDED_KEY) == 0
+
+
+def test_flush_keeps_tests_while_database_is_down(app, redis, monkeypatch):
+    redis.rpush(persistence.PENDING_KEY, *make_records(2))
+
+    def insert(rows):
+        raise OperationalError('INSERT', {}, Exception('database is down'))
+
+    monkeypatch.setattr(persistence, '_insert', insert)
+
+    with pytest.raises(OperationalError):
+        persistence.flush()
+    assert redis.llen(persistence.PENDING_KEY) == 2
+
+
+def test_write_batch_retries_while_database_is_unreachable(app, redis, monkeypatch):
+    insert = persistence._insert
+    failures = [OperationalError('INSERT', {}, Exception('database is down'))] * app.config['PERSIST_RETRIES']
+
+    def flaky_insert(rows):
+        if failures:
+            raise failures.pop()
+        insert(rows)
+
+    monkeypatch.setattr(persistence, '_insert', flaky_insert)
+
+    assert persistence.write_batch(make_records(3)) == 3
+    assert count_tests() == 3
+
+
+def test_write_batch_moves_rejected_tests_aside(app, redis, monkeypatch):
+    records = make_records(3)
+    rejected_id = persistence._to_row(records[1])['id']
+    insert = persistence._insert
+
+    def strict_insert(rows):
+        if any(row['id'] == rejected_id for row in rows):
+            raise IntegrityError('INSERT', {}, Exception('invalid row'))
+        insert(rows)
+
+    monkeypatch.setattr(persistence, '_insert', strict_insert)
+
+    assert persistence.write_batch(records) == 2
+    assert count_tests() == 2
+    assert redis.lrange(persistence.FAILED_KEY, 0, -1) == [records[1]]
+
+
+def test_save_test_spills_while_redis_is_down(app, redis, monkeypatch, enqueued):
+    def rpush(*args):
+        raise ConnectionError('redis is down')
+
+    monkeypatch.setattr(redis, 'rpush', rpush)
+    persistence.save_test(uuid.uuid4(), 'http://example.com/1mb.bin', 1.5, '{}')
+    monkeypatch.undo()
+
+    assert redis.llen(persistence.PENDING_KEY) == 0
+    assert persistence.replay_spill() == 1
+    assert redis.llen(persistence.PENDING_KEY) == 1
+    assert persistence.replay_spill() == 0
+
+
+def test_spill_appends_to_file_of_process(app, redis):
+    records = make_records(3)
+    persistence.spill(records[:2])
+    persistence.spill(records[2:])
+
+    assert persistence.replay_spill() == 3
+    assert redis.lrange(persistence.PENDING_KEY, 0, -1) == records
@@ -0,0 +1,114 @@
+from app.main.source_cache import SourceCache
+import asyncio
+import pytest
+
+
+@pytest.fixture
+def cache(app, redis):
+    return SourceCache(ttl=60)
+
+
+@pytest.fixture
+def deleted():
+    return []
+
+
+def expire(redis, file_name):
+    redis.hset(f'{SourceCache.entry_prefix}{file_name}', 'created', 0)
+
+
+def test_make_key_requires_validators():
+    assert SourceCache.make_key('http://example.com/1mb.bin', {'size': '10'}) is None
+    assert SourceCache.make_key('http://example.com/1mb.bin', {'etag': 'a'}) != SourceCache.make_key('http://example.com/1mb.bin', {'etag': 'b'})
+
+
+def test_acquire_takes_reference(cache):
+    assert cache.acquire('key') is None
+
+    cache.add('key', 'http://example.com/1mb.bin', 'first', 1024, 'DE:1')
+    entry = cache.acquire('key')
+
+    assert entry['file_name'] == 'first'
+    assert entry['file_size'] == 1024
+    assert entry['refs'] == 2
+
+
+def test_expired_entry_is_not_served(cache, redis):
+    cache.add('key', 'http://example.com/1mb.bin', 'first', 1024, 'DE:1')
+    expire(redis, 'first')
+
+    assert cache.acquire('key') is None
+
+
+def test_evict_keeps_referenced_entries(cache, redis, deleted):
+    cache.add('key', 'http://example.com/1mb.bin', 'first', 1024, 'DE:1')
+    expire(redis, 'first')
+
+    assert cache.evict(deleted.append) == 0
+
+    cache.release('first')
+    assert cache.evict(deleted.append) == 1
+    assert deleted == ['first']
+    assert not redis.exists(f'{SourceCache.current_prefix}key')
+
+
+def test_evict_keeps_fresh_unreferenced_entry(cache, deleted):
+    cache.add('key', 'http://example.com/1mb.bin', 'first', 1024, 'DE:1')
+    cache.release('first')
+
+    assert cache.evict(deleted.append) == 0
+    assert cache.acquire('key')['file_name'] == 'first'
+
+
+def test_replaced_entry_is_kept_until_released(cache, redis, deleted):
+    cache.add('key', 'http://example.com/1mb.bin', 'first', 1024, 'DE:1')
+    expire(redis, 'first')
+    assert cache.acquire('key') is None
+
+    # source replicated again while the first test still downloads the old file
+    cache.add('key', 'http://example.com/1mb.bin', 'second', 1024, 'DE:1')
+    assert cache.evict(deleted.append) == 0
+
+    # release goes to the entry the reference was taken on
+    cache.release('first')
+    assert cache._get('second')['refs'] == 1
+
+    assert cache.evict(deleted.append) == 1
+    assert deleted == ['first']
+    assert cache.acquire('key')['file_name'] == 'second'
+
+
+def test_late_release_doesnt_recreate_evicted_entry(cache, redis, deleted):
+    cache.add('key', 'http://example.com/1mb.bin', 'first', 1024, 'DE:1')
+    expire(redis, 'first')
+    cache.release('first')
+    cache.evict(deleted.append)
+
+    cache.release('first')
+
+    assert not redis.exists(f'{SourceCache.entry_prefix}first')
+
+
+def test_failed_delete_keeps_entry(cache, redis):
+    cache.add('key', 'http://example.com/1mb.bin', 'first', 1024, 'DE:1')
+    expire(redis, 'first')
+    cache.release('first')
+
+    def delete_object(file_name):
+        raise OSError('storage is down')
+
+    assert cache.evict(delete_object) == 0
+    assert redis.exists(f'{SourceCache.entry_prefix}first')
+
+
+def test_evict_skips_locked_key(cache, redis, deleted):
+    cache.add('key', 'http://example.com/1mb.bin', 'first', 1024, 'DE:1')
+    expire(redis, 'first')
+    cache.release('first')
+
+    lock = asyncio.run(cache.lock('key'))
+    try:
+        assert cache.evict(deleted.append) == 0
+    finally:
+        lock.release()
+    assert cache.evict(deleted.append) == 1
@@ -0,0 +1,102 @@
+from app.extensions import db
+from app.main import registry
+from app.models.vps import Vps
+import datetime
+import asyncio
+import pytest
+
+
+@pytest.fixture
+def vps(app):
+    app.config['CIRCUIT_FAILURE_THRESHOLD'] = 3
+    app.config['CIRCUIT_COOLDOWN'] = 60
+    vps = Vps(name='vps_1', url='http://10.10.10.10:5000', enabled=True, failures=0)
+    db.session.add(vps)
+    db.session.commit()
+    return vps
+
+
+def cool_down(vps):
+    vps.circuit_open_until = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(seconds=1)
+    db.session.commit()
+
+
+def test_circuit_opens_at_threshold(vps):
+    vps.record_failure()
+    vps.record_failure()
+    assert not vps.circuit_open
+
+    vps.record_failure()
+    assert vps.circuit_open
+    assert vps.failures == 3
+
+
+def test_half_open_circuit_reopens_on_failure(vps):
+    for _ in range(3):
+        vps.record_failure()
+    cool_down(vps)
+
+    # one attempt is let through after cooldown
+    assert not vps.circuit_open
+
+    vps.record_failure()
+    assert vps.circuit_open
+
+
+def test_half_open_circuit_closes_on_success(vps):
+    for _ in range(3):
+        vps.record_failure()
+    cool_down(vps)
+
+    vps.record_success()
+    assert not vps.circuit_open
+    assert vps.circuit_open_until is None
+    assert vps.failures == 0
+
+    vps.record_failure()
+    assert not vps.circuit_open
+
+
+def test_get_urls_skips_disabled(app, vps):
+    db.session.add(Vps(name='vps_2', url='http://10.10.10.11:5000', enabled=False, failures=0))
+    db.session.commit()
+
+    assert Vps.get_urls() == {'vps_1': 'http://10.10.10.10:5000'}
+
+
+def test_deleted_vps_are_not_seeded_again(app, vps):
+    app.config['VPS_URLS'] = {'vps_1': 'http://10.10.10.10:5000'}
+    client = app.test_client()
+
+    assert client.delete('/api/vps/vps_1').status_code == 200
+    assert Vps.get_urls() == {}
+    assert client.get('/api/vps').json == {'vps': []}
+
+
+def test_add_vps_rejects_non_bool_enabled(app):
+    client = app.test_client()
+
+    resp = client.post('/api/vps', json={'name': 'vps_1', 'url': 'http://10.10.10.10:5000', 'enabled': 'false'})
+    assert resp.status_code == 400
+    assert db.session.get(Vps, 'vps_1') is None
+
+    resp = client.post('/api/vps', json={'name': 'vps_1', 'url': 'http://10.10.10.10:5000/', 'enabled': False})
+    assert resp.status_code == 200
+    assert resp.json['url'] == 'http://10.10.10.10:5000'
+    assert resp.json['enabled'] is False
+
+
+def test_probe_all_updates_health(app, vps, monkeypatch):
+    db.session.add(Vps(name='vps_2', url='http://10.10.10.11:5000', enabled=True, failures=0))
+    db.session.commit()
+
+    async def probe_vps(session, vps_url):
+        if vps_url.endswith('11:5000'):
+            raise ConnectionError('refused')
+        return 12.5
+
+    monkeypatch.setattr(registry, 'probe_vps', probe_vps)
+
+    assert asyncio.run(registry.probe_all()) == {'vps_1': 12.5, 'vps_2': None}
+    assert db.session.get(Vps, 'vps_1').rtt == 12.5
+    assert db.session.get(Vps, 'vps_2').failures == 1